@@ -1,12 +1,21 @@
 # Assuming you have not changed the general structure of the template no modification is needed in this file.
+import sys, time
+
+# Time spent importing the add-in at Fusion launch, reported by run()
+_importStart = time.perf_counter()
+_moduleCount = len(sys.modules)
 from . import commands
 from .lib import fusion360utils as futil
+_importTime = time.perf_counter() - _importStart
+_importedModules = len(sys.modules) - _moduleCount
 
 
 def run(context):
     try:
         # This will run the start function in each of your commands as defined in commands/__init__.py
+        startTime = time.perf_counter()
         commands.start()
+        startupReport(time.perf_counter() - startTime)
 
     except:
         futil.handle_error('run' + context["IsApplicationStartup"])
@@ -21,4 +30,15 @@ def stop(context):
         commands.stop()
 
     except:
-        futil.handle_error('stop')
\ No newline at end of file
+        futil.handle_error('stop')
+
+
+# Log what the add-in costs at Fusion launch
+def startupReport(startTime: float):
+    report = [f'Startup: import {_importTime*1000:.1f} ms ({_importedModules} modules), start {startTime*1000:.1f} ms']
+    for name, seconds in commands.startTimes.items():
+        report.append(f'  {name}: {seconds*1000:.1f} ms')
+    heavy = [name for name in ('PIL', 'numpy') if any(module == name or module.endswith('.'+name) for module in sys.modules)]
+    if heavy:
+        report.append(f'  Loaded at startup: {", ".join(heavy)}')
+    futil.log('\n'.join(report))
@@ -0,0 +1,172 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from . import tiles
+
+# Automatic choice of the modelling engine.
+# The depth histogram is taken from the whole image, it is cheap and gives
+# the cut pixels and distinct depths exactly. Regions are estimated from bands
+# of full rows, since a region spans as much of a row and as many rows as its
+# depth level does. Tile uniqueness per tile size is taken from a grid of small
+# windows, so repetition is seen at the scale it is modelled at. The counts
+# are priced with a simple cost model, the cheapest engine available for the
+# backend wins.
+#
+# Layers is never chosen automatically, it quantizes the depths.
+
+TEMPORARY_BODIES = 'temporary bodies'
+SKETCH_FEATURES = 'sketch features'
+
+WINDOW_SIZE = 64
+WINDOW_GRID = 3
+TILE_SIZES = (4, 8, 16)
+# Full rows sampled for the region estimate, in bands spread over the image height
+ROW_BANDS = 8
+ROW_SAMPLE_PIXELS = WINDOW_SIZE*WINDOW_SIZE*WINDOW_GRID*WINDOW_GRID
+
+# Cost of the modelling operations relative to one box unioned into the tool body
+BOX_COST = 1.0
+# Copy and move of a tile instance, its union is priced separately
+INSTANCE_COST = 0.3
+UNION_COST = 1.0
+# Planning one pixel into regions, plain Python
+PLAN_COST = 0.0001
+# A pixel of the sketch line grid: its profile and the two measurements mapping it to its pixel
+SKETCH_PIXEL_COST = 0.4
+# A region rectangle: four sketch lines and its profile
+SKETCH_RECTANGLE_COST = 0.6
+EXTRUDE_COST = 25.0
+# Rough time of one cost unit, only used for reporting
+SECONDS_PER_UNIT = 0.01
+
+
+@dataclass(frozen=True)
+class ImageStatistics:
+	pixelCount: int
+	# Pixels of the tile windows
+	sampledPixels: int
+	cutFraction: float
+	distinctDepths: int
+	regionsPerPixel: float
+	# Tile size -> (unique tile runs per pixel, tile instances per pixel)
+	tileRates: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class EngineChoice:
+	engine: str
+	tileSize: int
+	predictedCost: float
+	# Candidate -> predicted cost
+	costs: dict
+	statistics: ImageStatistics
+
+	def describe(self) -> str:
+		s = self.statistics
+		candidates = ', '.join(f'{name} {cost:.0f}' for name, cost in sorted(self.costs.items(), key=lambda item: item[1]))
+		return (f'Auto engine: {self.engine}' + (f' ({self.tileSize}px tiles)' if self.engine == 'Tiles' else '') +
+			f', predicted cost {self.predictedCost:.0f} (~{self.predictedCost*SECONDS_PER_UNIT:.0f}s)\n'
+			f'\tCandidates: {candidates}\n'
+			f'\t{s.pixelCount} px: {s.cutFraction:.0%} cut, {s.distinctDepths} depths, {s.regionsPerPixel*s.pixelCount:.0f} regions, '
+			f'tiles sampled from {s.sampledPixels} px')
+
+
+# Statistics of pixels (shades, rows from the bottom up) cut with the depth lookup table lut
+def imageStatistics(pixels, lut: list, imageWidth: int, imageHeight: int) -> ImageStatistics:
+	pixelCount = imageWidth*imageHeight
+	histogram = Counter(pixels)
+	cut = sum(count for shade, count in histogram.items() if lut[shade] > 0)
+	distinct = len(set(lut[shade] for shade in histogram if lut[shade] > 0))
+	regions = estimateRegions(pixels, lut, imageWidth, imageHeight)
+
+	# Windows stacked on top of each other, tiles never span two windows
+	if imageWidth < WINDOW_SIZE*WINDOW_GRID or imageHeight < WINDOW_SIZE*WINDOW_GRID:
+		sample, sampleWidth, sampleHeight = pixels, imageWidth, imageHeight
+	else:
+		sample = []
+		for j in range(WINDOW_GRID):
+			y0 = (imageHeight-WINDOW_SIZE)*j//(WINDOW_GRID-1)
+			for i in range(WINDOW_GRID):
+				x0 = (imageWidth-WINDOW_SIZE)*i//(WINDOW_GRID-1)
+				for y in range(y0, y0+WINDOW_SIZE):
+					sample.extend(pixels[y*imageWidth+x0:y*imageWidth+x0+WINDOW_SIZE])
+		sampleWidth, sampleHeight = WINDOW_SIZE, WINDOW_SIZE*WINDOW_GRID*WINDOW_GRID
+	sampledPixels = sampleWidth*sampleHeight
+	tileRates = {}
+	for tileSize in TILE_SIZES:
+		uniqueTiles = tiles.uniqueTiles(sample, lut, sampleWidth, sampleHeight, tileSize)
+		tileRates[tileSize] = (sum(len(runs) for runs, _ in uniqueTiles)/sampledPixels, sum(len(positions) for _, positions in uniqueTiles)/sampledPixels)
+
+	return ImageStatistics(pixelCount, sampledPixels, cut/pixelCount, distinct, regions/pixelCount, tileRates)
+
+
+# Estimated number of regions of the plan of pixels.
+# A region starts wherever a run of one depth level does not continue the identical run of the
+# row below, as in plan.GeometryPlan.planRows. The starts are counted exactly in the bottom row and
+# in bands of full rows, each row against the one below it, and scaled to the image height.
+# A level spanning a band of rows and the full width is a single region, however large it is.
+def estimateRegions(pixels, lut: list, imageWidth: int, imageHeight: int) -> float:
+	def runs(y: int) -> set:
+		row = [lut[shade] for shade in pixels[y*imageWidth:(y+1)*imageWidth]]
+		result = set()
+		x = 0
+		while x < imageWidth:
+			end = x+1
+			while end < imageWidth and row[end] == row[x]:
+				end += 1
+			if row[x] > 0:
+				result.add((x, end, row[x]))
+			x = end
+		return result
+
+	bottom = runs(0)
+	if imageHeight == 1:
+		return len(bottom)
+	sampledRows = min(imageHeight-1, max(ROW_BANDS, ROW_SAMPLE_PIXELS//imageWidth))
+	if sampledRows == imageHeight-1:
+		bands = [(1, imageHeight)]
+	else:
+		bandRows = max(1, sampledRows//ROW_BANDS)
+		bands = [(y0, y0+bandRows) for y0 in (1+(imageHeight-1-bandRows)*k//(ROW_BANDS-1) for k in range(ROW_BANDS))]
+	starts = 0
+	rows = 0
+	for y0, y1 in bands:
+		below = bottom if y0 == 1 else runs(y0-1)
+		for y in range(y0, y1):
+			current = runs(y)
+			starts += len(current-below)
+			below = current
+		rows += y1-y0
+	return len(bottom) + starts/rows*(imageHeight-1)
+
+
+# Predicted cost of every engine available for backend.
+# Pixels models every cut pixel, Regions plans all pixels first and then models every region.
+# Pixels wins where the regions do not merge pixels, e.g. dithered or noisy images.
+# Layers is left out on purpose: it quantizes the depths to the layer count,
+# which makes a different model rather than a cheaper way to the same one.
+def engineCosts(statistics: ImageStatistics, backend: str) -> dict:
+	n = statistics.pixelCount
+	regions = statistics.regionsPerPixel*n
+	if backend == SKETCH_FEATURES:
+		extrudes = statistics.distinctDepths*EXTRUDE_COST
+		return {
+			'Pixels': n*SKETCH_PIXEL_COST + extrudes,
+			'Regions': n*PLAN_COST + regions*SKETCH_RECTANGLE_COST + extrudes,
+		}
+	costs = {
+		'Pixels': statistics.cutFraction*n*BOX_COST,
+		'Regions': n*PLAN_COST + regions*BOX_COST,
+	}
+	# Every tile instance is unioned on its own, there is no combine of many bodies at once
+	for tileSize, (runsPerPixel, instancesPerPixel) in statistics.tileRates.items():
+		costs[f'Tiles {tileSize}'] = runsPerPixel*n*BOX_COST + instancesPerPixel*n*(INSTANCE_COST+UNION_COST)
+	return costs
+
+
+# Cheapest engine for pixels on backend (TEMPORARY_BODIES or SKETCH_FEATURES)
+def chooseEngine(pixels, lut: list, imageWidth: int, imageHeight: int, backend: str) -> EngineChoice:
+	statistics = imageStatistics(pixels, lut, imageWidth, imageHeight)
+	costs = engineCosts(statistics, backend)
+	candidate = min(costs, key=lambda name: (costs[name], name))
+	engine, _, tileSize = candidate.partition(' ')
+	return EngineChoice(engine, int(tileSize) if tileSize else tiles.TILE_SIZE, costs[candidate], costs, statistics)
@@ -0,0 +1,123 @@
+import os, json, time, hashlib
+
+# Disk cache of generated lithophane tool bodies.
+# Entries are addressed by a hash of the grayscale pixel buffer and all
+# parameters that shape the cut, and evicted least-recently-used once the
+# folder grows beyond maxBytes.
+class ResultCache:
+	INDEX_FILE = 'index.json'
+	BODY_EXTENSION = '.smt'
+
+	def __init__(self, folder: str, maxBytes: int):
+		self.folder = folder
+		self.maxBytes = maxBytes
+		self.entries = {}
+		self.statistics = {'hits': 0, 'misses': 0, 'bytesSaved': 0, 'timeSaved': 0.0}
+		self._load()
+
+	# Content address of a pixel buffer and its modelling parameters
+	@staticmethod
+	def key(pixels: bytes, params: dict) -> str:
+		digest = hashlib.sha256(pixels)
+		for name in sorted(params):
+			value = params[name]
+			if isinstance(value, float):
+				value = round(value, 6)
+			digest.update(f'|{name}={value}'.encode())
+		return digest.hexdigest()
+
+	# Path of the cached body for key, or None on a miss
+	def lookup(self, key: str):
+		entry = self.entries.get(key)
+		if entry is not None and not os.path.isfile(self._path(key)):
+			del self.entries[key]
+			entry = None
+		if entry is None:
+			self.statistics['misses'] += 1
+			self._save()
+			return None
+		entry['lastAccess'] = time.time()
+		self._save()
+		return self._path(key)
+
+	# Account a successful reuse of key that took elapsed seconds to load
+	def recordHit(self, key: str, elapsed: float):
+		entry = self.entries.get(key)
+		if entry is None:
+			return
+		self.statistics['hits'] += 1
+		self.statistics['bytesSaved'] += entry['size']
+		self.statistics['timeSaved'] += max(0.0, entry['cost'] - elapsed)
+		self._save()
+
+	# Store a body for key. exporter(path) writes the body file and returns success,
+	# cost is the time in seconds it took to generate the body.
+	def store(self, key: str, exporter, cost: float) -> bool:
+		os.makedirs(self.folder, exist_ok=True)
+		path = self._path(key)
+		if not exporter(path) or not os.path.isfile(path):
+			return False
+		self.entries[key] = {'size': os.path.getsize(path), 'cost': cost, 'lastAccess': time.time()}
+		self._evict()
+		self._save()
+		return key in self.entries
+
+	def invalidate(self, key: str):
+		self.entries.pop(key, None)
+		self._remove(key)
+		self._save()
+
+	def clear(self):
+		for key in list(self.entries):
+			self._remove(key)
+		self.entries = {}
+		self._save()
+
+	def stats(self) -> dict:
+		result = dict(self.statistics)
+		result['entries'] = len(self.entries)
+		result['bytes'] = sum(e['size'] for e in self.entries.values())
+		return result
+
+	def formatStats(self) -> str:
+		s = self.stats()
+		return (f'Hits: {s["hits"]}, Misses: {s["misses"]}\n'
+			f'Saved: {s["bytesSaved"]/1048576:.1f} MB, {s["timeSaved"]:.1f} s\n'
+			f'Stored: {s["entries"]} bodies, {s["bytes"]/1048576:.1f}/{self.maxBytes/1048576:.0f} MB')
+
+	def _path(self, key: str) -> str:
+		return os.path.join(self.folder, key+self.BODY_EXTENSION)
+
+	def _remove(self, key: str):
+		try:
+			os.remove(self._path(key))
+		except OSError:
+			pass
+
+	def _evict(self):
+		total = sum(e['size'] for e in self.entries.values())
+		for key in sorted(self.entries, key=lambda k: self.entries[k]['lastAccess']):
+			if total <= self.maxBytes:
+				break
+			total -= self.entries[key]['size']
+			del self.entries[key]
+			self._remove(key)
+
+	def _load(self):
+		try:
+			with open(os.path.join(self.folder, self.INDEX_FILE), 'r') as f:
+				data = json.load(f)
+			self.entries = data.get('entries', {})
+			self.statistics.update(data.get('stats', {}))
+		except (OSError, ValueError):
+			pass
+
+	def _save(self):
+		try:
+			os.makedirs(self.folder, exist_ok=True)
+			path = os.path.join(self.folder, self.INDEX_FILE)
+			with open(path+'.tmp', 'w') as f:
+				json.dump({'entries': self.entries, 'stats': self.statistics}, f)
+			os.replace(path+'.tmp', path)
+		except OSError:
+			pass
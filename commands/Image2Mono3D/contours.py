@@ -0,0 +1,113 @@
+# Iso-contour layers of a depth map.
+# The cut depth of every pixel is quantized to a number of cumulative layers.
+# Each layer's region is outlined with marching squares and simplified, so
+# the modelling work depends on contour complexity instead of pixel count.
+#
+# Coordinates follow the pixel convention of plan.py.
+
+
+# Layer index of every pixel, i.e. through how many layers of layerThickness it is cut
+def layerIndices(pixels, lut: list, layerThickness: float, layerCount: int) -> bytearray:
+	indices = bytearray(len(pixels))
+	shadeLayers = [min(layerCount, int(depth/layerThickness + 0.5)) if layerThickness > 0 else 0 for depth in lut]
+	for pixelIndex, shade in enumerate(pixels):
+		indices[pixelIndex] = shadeLayers[shade]
+	return indices
+
+
+# Closed polygons outlining all pixels with layers[i] >= layer.
+# Outer boundaries are counter-clockwise, holes are clockwise.
+def layerContours(layers: bytearray, width: int, height: int, layer: int, epsilon: float = 0.25) -> list:
+	mask = bytes(1 if value >= layer else 0 for value in layers)
+	return [simplifyPolygon(polygon, epsilon) for polygon in marchingSquares(mask, width, height)]
+
+
+# Marching squares on the pixel centers of a binary mask.
+# Contour points lie on the pixel boundary midpoints. Segments keep the region
+# on their left, which makes the linked loops consistently oriented.
+def marchingSquares(mask: bytes, width: int, height: int) -> list:
+	# Padded rows, so every region is closed
+	empty = bytes(width+2)
+	rows = [empty] + [b'\x00' + mask[y*width:(y+1)*width] + b'\x00' for y in range(height)] + [empty]
+
+	# Segments in doubled coordinates, start point -> end point
+	segments = {}
+	for j in range(height+1):
+		lower, upper = rows[j], rows[j+1]
+		if lower == upper and not any(lower):
+			continue
+		for i in range(width+1):
+			bl, br, tr, tl = lower[i], lower[i+1], upper[i+1], upper[i]
+			if bl == br == tr == tl:
+				continue
+			# Side midpoints and their corners in counter-clockwise order
+			sides = (
+				((2*i, 2*j-1), bl, br),
+				((2*i+1, 2*j), br, tr),
+				((2*i, 2*j+1), tr, tl),
+				((2*i-1, 2*j), tl, bl),
+			)
+			exits = [k for k in range(4) if sides[k][1] and not sides[k][2]]
+			for k in exits:
+				# Pair each exit with the next entry counter-clockwise
+				for n in range(1, 4):
+					side = sides[(k+n) % 4]
+					if not side[1] and side[2]:
+						segments[sides[k][0]] = side[0]
+						break
+
+	# Link segments to closed loops
+	polygons = []
+	while segments:
+		start, point = segments.popitem()
+		polygon = [start]
+		while point != start:
+			polygon.append(point)
+			point = segments.pop(point)
+		polygons.append([(x/2, y/2) for x, y in polygon])
+	return polygons
+
+
+# Signed area, positive for counter-clockwise polygons
+def signedArea(polygon: list) -> float:
+	area = 0.0
+	for (x0, y0), (x1, y1) in zip(polygon, polygon[1:]+polygon[:1]):
+		area += x0*y1 - x1*y0
+	return area/2
+
+
+# Douglas-Peucker simplification of a closed polygon
+def simplifyPolygon(polygon: list, epsilon: float) -> list:
+	if len(polygon) < 4 or epsilon <= 0:
+		return polygon
+	# Split at the point farthest from the first one
+	first = polygon[0]
+	split = max(range(len(polygon)), key=lambda k: (polygon[k][0]-first[0])**2 + (polygon[k][1]-first[1])**2)
+	head = _simplifyPath(polygon[:split+1], epsilon)
+	tail = _simplifyPath(polygon[split:] + [first], epsilon)
+	return head[:-1] + tail[:-1]
+
+
+def _simplifyPath(path: list, epsilon: float) -> list:
+	keep = [False]*len(path)
+	keep[0] = keep[-1] = True
+	stack = [(0, len(path)-1)]
+	while stack:
+		start, end = stack.pop()
+		(x0, y0), (x1, y1) = path[start], path[end]
+		dx, dy = x1-x0, y1-y0
+		length = (dx*dx + dy*dy)**0.5
+		farthest, distance = None, epsilon
+		for k in range(start+1, end):
+			px, py = path[k]
+			if length > 0:
+				d = abs(dy*(px-x0) - dx*(py-y0))/length
+			else:
+				d = ((px-x0)**2 + (py-y0)**2)**0.5
+			if d > distance:
+				farthest, distance = k, d
+		if farthest is not None:
+			keep[farthest] = True
+			stack.append((start, farthest))
+			stack.append((farthest, end))
+	return [point for point, kept in zip(path, keep) if kept]
@@ -1,14 +1,16 @@
 import adsk.core, adsk.fusion
-import os, traceback
-from ...lib.PIL import Image
+import os, math, traceback, time, json
+from typing import TYPE_CHECKING
 from ...lib import fusion360utils as futil
 from ... import config
+if TYPE_CHECKING:
+	from . import cache, placement, plan, scheduler, governor, recorder
+# Pillow and the other modules of the command are imported on first use,
+# so Fusion does not pay for them at startup when the command is never run.
 app = adsk.core.Application.get()
 ui = app.userInterface
 design = None
 
-warning_showed = False
-
 # TODO *** Specify the command identity information. ***
 CMD_ID = f'{config.COMPANY_NAME}_{config.ADDIN_NAME}_image2mono3d'
 CMD_NAME = 'Image to Monochrome 3D'
@@ -25,13 +27,21 @@ WORKSPACE_ID = 'FusionSolidEnvironment'
 PANEL_ID = 'SolidModifyPanel'
 COMMAND_BESIDE_ID = 'FusionShellBodyCommand'
 
+# Attribute group of the inputs stored with generated base features.
+ATTRIBUTE_GROUP = f'{config.COMPANY_NAME}_{config.ADDIN_NAME}'
+
 # Resource location for command icons, here we assume a sub folder in this directory named "resources".
 RESOURCES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', '')
 
 # Local list of event handlers used to maintain a reference so
 # they are not released and garbage collected.
 local_handlers = []
+imageLoad = None
 loadedImage = None
+resultCache = None
+topologyCache = None
+placementFrames = {}
+jobScheduler = None
 
 # Executed when add-in is run.
 def start():
@@ -68,6 +78,12 @@ def stop():
 	if command_definition:
 		command_definition.deleteMe()
 
+	# Drop queued background jobs
+	global jobScheduler
+	if jobScheduler is not None:
+		jobScheduler.stop()
+		jobScheduler = None
+
 
 # Function that is called when a user clicks the corresponding button in the UI.
 # This defines the contents of the command dialog and connects to the command related events.
@@ -75,16 +91,17 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
 	# General logging for debug.
 	futil.log(f'{CMD_NAME} Command Created Event')
 
+	from . import topology
+	global topologyCache, placementFrames
+	topologyCache = topology.TopologyCache()
+	placementFrames = {}
+
 	# https://help.autodesk.com/view/fusion360/ENU/?contextId=CommandInputs
 	inputs = args.command.commandInputs
 
 	# TODO Define the dialog for your command by adding different inputs to the command.
 	global design
 	design = adsk.fusion.Design.cast(app.activeProduct)
-	global warning_showed
-	if not warning_showed and design.designType == adsk.fusion.DesignTypes.ParametricDesignType:
-		ui.messageBox('This tool is optimized for direct design mode (Disabled History). Please consider switching mode.', 'Design Mode', adsk.core.MessageBoxButtonTypes.OKButtonType)
-		warning_showed = True
 
 	# Create image input
 	inputs.addBoolValueInput('imageSelector', 'Image', False, RESOURCES_FOLDER+"/imageSelector", False)
@@ -135,11 +152,58 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
 	minThicknessInput.isVisible = False
 	minThicknessInput.tooltip = 'Minimum Depth (Strength) of the resulting object. In Flush Mode it\'s split half-half for top/bottom.'
 
+	# Print resolution
+	initialValue = adsk.core.ValueInput.createByReal(0.04)
+	pitchInput = inputs.addDistanceValueCommandInput('pitchSelector', 'Print Resolution', initialValue)
+	pitchInput.minimumValue = 0
+	pitchInput.tooltip = 'Smallest feature size your printer reproduces, e.g. the nozzle diameter.\n\nImages with smaller pixels are resampled to this pitch before modelling, which saves most of the modelling time without visible loss. 0 keeps every pixel.'
+
 	# colorShiftCorrection
 	initialValue = adsk.core.ValueInput.createByReal(2)
 	colorShiftCorrection = inputs.addIntegerSliderCommandInput('colorShiftCorrectionSelector', 'Black/White distribution', -100, 100, False)
 	colorShiftCorrection.valueOne = 0
 
+	# Gamma
+	initialValue = adsk.core.ValueInput.createByReal(1)
+	gammaInput = inputs.addValueInput('gammaSelector', 'Gamma', '', initialValue)
+	gammaInput.tooltip = 'Gamma applied to the image shades before the Black/White distribution. Values above 1 darken the mid tones.'
+
+	# Tone curve
+	toneCurveInput = inputs.addStringValueInput('toneCurveSelector', 'Tone Curve', '')
+	toneCurveInput.tooltip = 'Optional tone curve as shade:value control points on the 0-255 scale, e.g. 0:0, 128:96, 255:255'
+
+	# Mask
+	maskInput = inputs.addDropDownCommandInput('maskSelector', 'Mask', adsk.core.DropDownStyles.TextListDropDownStyle)
+	maskInput.listItems.add('None', True)
+	maskInput.listItems.add('Alpha Channel', False)
+	maskInput.listItems.add('Mask Image', False)
+	maskInput.listItems.add('Shade Threshold', False)
+	maskInput.tooltip = 'Masked pixels are left solid and skipped by all modelling work, which saves most of the time for logos and cut-out portraits.\n\nAlpha Channel masks transparent pixels, Mask Image the dark pixels of a separate image and Shade Threshold all pixels at least as bright as the threshold.'
+	inputs.addBoolValueInput('maskImageSelector', 'Mask Image', False, RESOURCES_FOLDER+"/imageSelector", False).isVisible = False
+	stringValueInput = inputs.addStringValueInput('selectedMaskFileName', 'Selected Mask', '')
+	stringValueInput.isReadOnly = True
+	stringValueInput.isVisible = False
+	maskThresholdInput = inputs.addIntegerSliderCommandInput('maskThresholdSelector', 'Mask Threshold', 0, 255, False)
+	maskThresholdInput.valueOne = 250
+	maskThresholdInput.isVisible = False
+	maskClipInput = inputs.addBoolValueInput('maskClipSelector', 'Clip Fix Missing Body', True, '', False)
+	maskClipInput.isVisible = False
+	maskClipInput.tooltip = 'Fills the missing body below unmasked pixels only, so the lithophane keeps the shape of the mask.'
+
+	# Modelling engine
+	engineInput = inputs.addDropDownCommandInput('engineSelector', 'Engine', adsk.core.DropDownStyles.TextListDropDownStyle)
+	engineInput.listItems.add('Auto', True)
+	engineInput.listItems.add('Pixels', False)
+	engineInput.listItems.add('Layers', False)
+	engineInput.listItems.add('Tiles', False)
+	engineInput.listItems.add('Regions', False)
+	engineInput.tooltip = 'Auto samples the image for repetition, runs and edges, picks the cheapest of Pixels, Tiles and Regions and logs the predicted cost. Never picks Layers.\n\nPixels cuts every pixel to its own depth.\n\nLayers slices the image into cumulative layers of equal thickness and cuts the outline of each layer. Much faster for large images.\n\nTiles models every distinct block of pixels once and copies it to all places it occurs. Much faster for logos, patterns and QR codes. Falls back to Pixels for multiple parametric features.\n\nRegions plans the cuts first and merges neighbouring pixels of equal depth into rectangles. Fast for images with larger areas of equal shade.'
+
+	# Layer count
+	layerCountInput = inputs.addIntegerSpinnerCommandInput('layerCountSelector', 'Layers', 1, 255, 1, 16)
+	layerCountInput.isVisible = False
+	layerCountInput.tooltip = 'Number of layers the depth range is split into. Matching it to your print layers gives the best result.'
+
 	# Mode selection
 	modeInput = inputs.addBoolValueInput('modeSelector', 'Flush Surface', True, '', True)
 	modeInput.isEnabled = False
@@ -155,6 +219,24 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
 	fixBrokenInput = inputs.addBoolValueInput('fixBrokenSelector', 'Fix Missing Body', True, '', True)
 	fixBrokenInput.tooltip = 'Ensures that the whole image is rendered.\n\nTurn this off if you want to truncate the image to a given body. However, for tilted surfaces in flush mode, this might lead to revealed spots.'
 
+	# Output selection
+	outputInput = inputs.addDropDownCommandInput('outputSelector', 'Output', adsk.core.DropDownStyles.TextListDropDownStyle)
+	outputInput.listItems.add('Body', True)
+	outputInput.listItems.add('Mesh File', False)
+	outputInput.tooltip = 'Body models the lithophane into the selected body.\n\nMesh File writes it as STL or 3MF file instead, without modifying the design. Suited for very large images.'
+
+	# Fast parametric mode
+	fastParametricInput = inputs.addBoolValueInput('fastParametricSelector', 'Single Base Feature', True, '', True)
+	fastParametricInput.isVisible = design.designType == adsk.fusion.DesignTypes.ParametricDesignType
+	fastParametricInput.tooltip = 'Models the lithophane like in direct design mode and stores it in a single base feature.\n\nTurn this off to create sketch and extrude features instead, which is much slower.'
+
+	# Background execution
+	backgroundInput = inputs.addBoolValueInput('backgroundSelector', 'Run in Background', True, '', False)
+	backgroundInput.tooltip = 'Models the lithophane in short time slices after the dialog closed, so Fusion stays responsive and Cancel reacts immediately.\n\nFurther lithophanes can be started meanwhile, they are queued and run one after another. Each slice is its own undo step.'
+
+	# Result cache statistics
+	cacheStatsView = inputs.addTextBoxCommandInput('cacheStatsView', 'Result Cache', getResultCache().formatStats().replace('\n', '<br>'), 3, True)
+
 	support = inputs.addBoolValueInput('supportDevSelector', 'Support the Dev', False, RESOURCES_FOLDER+"/supportDev", False)
 
 	# TODO Connect to the events that are needed by this command.
@@ -170,17 +252,40 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
 # is immediately called after the created event not command inputs were created for the dialog.
 def command_execute(args: adsk.core.CommandEventArgs):
 	# General logging for debug.
-	if design.designType == adsk.fusion.DesignTypes.DirectDesignType:
-		command_executeDirect(args)
+	outputInput = adsk.core.DropDownCommandInput.cast(args.command.commandInputs.itemById('outputSelector'))
+	fastParametricInput = adsk.core.BoolValueCommandInput.cast(args.command.commandInputs.itemById('fastParametricSelector'))
+	backgroundInput = adsk.core.BoolValueCommandInput.cast(args.command.commandInputs.itemById('backgroundSelector'))
+	if outputInput.selectedItem.name == 'Mesh File':
+		command_executeMesh(args)
+		return
+
+	isBackground = backgroundInput.value
+	if design.designType == adsk.fusion.DesignTypes.DirectDesignType or fastParametricInput.value:
+		steps = executeDirectSteps(args, isBackground)
+	else:
+		steps = executeParametricSteps(args, isBackground)
+
+	if isBackground:
+		# Run the setup while the inputs are valid, the modelling continues in time slices
+		from . import scheduler
+		next(steps, None)
+		getScheduler().submit(scheduler.Job(CMD_NAME, steps))
 	else:
-		command_executeParametric(args)
+		for _ in steps:
+			pass
 
 
-def command_executeParametric(args: adsk.core.CommandEventArgs):
+# Models the lithophane with sketch and extrude features.
+# Yields after every unit of work, see command_execute.
+def executeParametricSteps(args: adsk.core.CommandEventArgs, isBackground: bool):
 	# General logging for debug.
 	futil.log(f'{CMD_NAME} Command Execute Parametric Event')
+	from ...lib.PIL import Image
+	from . import loader, recorder, shading
 	# Get a reference to your command's inputs.
 	inputs = args.command.commandInputs
+	# Background jobs outlive the command, a later command replaces the global design
+	rootComponent = design.rootComponent
 
 	# TODO ******************************** Your code here ********************************
 
@@ -189,60 +294,88 @@ def command_executeParametric(args: adsk.core.CommandEventArgs):
 	
 	faceSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('faceSelector'))
 	baseSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('baseSelector'))
-	edgeSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('heightEdgeSelector'))
-	heightInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('heightSelector'))
 	modeInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('modeSelector'))
 	fixBrokenInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('fixBrokenSelector'))
 	minThicknessInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('minThicknessSelector'))
 	flushBTInput = adsk.core.ValueCommandInput.cast(inputs.itemById('flushBTSelector'))
-	colorShiftCorrectionInput = adsk.core.IntegerSliderCommandInput.cast(inputs.itemById('colorShiftCorrectionSelector'))
 
 	face = adsk.fusion.BRepFace.cast(faceSelectorInput.selection(0).entity)
 	base = adsk.fusion.BRepEdge.cast(baseSelectorInput.selection(0).entity)
 
-	progressDialog = ui.createProgressDialog()
-	progressDialog.cancelButtonText = 'Cancel'
-	progressDialog.isBackgroundTranslucent = False
-	progressDialog.isCancelButtonShown = True
+	# Input values, the inputs are gone once a background job continues after the command closed
+	isFlush = modeInput.value
+	fixBroken = fixBrokenInput.value
+	minThickness = minThicknessInput.value
+	flushBT = flushBTInput.value
 
 	if face is None or base is None:
 		return
 
 	global loadedImage
-	if loadedImage is None or not len(fileName) > 0:
+	if not len(fileName) > 0 or not awaitImage(args):
 		return
 	
 	try:
-		
+		loadedImage = resampleForPrint(inputs, base, loadedImage)
 		image = loadedImage
 		imageWidth, imageHeight = image.size
 		
 		# Load image
+		maskImage = getMask(inputs, loadedImage)
 		loadedImage = loadedImage.transpose(Image.FLIP_TOP_BOTTOM)
 		imageAsLine = list(loadedImage.getdata())
 		futil.log('Image Raw: '+str(imageAsLine))
+		maskRegions = None
+		if maskImage is not None:
+			maskImage = maskImage.transpose(Image.FLIP_TOP_BOTTOM)
+			imageAsLine = shading.applyMask(imageAsLine, maskImage.tobytes(), loader.shadeLevels(loadedImage))
+			if fixBroken and adsk.core.BoolValueCommandInput.cast(inputs.itemById('maskClipSelector')).value:
+				maskRegions = getMaskRegions(maskImage)
 		
 		if imageWidth*imageHeight > 2500 and ui.messageBox(f'This process can take several minutes depending on the size of the image.\nContinue?\n\nPixels to be processed: {imageWidth*imageHeight}','Expensive Operations Warning', adsk.core.MessageBoxButtonTypes.OKCancelButtonType) != adsk.core.DialogResults.DialogOK:
 			return
 
-		progressDialog.show('Generating Mono3D', 'Loading...', 0, 100, 0)
+		frame = getPlacementFrame(inputs, face, base, imageWidth, imageHeight)
+		cmPerPixel = frame.cmPerPixel
 		
-		widthInputValue = base.length
-		cmPerPixel = (widthInputValue/imageWidth, 0)
+		pixelHeightVector = frame.pixelHeightVector
+		pixelWidthVector = frame.pixelWidthVector
 
-		heightInputValue = cmPerPixel[0]*imageHeight
-		if edgeSelectorInput.isVisible:
-			edge = adsk.fusion.BRepEdge.cast(edgeSelectorInput.selection(0).entity)
-			heightInputValue = edge.length
-		elif heightInput.isVisible:
-			heightInputValue = heightInput.value
+		depth = frame.depth(minThickness)
+		futil.log(f'Depth: {depth}')
+
+		if minThickness >= depth:
+			raise Warning('Minimum Depth exceeds object depth.')
+
+		faceNormal = frame.faceNormal
+
+		depthLut = getDepthLut(inputs, depth-minThickness, loader.shadeLevels(loadedImage))
+		engine = getEngine(inputs)
+		layerCount = getLayerCount(inputs)
+		geometryPlan = createGeometryPlan(imageWidth, imageHeight, depth, minThickness, isFlush, fixBroken, maskRegions, flushBT, cmPerPixel)
+	except Exception:
+		futil.log(f'Exception caught: {traceback.format_exc()}')
+		reportFailure(args, 'Error processing design.\n\n\n\n'+traceback.format_exc(), isBackground)
+		return
+
+	# All inputs are read, the remaining work may continue in time slices.
+	# Nothing is shown or changed before, a queued job starts when the scheduler runs it.
+	yield
+
+	progressDialog = ui.createProgressDialog()
+	progressDialog.cancelButtonText = 'Cancel'
+	progressDialog.isBackgroundTranslucent = False
+	progressDialog.isCancelButtonShown = True
 
-		cmPerPixel = (cmPerPixel[0], heightInputValue/imageHeight)
+	trace = startRecording()
+	try:
+		progressDialog = recorder.wrap(trace, progressDialog, 'ProgressDialog')
+		progressDialog.show('Generating Mono3D', 'Loading...', 0, 100, 0)
 		
 		# Create new sketch, obtain creation objects
-		sketch = design.rootComponent.sketches.add(face)
-		sketchLines = sketch.sketchCurves.sketchLines
-		extrudes = design.rootComponent.features.extrudeFeatures
+		sketch = rootComponent.sketches.add(face)
+		sketchLines = recorder.wrap(trace, sketch.sketchCurves.sketchLines, 'SketchLines')
+		extrudes = recorder.wrap(trace, rootComponent.features.extrudeFeatures, 'ExtrudeFeatures')
 		# Outline Image region width
 		baseSketchLine: adsk.fusion.SketchLine = sketch.project(base)[0]
 
@@ -274,27 +407,6 @@ def command_executeParametric(args: adsk.core.CommandEventArgs):
 		tv.add(mv)
 
 		heightSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, tv.asPoint())
-		
-		pixelFHeightVector = heightSketchLine.startSketchPoint.worldGeometry.vectorTo(heightSketchLine.endSketchPoint.worldGeometry)
-		pixelFWidthVector = baseSketchLine.startSketchPoint.worldGeometry.vectorTo(baseSketchLine.endSketchPoint.worldGeometry)
-		
-		pixelHeightVector = pixelFHeightVector.copy()
-		pixelHeightVector.scaleBy(1/imageHeight)
-		pixelWidthVector = pixelFWidthVector.copy()
-		pixelWidthVector.scaleBy(1/imageWidth)
-
-		pixelOnePV = origin.worldGeometry.asVector()
-		pixelOnePV.add(pixelHeightVector)
-		pixelOnePV.add(pixelWidthVector)
-		depthPoint, depth = getDepthPoint(face, pixelOnePV.asPoint())
-		depth = minThicknessInput.value+0.1 if depthPoint is None else depth
-		futil.log(f'Depth: {depth}')
-
-		if minThicknessInput.value >= depth:
-			raise Warning('Minimum Depth exceeds object depth.')
-
-		faceNormal = face.evaluator.getNormalAtPoint(origin.worldGeometry)[1]
-		faceNormal.normalize()
 
 		# Outline Image depth
 		nv = faceNormal.copy()
@@ -304,21 +416,20 @@ def command_executeParametric(args: adsk.core.CommandEventArgs):
 		depthSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, tv.asPoint())
 		sketch.isVisible = False
 
+
+		engine, tileSize = chooseEngine(engine, imageAsLine, depthLut, imageWidth, imageHeight, 'sketch features')
 	
-		# fixBroken
-		if fixBrokenInput.value and not progressDialog.wasCancelled:
-			
-			# Create boundaries
-			tv = origin.geometry.asVector()
-			mv = sketchWidthVector.copy()
-			mv.scaleBy(imageWidth)
-			tv.add(mv)
-			mv = sketchHeightVector.copy()
-			mv.scaleBy(imageHeight)
-			tv.add(mv)
-
-			tlines = sketchLines.addThreePointRectangle(origin, widthEndPoint, tv.asPoint())
-			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in sketch.profiles])
+		# Image boundary, kept apart from the pixel grid so border features only see a single profile.
+		# Only created when needed, like in the direct path.
+		outlineSketch = None
+
+		# fixBroken, clipped to the mask if requested
+		if geometryPlan.slabs() and not progressDialog.wasCancelled:
+			if geometryPlan.fillsImage():
+				slabSketch = outlineSketch = createOutlineSketch(rootComponent, face, frame)
+			else:
+				slabSketch = createRegionSketch(trace, rootComponent, face, frame, geometryPlan.slabs())
+			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in slabSketch.profiles])
 			extrudeInput = extrudes.createInput(outlineProfiles, adsk.fusion.FeatureOperations.JoinFeatureOperation)
 			extrudeInput.participantBodies = []
 			extrudeInput.isSolid = True
@@ -326,121 +437,170 @@ def command_executeParametric(args: adsk.core.CommandEventArgs):
 			extrudes.add(extrudeInput)
 
 
-		# Create Pattern
-		startXPattern = (imageWidth > imageHeight)
-		progressDialog.message = 'Sketching: %p% - %v/%m'
-		for i in range(2):
-			if startXPattern:
-				progressDialog.maximumValue = imageWidth
-				iv1 = origin.geometry.asVector()
-				for l in range(imageWidth):
-					if progressDialog.wasCancelled:
-						break
-					iv1.add(sketchWidthVector)
-					iv2 = iv1.copy()
-					iv2.add(sketchFHeightVector)
-					sketchLines.addByTwoPoints(iv1.asPoint(), iv2.asPoint())
-					progressDialog.progressValue = l+1
-			
-			else:
-				progressDialog.maximumValue = imageHeight
-				iv1 = origin.geometry.asVector()
-				for l in range(imageHeight):
-					if progressDialog.wasCancelled:
-						break
-					iv1.add(sketchHeightVector)
-					iv2 = iv1.copy()
-					iv2.add(sketchFWidthVector)
-					sketchLine = sketchLines.addByTwoPoints(iv1.asPoint(), iv2.asPoint())
-					progressDialog.progressValue = l+1
-					
-			startXPattern = not startXPattern
-
-		# Map Profiles
-		measureMgr = app.measureManager	
-		
-		colorProfileMapping = {}
-
-		progressDialog.message = 'Mapping Pixels: %p% - %v/%m'
-		progressDialog.maximumValue = sketch.profiles.count
-		for i, p in enumerate(sketch.profiles):
-			if progressDialog.wasCancelled:
-				break
-			pMidPoint = getPoint3DMidPoint(p.boundingBox.minPoint, p.boundingBox.maxPoint)
-			pHI = int(measureMgr.measureMinimumDistance(baseSketchLine.geometry, pMidPoint).value / cmPerPixel[1])
-			pWI = int(measureMgr.measureMinimumDistance(heightSketchLine.geometry, pMidPoint).value / cmPerPixel[0])
-			pixelIndex = pHI*imageWidth + pWI
-			futil.log(f'{i}/{sketch.profiles.count}: PixelIndex: {pWI}|{pHI} - {pixelIndex} -> {-pixelIndex/(imageHeight*imageWidth)*depth}\n{measureMgr.measureMinimumDistance(heightSketchLine.geometry, pMidPoint).value}')
-			if pixelIndex > imageHeight*imageWidth:
-				futil.log('HERE')#raise Exception(f'HERE {imageWidth}:{imageHeight}')
-			else:
-				colorProfileMapping.setdefault(imageAsLine[pixelIndex], []).append(p)
-			progressDialog.progressValue = i+1
-
-		# Extruding
-		progressDialog.message = 'Extruding: %p% - %v/%m shades'
-		progressDialog.maximumValue = 256
-
-		futil.log(f'Depth: {depth}')
-
-		# Iterate through color spectrum
-		for e in range(256):
-			if progressDialog.wasCancelled:
-				break
-			if e not in colorProfileMapping:
-				continue
-
-			extrudeProfiles = adsk.core.ObjectCollection.createWithArray(colorProfileMapping[e])
-
-			shiftCorrection = max(min(255, e + colorShiftCorrectionInput.valueOne*0.01*255), 0)
-			pixelDistance = (depth-minThicknessInput.value)/255*shiftCorrection
-			futil.log(f'PixelGroup: {e} Distance: {pixelDistance}')
-			futil.log(f'\tPixels: {len(colorProfileMapping[e])}')
-
-			if pixelDistance == 0:
-				continue
-
-			extrudeInput = extrudes.createInput(extrudeProfiles, adsk.fusion.FeatureOperations.CutFeatureOperation)
-			extrudeInput.participantBodies = [face.body]
-			extrudeInput.isSolid = True
-			if not modeInput.value: # NOT FLUSH
-				extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(pixelDistance)), adsk.fusion.ExtentDirections.NegativeExtentDirection)
-				exf = extrudes.add(extrudeInput)
+		if engine == 'Layers':
+			for exf in extrudeLayers(trace, rootComponent, face, adsk.fusion.FeatureOperations.CutFeatureOperation, [face.body], origin.worldGeometry, pixelWidthVector, pixelHeightVector, imageAsLine, imageWidth, imageHeight, depthLut, depth, minThickness, isFlush, layerCount, progressDialog):
 				if exf.healthState == adsk.fusion.FeatureHealthStates.WarningFeatureHealthState:
 					exf.deleteMe()
-
-			else: # FLUSH
-				extrudeInput.startExtent = adsk.fusion.OffsetStartDefinition.create(adsk.core.ValueInput.createByReal(-(depth-minThicknessInput.value/2)))
-				extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(pixelDistance)), adsk.fusion.ExtentDirections.PositiveExtentDirection)
-				exf = extrudes.add(extrudeInput)
+				yield
+
+		elif engine == 'Regions':
+			from . import plan
+			geometryPlan.planRows(plan.pixelRows(imageAsLine, imageWidth, imageHeight), depthLut)
+			futil.log(f'Plan: {len(geometryPlan)} regions for {geometryPlan.pixelCount()} pixels')
+
+			# One sketch of rectangles and one extrude per depth
+			progressDialog.message = 'Extruding: %p% - %v/%m regions'
+			progressDialog.maximumValue = len(geometryPlan)
+			progressDialog.progressValue = 0
+			for pixelDistance, rects in geometryPlan.byDepth().items():
+				if progressDialog.wasCancelled:
+					break
+				regionSketch = createRegionSketch(trace, rootComponent, face, frame, rects)
+				exf = None
+				try:
+					progressDialog.progressValue += len(rects)
+					yield
+
+					extrudeProfiles = adsk.core.ObjectCollection.createWithArray([x for x in regionSketch.profiles])
+					extrudeInput = extrudes.createInput(extrudeProfiles, adsk.fusion.FeatureOperations.CutFeatureOperation)
+					extrudeInput.participantBodies = [face.body]
+					extrudeInput.isSolid = True
+					if not isFlush: # NOT FLUSH
+						extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(pixelDistance)), adsk.fusion.ExtentDirections.NegativeExtentDirection)
+					else: # FLUSH
+						extrudeInput.startExtent = adsk.fusion.OffsetStartDefinition.create(adsk.core.ValueInput.createByReal(-(depth-minThickness/2)))
+						extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(pixelDistance)), adsk.fusion.ExtentDirections.PositiveExtentDirection)
+					exf = extrudes.add(extrudeInput)
+				finally:
+					# The sketch of a depth whose extrude was cancelled or failed is not left behind
+					if exf is None:
+						regionSketch.deleteMe()
 				if exf.healthState == adsk.fusion.FeatureHealthStates.WarningFeatureHealthState:
 					exf.deleteMe()
+				yield
+
+		else:
+			# Create Pattern
+			startXPattern = (imageWidth > imageHeight)
+			progressDialog.message = 'Sketching: %p% - %v/%m'
+			for i in range(2):
+				if startXPattern:
+					progressDialog.maximumValue = imageWidth
+					iv1 = origin.geometry.asVector()
+					for l in range(imageWidth):
+						if progressDialog.wasCancelled:
+							break
+						iv1.add(sketchWidthVector)
+						iv2 = iv1.copy()
+						iv2.add(sketchFHeightVector)
+						sketchLines.addByTwoPoints(iv1.asPoint(), iv2.asPoint())
+						progressDialog.progressValue = l+1
+						yield
+			
+				else:
+					progressDialog.maximumValue = imageHeight
+					iv1 = origin.geometry.asVector()
+					for l in range(imageHeight):
+						if progressDialog.wasCancelled:
+							break
+						iv1.add(sketchHeightVector)
+						iv2 = iv1.copy()
+						iv2.add(sketchFWidthVector)
+						sketchLine = sketchLines.addByTwoPoints(iv1.asPoint(), iv2.asPoint())
+						progressDialog.progressValue = l+1
+						yield
+					
+				startXPattern = not startXPattern
 
-			progressDialog.progressValue = e+1
+			# Map Profiles
+			measureMgr = recorder.wrap(trace, app.measureManager, 'MeasureManager')
+		
+			depthProfileMapping = {}
+
+			progressDialog.message = 'Mapping Pixels: %p% - %v/%m'
+			progressDialog.maximumValue = sketch.profiles.count
+			for i, p in enumerate(sketch.profiles):
+				if progressDialog.wasCancelled:
+					break
+				pMidPoint = getPoint3DMidPoint(p.boundingBox.minPoint, p.boundingBox.maxPoint)
+				pHI = int(measureMgr.measureMinimumDistance(baseSketchLine.geometry, pMidPoint).value / cmPerPixel[1])
+				pWI = int(measureMgr.measureMinimumDistance(heightSketchLine.geometry, pMidPoint).value / cmPerPixel[0])
+				pixelIndex = pHI*imageWidth + pWI
+				futil.log(f'{i}/{sketch.profiles.count}: PixelIndex: {pWI}|{pHI} - {pixelIndex} -> {-pixelIndex/(imageHeight*imageWidth)*depth}\n{measureMgr.measureMinimumDistance(heightSketchLine.geometry, pMidPoint).value}')
+				if pixelIndex > imageHeight*imageWidth:
+					futil.log('HERE')#raise Exception(f'HERE {imageWidth}:{imageHeight}')
+				elif depthLut[imageAsLine[pixelIndex]] > 0:
+					depthProfileMapping.setdefault(depthLut[imageAsLine[pixelIndex]], []).append(p)
+				progressDialog.progressValue = i+1
+				yield
+
+			# Extruding
+			progressDialog.message = 'Extruding: %p% - %v/%m depths'
+			progressDialog.maximumValue = len(depthProfileMapping)
+
+			futil.log(f'Depth: {depth}')
+
+			# Iterate through depth groups, shades of equal depth share one extrude
+			for e, pixelDistance in enumerate(sorted(depthProfileMapping)):
+				if progressDialog.wasCancelled:
+					break
+
+				extrudeProfiles = adsk.core.ObjectCollection.createWithArray(depthProfileMapping[pixelDistance])
+
+				futil.log(f'PixelGroup: {e} Distance: {pixelDistance}')
+				futil.log(f'\tPixels: {len(depthProfileMapping[pixelDistance])}')
+
+				extrudeInput = extrudes.createInput(extrudeProfiles, adsk.fusion.FeatureOperations.CutFeatureOperation)
+				extrudeInput.participantBodies = [face.body]
+				extrudeInput.isSolid = True
+				if not isFlush: # NOT FLUSH
+					extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(pixelDistance)), adsk.fusion.ExtentDirections.NegativeExtentDirection)
+					exf = extrudes.add(extrudeInput)
+					if exf.healthState == adsk.fusion.FeatureHealthStates.WarningFeatureHealthState:
+						exf.deleteMe()
+
+				else: # FLUSH
+					extrudeInput.startExtent = adsk.fusion.OffsetStartDefinition.create(adsk.core.ValueInput.createByReal(-(depth-minThickness/2)))
+					extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(pixelDistance)), adsk.fusion.ExtentDirections.PositiveExtentDirection)
+					exf = extrudes.add(extrudeInput)
+					if exf.healthState == adsk.fusion.FeatureHealthStates.WarningFeatureHealthState:
+						exf.deleteMe()
+
+				progressDialog.progressValue = e+1
+				yield
 	
-		if not progressDialog.wasCancelled and modeInput.value and flushBTInput.value > 0: # FLUSH
-			
-			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in sketch.profiles])
+		if not progressDialog.wasCancelled and geometryPlan.outlineThickness > 0: # FLUSH
+			if outlineSketch is None:
+				outlineSketch = createOutlineSketch(rootComponent, face, frame)
+			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in outlineSketch.profiles])
 			extrudeInput = extrudes.createInput(outlineProfiles, adsk.fusion.FeatureOperations.JoinFeatureOperation)
 			extrudeInput.isSolid = True
-			extrudeInput.setThinExtrude(adsk.fusion.ThinExtrudeWallLocation.Side1, adsk.core.ValueInput.createByReal(cmPerPixel[0]/flushBTInput.value))
+			extrudeInput.setThinExtrude(adsk.fusion.ThinExtrudeWallLocation.Side1, adsk.core.ValueInput.createByReal(geometryPlan.outlineThickness))
 			extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(depth)), adsk.fusion.ExtentDirections.NegativeExtentDirection)
 			extrudes.add(extrudeInput)
 
 		if progressDialog.wasCancelled:
-			args.executeFailed = True
-			args.executeFailedMessage = 'Cancelled.'
+			reportFailure(args, 'Cancelled.', isBackground)
 		progressDialog.hide()
 	except Exception as ex:
 		futil.log(f'Exception caught: {traceback.format_exc()}')
-		args.executeFailed = True
-		args.executeFailedMessage = 'Error processing design.\n\n\n\n'+traceback.format_exc()
-
-def command_executeDirect(args: adsk.core.CommandEventArgs):
+		progressDialog.hide()
+		reportFailure(args, 'Error processing design.\n\n\n\n'+traceback.format_exc(), isBackground)
+	finally:
+		recorder.stop(trace)
+
+# Models the lithophane with temporary bodies. In parametric designs the result is
+# wrapped in a single base feature instead of being added directly.
+# Yields after every unit of work, see command_execute.
+def executeDirectSteps(args: adsk.core.CommandEventArgs, isBackground: bool):
 	# General logging for debug.
 	futil.log(f'{CMD_NAME} Command Execute Direct Event')
+	from ...lib.PIL import Image
+	from . import cache, governor, loader, recorder, shading
 	# Get a reference to your command's inputs.
 	inputs = args.command.commandInputs
+	# Background jobs outlive the command, a later command replaces the global design
+	rootComponent = design.rootComponent
 
 	# TODO ******************************** Your code here ********************************
 
@@ -449,132 +609,113 @@ def command_executeDirect(args: adsk.core.CommandEventArgs):
 	
 	faceSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('faceSelector'))
 	baseSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('baseSelector'))
-	edgeSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('heightEdgeSelector'))
-	heightInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('heightSelector'))
 	modeInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('modeSelector'))
 	fixBrokenInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('fixBrokenSelector'))
 	minThicknessInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('minThicknessSelector'))
 	flushBTInput = adsk.core.ValueCommandInput.cast(inputs.itemById('flushBTSelector'))
-	colorShiftCorrectionInput = adsk.core.IntegerSliderCommandInput.cast(inputs.itemById('colorShiftCorrectionSelector'))
 
 	face = adsk.fusion.BRepFace.cast(faceSelectorInput.selection(0).entity)
 	base = adsk.fusion.BRepEdge.cast(baseSelectorInput.selection(0).entity)
 
-	progressDialog = ui.createProgressDialog()
-	progressDialog.cancelButtonText = 'Cancel'
-	progressDialog.isBackgroundTranslucent = False
-	progressDialog.isCancelButtonShown = True
+	# Input values, the inputs are gone once a background job continues after the command closed
+	isFlush = modeInput.value
+	fixBroken = fixBrokenInput.value
+	minThickness = minThicknessInput.value
+	flushBT = flushBTInput.value
 
 	if face is None or base is None:
 		return
 
 	global loadedImage
-	if loadedImage is None or not len(fileName) > 0:
+	if not len(fileName) > 0 or not awaitImage(args):
 		return
 	
 	try:
+		loadedImage = resampleForPrint(inputs, base, loadedImage)
 		image = loadedImage
 		imageWidth, imageHeight = image.size
 		
 		# Load image
+		maskImage = getMask(inputs, loadedImage)
 		loadedImage = loadedImage.transpose(Image.FLIP_TOP_BOTTOM)
 		imageAsLine = list(loadedImage.getdata())
 		futil.log('Image Raw: '+str(imageAsLine))
+		maskRegions = None
+		if maskImage is not None:
+			maskImage = maskImage.transpose(Image.FLIP_TOP_BOTTOM)
+			imageAsLine = shading.applyMask(imageAsLine, maskImage.tobytes(), loader.shadeLevels(loadedImage))
+			if fixBroken and adsk.core.BoolValueCommandInput.cast(inputs.itemById('maskClipSelector')).value:
+				maskRegions = getMaskRegions(maskImage)
 		futil.log(f'Image Size: {imageWidth*imageHeight}px')
 		if imageWidth*imageHeight > 50000 and ui.messageBox(f'This process can take several minutes depending on the size of the image.\nContinue?\n\nPixels to be processed: {imageWidth*imageHeight}','Expensive Operations Warning', adsk.core.MessageBoxButtonTypes.OKCancelButtonType) != adsk.core.DialogResults.DialogOK:
 			return
 		
-		progressDialog.show('Generating Mono3D', 'Loading...', 0, 100, 0)
-		
-		widthInputValue = base.length
-		cmPerPixel = (widthInputValue/imageWidth, 0)
-
-		heightInputValue = cmPerPixel[0]*imageHeight
-		if edgeSelectorInput.isVisible:
-			edge = adsk.fusion.BRepEdge.cast(edgeSelectorInput.selection(0).entity)
-			heightInputValue = edge.length
-		elif heightInput.isVisible:
-			heightInputValue = heightInput.value
-
-		cmPerPixel = (cmPerPixel[0], heightInputValue/imageHeight)
-		
-		# Create new sketch, obtain creation objects
-		sketch = design.rootComponent.sketches.add(face)
-		sketchLines = sketch.sketchCurves.sketchLines
-		extrudes = design.rootComponent.features.extrudeFeatures
-		# Outline Image region width
-		baseSketchLine: adsk.fusion.SketchLine = sketch.project(base)[0]
-		
-		# Calculate pixelVectors
-		coEdge = getCoEdge(base, face)
-		if coEdge is None:
-			raise Exception('No CoEdge found')
+		frame = getPlacementFrame(inputs, face, base, imageWidth, imageHeight)
+		cmPerPixel = frame.cmPerPixel
 
-		origin = baseSketchLine.startSketchPoint
-		widthEndPoint = baseSketchLine.endSketchPoint
+		# Parametric designs only keep the base feature holding the result
+		isParametric = design.designType == adsk.fusion.DesignTypes.ParametricDesignType
 
-		if coEdge.isOpposedToEdge:
-			origin, widthEndPoint = widthEndPoint, origin
-		
-		sketchWidthVector = origin.geometry.vectorTo(widthEndPoint.geometry)
-		sketchWidthVector.scaleBy(1/imageWidth)
-		sketchHeightVector = adsk.core.Vector3D.create(-sketchWidthVector.y, sketchWidthVector.x, 0)
-		sketchHeightVector.normalize()
-		sketchHeightVector.scaleBy(cmPerPixel[1])
+		origin = frame.origin
+		pixelWidthVector = frame.pixelWidthVector
+		pixelHeightVector = frame.pixelHeightVector
+		faceNormal = frame.faceNormal
+		depth = frame.depth(minThickness)
+		futil.log(f'Depth: {depth}')
 
+		if minThickness >= depth:
+			raise Warning('Minimum Depth exceeds object depth.')
 
-		# Outline Image region height
-		tv = origin.geometry.asVector()
-		mv = sketchHeightVector.copy()
-		mv.scaleBy(imageHeight)
-		tv.add(mv)
+		# Lithophane placement, maps image-local tool bodies onto the face
+		toolPlacement = frame.placement()
+		geometryPlan = createGeometryPlan(imageWidth, imageHeight, depth, minThickness, isFlush, fixBroken, maskRegions, flushBT, cmPerPixel)
+
+		depthLut = getDepthLut(inputs, depth-minThickness, loader.shadeLevels(loadedImage))
+		engine = getEngine(inputs)
+		layerCount = getLayerCount(inputs) if engine == 'Layers' else 0
+
+		# Key of previously generated tool bodies
+		cacheKey = cache.ResultCache.key(loadedImage.tobytes() + (maskImage.tobytes() if maskImage is not None else b''), {
+			'imageWidth': imageWidth,
+			'imageHeight': imageHeight,
+			'width': cmPerPixel[0]*imageWidth,
+			'height': cmPerPixel[1]*imageHeight,
+			'depth': depth,
+			'minThickness': minThickness,
+			'depthLut': depthLut,
+			'flush': isFlush,
+			'engine': engine,
+			'layers': layerCount,
+		})
+		inputValues = getInputValues(inputs)
+	except Exception:
+		futil.log(f'Exception caught: {traceback.format_exc()}')
+		reportFailure(args, 'Error processing design.\n\n\n\n'+traceback.format_exc(), isBackground)
+		return
 
-		heightSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, tv.asPoint())
-		
-		pixelFHeightVector = heightSketchLine.startSketchPoint.worldGeometry.vectorTo(heightSketchLine.endSketchPoint.worldGeometry)
-		pixelFWidthVector = baseSketchLine.startSketchPoint.worldGeometry.vectorTo(baseSketchLine.endSketchPoint.worldGeometry)
-		
-		pixelHeightVector = pixelFHeightVector.copy()
-		pixelHeightVector.scaleBy(1/imageHeight)
-		pixelWidthVector = pixelFWidthVector.copy()
-		pixelWidthVector.scaleBy(1/imageWidth)
-
-		pixelOnePV = origin.worldGeometry.asVector()
-		pixelOnePV.add(pixelHeightVector)
-		pixelOnePV.add(pixelWidthVector)
-		depthPoint, depth = getDepthPoint(face, pixelOnePV.asPoint())
-		depth = minThicknessInput.value+0.1 if depthPoint is None else depth
-		futil.log(f'Depth: {depth}')
+	# All inputs are read, the remaining work may continue in time slices.
+	# Nothing is shown or changed before, a queued job starts when the scheduler runs it.
+	yield
 
-		if minThicknessInput.value >= depth:
-			raise Warning('Minimum Depth exceeds object depth.')
+	progressDialog = ui.createProgressDialog()
+	progressDialog.cancelButtonText = 'Cancel'
+	progressDialog.isBackgroundTranslucent = False
+	progressDialog.isCancelButtonShown = True
 
-		faceNormal = face.evaluator.getNormalAtPoint(origin.worldGeometry)[1]
-		faceNormal.normalize()
+	memoryGovernor = governor.MemoryGovernor(config.MEMORY_BUDGET_MB*1024*1024, tracePython=config.TRACE_PYTHON_MEMORY)
+	trace = startRecording()
+	try:
+		progressDialog = recorder.wrap(trace, progressDialog, 'ProgressDialog')
+		progressDialog.show('Generating Mono3D', 'Loading...', 0, 100, 0)
 
-		# Outline Image depth
-		nv = face.evaluator.getNormalAtPoint(origin.worldGeometry)[1]
-		nv.normalize()
-		nv.scaleBy(-depth)
-		tv = origin.geometry.asVector()
-		tv.add(nv)
-		depthSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, tv.asPoint())
-		sketch.isVisible = False
+		# Image boundary for the border features, only created when needed
+		extrudes = recorder.wrap(trace, rootComponent.features.extrudeFeatures, 'ExtrudeFeatures')
+		outlineSketch = None
 
 		# fixBroken
-		if fixBrokenInput.value and not progressDialog.wasCancelled:
-			
-			# Create boundaries
-			tv = origin.geometry.asVector()
-			mv = sketchWidthVector.copy()
-			mv.scaleBy(imageWidth)
-			tv.add(mv)
-			mv = sketchHeightVector.copy()
-			mv.scaleBy(imageHeight)
-			tv.add(mv)
-
-			tlines = sketchLines.addThreePointRectangle(origin, widthEndPoint, tv.asPoint())
-			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in sketch.profiles])
+		if geometryPlan.fillsImage() and not progressDialog.wasCancelled and not isParametric:
+			outlineSketch = createOutlineSketch(rootComponent, face, frame)
+			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in outlineSketch.profiles])
 			extrudeInput = extrudes.createInput(outlineProfiles, adsk.fusion.FeatureOperations.JoinFeatureOperation)
 			extrudeInput.participantBodies = [face.body]
 			extrudeInput.isSolid = True
@@ -583,97 +724,349 @@ def command_executeDirect(args: adsk.core.CommandEventArgs):
 				extrudes.add(extrudeInput)
 			except RuntimeError:
 				pass
-		# Index Pixels
-		pixelOriginIndex = {}
-
-		progressDialog.message = 'Indexing Pixels: %p% - %v/%m'
-		progressDialog.maximumValue = imageWidth*imageHeight
-		for pixelIndex in range(imageWidth*imageHeight):
-			if progressDialog.wasCancelled:
-				break
-			pHI = pixelIndex // imageWidth
-			pWI = pixelIndex % imageWidth
-			tv = origin.worldGeometry.asVector()
-			mvH = pixelHeightVector.copy()
-			mvH.scaleBy(pHI+0.5)
-			tv.add(mvH)
-			mvW = pixelWidthVector.copy()
-			mvW.scaleBy(pWI+0.5)
-			tv.add(mvW)
-
-			pixelOriginIndex.setdefault(imageAsLine[pixelIndex], []).append(tv.asPoint())
-			progressDialog.progressValue = pixelIndex+1
 
-		
-		# Modelling
-		progressDialog.message = 'Modelling: %p% - %v/%m shades'
-		progressDialog.maximumValue = 256
-		
-		tempBrepMgr = adsk.fusion.TemporaryBRepManager.get()
+		tempBrepMgr = recorder.wrap(trace, adsk.fusion.TemporaryBRepManager.get(), 'TemporaryBRepManager')
 
 		faceTempBody = tempBrepMgr.copy(face.body)
+		toolBody = None
+
+		# fixBroken, as temporary slab below the image region or the unmasked pixels
+		if isParametric or not geometryPlan.fillsImage():
+			for x0, y0, x1, y1 in geometryPlan.slabs():
+				slabBody = createPixelBox(tempBrepMgr, origin, pixelWidthVector, pixelHeightVector, faceNormal, x0, y0, x1, y1, 0, depth)
+				tempBrepMgr.booleanOperation(faceTempBody, slabBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+
+		# Lookup previously generated tool body
+		resultCache = getResultCache()
+
+		startTime = time.perf_counter()
+		cachePath = resultCache.lookup(cacheKey)
+		if cachePath is not None:
+			progressDialog.message = 'Loading cached body...'
+			toolBody = importCachedTool(tempBrepMgr, cachePath, toolPlacement)
+			if toolBody is None:
+				resultCache.invalidate(cacheKey)
+			else:
+				resultCache.recordHit(cacheKey, time.perf_counter()-startTime)
+				futil.log(f'Cache hit: {cacheKey}')
+
+		if toolBody is None:
+			# Auto is cached as such and only sampled on a miss, the choice only depends on the image and the inputs in the key
+			engine, tileSize = chooseEngine(engine, imageAsLine, depthLut, imageWidth, imageHeight, 'temporary bodies')
+			memoryGovernor.stage('modelling')
+			if engine == 'Layers':
+				# One temporary layer body and sketch per layer, removed from the design again.
+				# Only the job's own features are deleted, the user may edit the design in between.
+				layers = extrudeLayers(trace, rootComponent, face, adsk.fusion.FeatureOperations.NewBodyFeatureOperation, None, origin, pixelWidthVector, pixelHeightVector, imageAsLine, imageWidth, imageHeight, depthLut, depth, minThickness, isFlush, layerCount, progressDialog, True)
+				try:
+					for exf in layers:
+						try:
+							for layerBody in list(exf.bodies):
+								layerTempBody = tempBrepMgr.copy(layerBody)
+								if toolBody is None:
+									toolBody = layerTempBody
+								else:
+									tempBrepMgr.booleanOperation(toolBody, layerTempBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+						finally:
+							if isParametric:
+								exf.deleteMe()
+							else:
+								for layerBody in list(exf.bodies):
+									layerBody.deleteMe()
+						toolBody = releaseToolBody(memoryGovernor, tempBrepMgr, faceTempBody, toolBody)
+						yield
+				finally:
+					# Removes the sketch of the open layer when the job is cancelled or fails
+					layers.close()
+
+			elif engine == 'Regions':
+				from . import plan
+				geometryPlan.planRows(plan.pixelRows(imageAsLine, imageWidth, imageHeight), depthLut)
+				futil.log(f'Plan: {len(geometryPlan)} regions for {geometryPlan.pixelCount()} pixels, {len(geometryPlan.serialize())} bytes')
+
+				progressDialog.message = 'Modelling: %p% - %v/%m regions'
+				progressDialog.maximumValue = len(geometryPlan)
+				progressDialog.progressValue = 0
+				for x0, y0, x1, y1, pixelDistance in geometryPlan.regions():
+					if progressDialog.wasCancelled:
+						break
+					top = geometryPlan.cutTop(pixelDistance) # FLUSH
+					regionBody = createPixelBox(tempBrepMgr, origin, pixelWidthVector, pixelHeightVector, faceNormal, x0, y0, x1, y1, top, pixelDistance)
+					if toolBody is None:
+						toolBody = regionBody
+					else:
+						tempBrepMgr.booleanOperation(toolBody, regionBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+					toolBody = releaseToolBody(memoryGovernor, tempBrepMgr, faceTempBody, toolBody)
+					progressDialog.progressValue += 1
+					yield
+
+			elif engine == 'Tiles':
+				from . import tiles
+				uniqueTiles = tiles.uniqueTiles(imageAsLine, depthLut, imageWidth, imageHeight, tileSize)
+				futil.log(f'Tiles: {len(uniqueTiles)} unique of {sum(len(positions) for _, positions in uniqueTiles)}')
+
+				progressDialog.message = 'Modelling: %p% - %v/%m tiles'
+				progressDialog.maximumValue = sum(len(positions) for _, positions in uniqueTiles)
+				progressDialog.progressValue = 0
+				for runs, positions in uniqueTiles:
+					if progressDialog.wasCancelled:
+						break
 
-		futil.log(f'Depth: {depth}')
+					# Carve the tile once, at its first position
+					tx, ty = positions[0]
+					tileBody = None
+					for x0, y, x1, pixelDistance in runs:
+						top = depth-pixelDistance-minThickness/2 if isFlush else 0 # FLUSH
+						runBody = createPixelBox(tempBrepMgr, origin, pixelWidthVector, pixelHeightVector, faceNormal, tx+x0, ty+y, tx+x1, ty+y+1, top, pixelDistance)
+						if tileBody is None:
+							tileBody = runBody
+						else:
+							tempBrepMgr.booleanOperation(tileBody, runBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+						yield
+
+					# Instance copies at all positions, collected into one body which is merged into the
+					# tool body at once. The temporary BRep manager has no n-ary combine, so the disjoint
+					# instances are still unioned one by one, but into the small instances body.
+					instancesBody = None
+					for px, py in positions:
+						if progressDialog.wasCancelled:
+							break
+						instanceBody = tempBrepMgr.copy(tileBody)
+						offset = pixelWidthVector.copy()
+						offset.scaleBy(px-tx)
+						mv = pixelHeightVector.copy()
+						mv.scaleBy(py-ty)
+						offset.add(mv)
+						move = adsk.core.Matrix3D.create()
+						move.translation = offset
+						tempBrepMgr.transform(instanceBody, move)
+						if instancesBody is None:
+							instancesBody = instanceBody
+						else:
+							tempBrepMgr.booleanOperation(instancesBody, instanceBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+						progressDialog.progressValue += 1
+						yield
+					if instancesBody is not None:
+						if toolBody is None:
+							toolBody = instancesBody
+						else:
+							tempBrepMgr.booleanOperation(toolBody, instancesBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+						toolBody = releaseToolBody(memoryGovernor, tempBrepMgr, faceTempBody, toolBody)
 
-		# Iterate through color spectrum
-		for e in range(256):
-			if progressDialog.wasCancelled:
-				break
-			if e not in pixelOriginIndex:
-				continue
+			else:
+				# Index Pixels by depth
+				memoryGovernor.stage('indexing')
+				depthGroups = shading.groupByDepth(imageAsLine, depthLut)
+				pixelOriginIndex = {}
+
+				progressDialog.message = 'Indexing Pixels: %p% - %v/%m'
+				progressDialog.maximumValue = sum(len(group) for group in depthGroups.values())
+				progressDialog.progressValue = 0
+				for pixelIndex in (i for group in depthGroups.values() for i in group):
+					if progressDialog.wasCancelled:
+						break
+					pHI = pixelIndex // imageWidth
+					pWI = pixelIndex % imageWidth
+					tv = origin.asVector()
+					mvH = pixelHeightVector.copy()
+					mvH.scaleBy(pHI+0.5)
+					tv.add(mvH)
+					mvW = pixelWidthVector.copy()
+					mvW.scaleBy(pWI+0.5)
+					tv.add(mvW)
+
+					pixelOriginIndex.setdefault(depthLut[imageAsLine[pixelIndex]], []).append(tv.asPoint())
+					progressDialog.progressValue += 1
+					memoryGovernor.sample()
+					yield
 
-			shiftCorrection = max(min(255, e + colorShiftCorrectionInput.valueOne*0.01*255), 0)
-			pixelDistance = (depth-minThicknessInput.value)/255*shiftCorrection
-			futil.log(f'PixelGroup: {e} Distance: {pixelDistance}')
-			futil.log(f'\tPixels: {len(pixelOriginIndex[e])}')
+			
+				# Modelling
+				memoryGovernor.stage('modelling')
+				progressDialog.message = 'Modelling: %p% - %v/%m depths'
+				progressDialog.maximumValue = len(pixelOriginIndex)
 
-			if pixelDistance == 0:
-				continue
+				futil.log(f'Depth: {depth}')
+
+				# Iterate through depth groups, collecting all cuts in a single tool body
+				for e, pixelDistance in enumerate(sorted(pixelOriginIndex)):
+					if progressDialog.wasCancelled:
+						break
 
-			bodies = adsk.core.ObjectCollection.create()
-			for op in pixelOriginIndex[e]:
-				sop = op.asVector()
-				fns = faceNormal.copy()
-				fns.scaleBy(-pixelDistance/2)
-				sop.add(fns)
-				if modeInput.value: # FLUSH
-					fns = faceNormal.copy()
-					fns.scaleBy(-(depth-pixelDistance-minThicknessInput.value/2))
-					sop.add(fns)
-				op = sop.asPoint()
-
-				orientedBox = adsk.core.OrientedBoundingBox3D.create(op, pixelWidthVector, pixelHeightVector, cmPerPixel[0], cmPerPixel[1], pixelDistance)
-				tempBody = tempBrepMgr.createBox(orientedBox)
-				bodies.add(tempBody)
-				tempBrepMgr.booleanOperation(faceTempBody, tempBody, adsk.fusion.BooleanTypes.DifferenceBooleanType)
-
-			progressDialog.progressValue = e+1
-		newbody = design.rootComponent.bRepBodies.add(faceTempBody)
-		newbody.name = 'Image2Mono3D'
-		face.body.isVisible = False
-
-		if not progressDialog.wasCancelled and modeInput.value and flushBTInput.value > 0: # FLUSH	
-			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in sketch.profiles])
+					futil.log(f'PixelGroup: {e} Distance: {pixelDistance}')
+					futil.log(f'\tPixels: {len(pixelOriginIndex[pixelDistance])}')
+
+					for op in pixelOriginIndex[pixelDistance]:
+						if progressDialog.wasCancelled:
+							break
+						sop = op.asVector()
+						fns = faceNormal.copy()
+						fns.scaleBy(-pixelDistance/2)
+						sop.add(fns)
+						if isFlush: # FLUSH
+							fns = faceNormal.copy()
+							fns.scaleBy(-(depth-pixelDistance-minThickness/2))
+							sop.add(fns)
+						op = sop.asPoint()
+
+						orientedBox = adsk.core.OrientedBoundingBox3D.create(op, pixelWidthVector, pixelHeightVector, cmPerPixel[0], cmPerPixel[1], pixelDistance)
+						tempBody = tempBrepMgr.createBox(orientedBox)
+						if toolBody is None:
+							toolBody = tempBody
+						else:
+							tempBrepMgr.booleanOperation(toolBody, tempBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+						toolBody = releaseToolBody(memoryGovernor, tempBrepMgr, faceTempBody, toolBody)
+						yield
+
+					progressDialog.progressValue = e+1
+
+			# Tool bodies cut early are incomplete and not cached
+			if not progressDialog.wasCancelled and toolBody is not None and memoryGovernor.flushes == 0:
+				resultCache.store(cacheKey, lambda path: exportCachedTool(tempBrepMgr, toolBody, path, toolPlacement), time.perf_counter()-startTime)
+
+		memoryGovernor.stage('result')
+		if toolBody is not None:
+			tempBrepMgr.booleanOperation(faceTempBody, toolBody, adsk.fusion.BooleanTypes.DifferenceBooleanType)
+		futil.log(f'Result Cache: {resultCache.formatStats()}')
+
+		if isParametric:
+			if not progressDialog.wasCancelled and geometryPlan.outlineThickness > 0: # FLUSH
+				frameBody = createOutlineFrame(tempBrepMgr, origin, pixelWidthVector, pixelHeightVector, faceNormal, geometryPlan)
+				if frameBody is not None:
+					tempBrepMgr.booleanOperation(faceTempBody, frameBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+
+			# Single base feature holding the result, inputs are kept for later regeneration
+			baseFeature = rootComponent.features.baseFeatures.add()
+			baseFeature.startEdit()
+			newbody = rootComponent.bRepBodies.add(faceTempBody, baseFeature)
+			baseFeature.finishEdit()
+			baseFeature.name = 'Image2Mono3D'
+			newbody.name = 'Image2Mono3D'
+			inputValues.update({'cacheKey': cacheKey, 'depth': depth, 'imageWidth': imageWidth, 'imageHeight': imageHeight})
+			baseFeature.attributes.add(ATTRIBUTE_GROUP, 'inputs', json.dumps(inputValues))
+			face.body.isLightBulbOn = False
+
+		else:
+			newbody = rootComponent.bRepBodies.add(faceTempBody)
+			newbody.name = 'Image2Mono3D'
+			face.body.isVisible = False
+
+		if not progressDialog.wasCancelled and geometryPlan.outlineThickness > 0 and not isParametric: # FLUSH	
+			if outlineSketch is None:
+				outlineSketch = createOutlineSketch(rootComponent, face, frame)
+			outlineProfiles = adsk.core.ObjectCollection.createWithArray([x for x in outlineSketch.profiles])
 			extrudeInput = extrudes.createInput(outlineProfiles, adsk.fusion.FeatureOperations.JoinFeatureOperation)
 			extrudeInput.isSolid = True
 			extrudeInput.participantBodies = [newbody]
-			extrudeInput.setThinExtrude(adsk.fusion.ThinExtrudeWallLocation.Side1, adsk.core.ValueInput.createByReal(cmPerPixel[0]/flushBTInput.value))
+			extrudeInput.setThinExtrude(adsk.fusion.ThinExtrudeWallLocation.Side1, adsk.core.ValueInput.createByReal(geometryPlan.outlineThickness))
 			extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(depth)), adsk.fusion.ExtentDirections.NegativeExtentDirection)
 			try:
 				extrudes.add(extrudeInput)
 			except:
 				pass
 		if progressDialog.wasCancelled:
+			reportFailure(args, 'Cancelled.', isBackground)
+		progressDialog.hide()
+		futil.log(f'Peak memory:\n{memoryGovernor.report()}')
+	except governor.MemoryBudgetExceeded as ex:
+		futil.log(f'{ex}\nPeak memory:\n{memoryGovernor.report()}')
+		progressDialog.hide()
+		reportFailure(args, f'{ex}\nReduce the image size or raise MEMORY_BUDGET_MB in config.py.\n\nPeak memory per stage:\n{memoryGovernor.report()}', isBackground)
+	except Exception as ex:
+		futil.log(f'Exception caught: {traceback.format_exc()}\nPeak memory:\n{memoryGovernor.report()}')
+		progressDialog.hide()
+		reportFailure(args, 'Error processing design.\n\n\n\n'+traceback.format_exc(), isBackground)
+	finally:
+		memoryGovernor.close()
+		recorder.stop(trace)
+
+
+
+
+# Streams the lithophane into a STL or 3MF file instead of modelling it
+def command_executeMesh(args: adsk.core.CommandEventArgs):
+	# General logging for debug.
+	futil.log(f'{CMD_NAME} Command Execute Mesh Event')
+	from . import loader, mesh, shading
+	# Get a reference to your command's inputs.
+	inputs = args.command.commandInputs
+
+	fileNameInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedFileName'))
+	fileName = fileNameInput.value
+	
+	faceSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('faceSelector'))
+	baseSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('baseSelector'))
+	modeInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('modeSelector'))
+	minThicknessInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('minThicknessSelector'))
+	flushBTInput = adsk.core.ValueCommandInput.cast(inputs.itemById('flushBTSelector'))
+
+	face = adsk.fusion.BRepFace.cast(faceSelectorInput.selection(0).entity)
+	base = adsk.fusion.BRepEdge.cast(baseSelectorInput.selection(0).entity)
+
+	if face is None or base is None:
+		return
+
+	global loadedImage
+	if not len(fileName) > 0 or not awaitImage(args):
+		return
+
+	fileDialog = ui.createFileDialog()
+	fileDialog.filter = 'STL Files (*.stl);;3MF Files (*.3mf)'
+	fileDialog.filterIndex = 0
+	fileDialog.title = 'Save Mesh File'
+	if fileDialog.showSave() != adsk.core.DialogResults.DialogOK:
+		args.executeFailed = True
+		args.executeFailedMessage = 'Cancelled.'
+		return
+	meshFileName = fileDialog.filename
+
+	progressDialog = ui.createProgressDialog()
+	progressDialog.cancelButtonText = 'Cancel'
+	progressDialog.isBackgroundTranslucent = False
+	progressDialog.isCancelButtonShown = True
+
+	try:
+		loadedImage = resampleForPrint(inputs, base, loadedImage)
+		imageWidth, imageHeight = loadedImage.size
+
+		frame = getPlacementFrame(inputs, face, base, imageWidth, imageHeight)
+		cmPerPixel = frame.cmPerPixel
+		depth = frame.depth(minThicknessInput.value)
+		futil.log(f'Depth: {depth}')
+
+		if minThicknessInput.value >= depth:
+			raise Warning('Minimum Depth exceeds object depth.')
+
+		depthLut = getDepthLut(inputs, depth-minThicknessInput.value, loader.shadeLevels(loadedImage))
+		shadeRows = lambda: mesh.imageRows(loadedImage)
+		maskImage = getMask(inputs, loadedImage)
+		if maskImage is not None:
+			shadeRows = lambda: (shading.applyMask(row, maskRow, loader.shadeLevels(loadedImage)) for row, maskRow in zip(mesh.imageRows(loadedImage), mesh.imageRows(maskImage)))
+		isThreeMF = meshFileName.lower().endswith('.3mf')
+		progressDialog.show('Generating Mono3D', 'Writing Mesh: %p% - %v/%m rows', 0, imageHeight*(2 if isThreeMF else 1), 0)
+
+		geometryPlan = createGeometryPlan(imageWidth, imageHeight, depth, minThicknessInput.value, modeInput.value, False, None, flushBTInput.value, cmPerPixel)
+		# Rows of cut depths, stops early when cancelled. The mesh is written per row for every engine.
+		def cutRows():
+			for row in ([depthLut[shade] for shade in row] for row in shadeRows()):
+				if progressDialog.wasCancelled:
+					return
+				progressDialog.progressValue += 1
+				yield row
+
+		mesh.writeLithophane(meshFileName, cutRows, geometryPlan, cmPerPixel)
+
+		if progressDialog.wasCancelled:
+			os.remove(meshFileName)
 			args.executeFailed = True
 			args.executeFailedMessage = 'Cancelled.'
+		else:
+			futil.log(f'Mesh written: {meshFileName} ({os.path.getsize(meshFileName)} bytes)')
 		progressDialog.hide()
-		
 	except Exception as ex:
 		futil.log(f'Exception caught: {traceback.format_exc()}')
 		args.executeFailed = True
-		args.executeFailedMessage = 'Error processing design.\n\n\n\n'+traceback.format_exc()
-
-
+		args.executeFailedMessage = 'Error writing mesh.\n\n\n\n'+traceback.format_exc()
 
 
 # This event handler is called when the command needs to compute a new preview in the graphics window.
@@ -687,9 +1080,6 @@ def command_preview(args: adsk.core.CommandEventArgs):
 	
 	faceSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('faceSelector'))
 	baseSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('baseSelector'))
-	edgeSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('heightEdgeSelector'))
-	heightInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('heightSelector'))
-	modeInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('modeSelector'))
 	fixBrokenInput = adsk.core.BoolValueCommandInput.cast(inputs.itemById('fixBrokenSelector'))
 	minThicknessInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('minThicknessSelector'))
 
@@ -699,96 +1089,41 @@ def command_preview(args: adsk.core.CommandEventArgs):
 	if face is None or base is None:
 		return
 
-	global loadedImage
-	if loadedImage is None or not len(fileName) > 0:
+	# The preview only needs the image size, which is known long before the image is decoded.
+	# It is skipped until then, the worker may still be busy with a previously selected image.
+	if imageLoad is None or not len(fileName) > 0 or not imageLoad.sizeReady():
 		return
 	
 	try:
-		image = loadedImage
-		imageWidth, imageHeight = image.size
-		widthInputValue = base.length
-		cmPerPixel = (widthInputValue/imageWidth, 0)
-
-		heightInputValue = cmPerPixel[0]*imageHeight
-		if edgeSelectorInput.isVisible:
-			edge = adsk.fusion.BRepEdge.cast(edgeSelectorInput.selection(0).entity)
-			heightInputValue = edge.length
-		elif heightInput.isVisible:
-			heightInputValue = heightInput.value
-
-		cmPerPixel = (cmPerPixel[0], heightInputValue/imageHeight)
+		imageWidth, imageHeight = imageLoad.size(0)
+		frame = getPlacementFrame(inputs, face, base, imageWidth, imageHeight)
+		depth = frame.depth(minThicknessInput.value)
+		futil.log(f'Depth: {depth}')
 		
 		# Create new sketch, obtain creation objects
 		sketch = design.rootComponent.sketches.add(face)
 		sketchLines = sketch.sketchCurves.sketchLines
 		extrudes = design.rootComponent.features.extrudeFeatures
 
-		# Outline Image region width
-		baseSketchLine: adsk.fusion.SketchLine = sketch.project(base)[0]
-
-		# Calculate pixelVectors
-		coEdge = getCoEdge(base, face)
-		if coEdge is None:
-			raise Exception('No CoEdge found')
-
-		origin = baseSketchLine.startSketchPoint
-		widthEndPoint = baseSketchLine.endSketchPoint
-
-		if coEdge.isOpposedToEdge:
-			origin, widthEndPoint = widthEndPoint, origin
-		
-		sketchWidthVector = origin.geometry.vectorTo(widthEndPoint.geometry)
-		sketchWidthVector.scaleBy(1/imageWidth)
-		sketchHeightVector = adsk.core.Vector3D.create(-sketchWidthVector.y, sketchWidthVector.x, 0)
-		sketchHeightVector.normalize()
-		sketchHeightVector.scaleBy(cmPerPixel[1])
-
-
-		# Outline Image region height
-		tv = origin.geometry.asVector()
-		mv = sketchHeightVector.copy()
-		mv.scaleBy(imageHeight)
-		tv.add(mv)
-
-		heightSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, tv.asPoint())
-		
-		pixelFHeightVector = heightSketchLine.startSketchPoint.worldGeometry.vectorTo(heightSketchLine.endSketchPoint.worldGeometry)
-		pixelFWidthVector = baseSketchLine.startSketchPoint.worldGeometry.vectorTo(baseSketchLine.endSketchPoint.worldGeometry)
-		
-		pixelHeightVector = pixelFHeightVector.copy()
-		pixelHeightVector.scaleBy(1/imageHeight)
-		pixelWidthVector = pixelFWidthVector.copy()
-		pixelWidthVector.scaleBy(1/imageWidth)
-
-		pixelOnePV = origin.worldGeometry.asVector()
-		pixelOnePV.add(pixelHeightVector)
-		pixelOnePV.add(pixelWidthVector)
-		depthPoint, depth = getDepthPoint(face, pixelOnePV.asPoint())
-		depth = minThicknessInput.value+0.1 if depthPoint is None else depth
-		futil.log(f'Depth: {depth}')
+		# Outline Image region width and height
+		origin = sketch.modelToSketchSpace(frame.origin)
+		widthEndPoint = sketch.modelToSketchSpace(frame.corner(imageWidth, 0))
+		baseSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, widthEndPoint)
+		heightSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(baseSketchLine.startSketchPoint, sketch.modelToSketchSpace(frame.corner(0, imageHeight)))
 
 		# Outline Image depth
-		nv = face.evaluator.getNormalAtPoint(origin.worldGeometry)[1]
-		nv.normalize()
+		nv = frame.faceNormal
 		nv.scaleBy(-depth)
-		tv = origin.geometry.asVector()
-		tv.add(nv)
-		depthSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(origin, tv.asPoint())
+		depthEndPoint = frame.origin
+		depthEndPoint.translateBy(nv)
+		depthSketchLine: adsk.fusion.SketchLine = sketchLines.addByTwoPoints(baseSketchLine.startSketchPoint, sketch.modelToSketchSpace(depthEndPoint))
 	
 		# extrude after canvas
 		if fixBrokenInput.value:
 			if design.designType == adsk.fusion.DesignTypes.DirectDesignType:
 				face.body.isVisible = False
 			# Create boundaries
-			tv = origin.geometry.asVector()
-			mv = sketchWidthVector.copy()
-			mv.scaleBy(imageWidth)
-			tv.add(mv)
-			mv = sketchHeightVector.copy()
-			mv.scaleBy(imageHeight)
-			tv.add(mv)
-
-			tlines = sketchLines.addThreePointRectangle(origin, widthEndPoint, tv.asPoint())
+			tlines = sketchLines.addThreePointRectangle(origin, widthEndPoint, sketch.modelToSketchSpace(frame.corner(imageWidth, imageHeight)))
 			# prepare extrusion, wait for canvas
 			inputProfiles = adsk.core.ObjectCollection.createWithArray([x for x in sketch.profiles])
 			extrude = extrudes.addSimple(inputProfiles, adsk.core.ValueInput.createByReal(-depth), adsk.fusion.FeatureOperations.JoinFeatureOperation)
@@ -808,7 +1143,7 @@ def command_input_changed(args: adsk.core.InputChangedEventArgs):
 
 	if changed_input.id == 'imageSelector':
 		fileDialog = ui.createFileDialog()
-		fileDialog.filter = 'Image Files (*.BMP;*.JPG;*.PNG);;All files (*.*)'
+		fileDialog.filter = 'Image Files (*.BMP;*.JPG;*.PNG;*.TIF;*.PGM);;All files (*.*)'
 		fileDialog.filterIndex = 0
 		fileDialog.isMultiSelectEnabled = False
 		fileDialog.title = 'Select Image File'
@@ -816,16 +1151,13 @@ def command_input_changed(args: adsk.core.InputChangedEventArgs):
 		if result == adsk.core.DialogResults.DialogOK:
 			fileNameInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedFileName'))
 			fileName = fileDialog.filename
-			global loadedImage
-			try:
-				image = Image.open(fileName).convert('L')
-				image.verify()
-				loadedImage = image
-			except Exception as ex:
-				futil.log(f'Exception caught: {traceback.format_exc()}')
-				ui.messageBox('Invalid Image File: '+str(ex))
-				fileName = ''
-				loadedImage = None
+			# Decode in the background, so switching images never blocks the dialog
+			from . import loader
+			global imageLoad, loadedImage
+			if imageLoad is not None:
+				imageLoad.cancel()
+			imageLoad = loader.ImageLoad(fileName, config.MAX_IMAGE_PIXELS)
+			loadedImage = None
 
 			fileNameInput.value = fileName
 			fileNameInput.tooltip = fileName
@@ -839,6 +1171,7 @@ def command_input_changed(args: adsk.core.InputChangedEventArgs):
 		minThicknessInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('minThicknessSelector'))
 		try:
 			face = adsk.fusion.BRepFace.cast(faceSelectorInput.selection(0).entity)
+			topologyCache.setFace(face)
 			modeInput.isEnabled = True
 			flushBTInput.isVisible = modeInput.value
 			baseSelectionInput.isVisible = True
@@ -846,6 +1179,7 @@ def command_input_changed(args: adsk.core.InputChangedEventArgs):
 			
 		except Exception as ex:
 			futil.log(f'Exception caught: {traceback.format_exc()}')
+			topologyCache.clear()
 			modeInput.isEnabled = False
 			flushBTInput.isVisible = False
 			baseSelectionInput.isVisible = False
@@ -881,9 +1215,7 @@ def command_input_changed(args: adsk.core.InputChangedEventArgs):
 			if coEdge is None:
 				raise Exception('No CoEdge found')
 
-			edgeEndPoints = edge.evaluator.getEndPoints()[1:]
-			if coEdge.isOpposedToEdge:
-				edgeEndPoints = edgeEndPoints[::-1]
+			edgeEndPoints = topologyCache.edgeEndPoints(edge)
 			faceNormal = face.evaluator.getNormalAtPoint(edgeEndPoints[0])[1]
 			faceNormal.normalize()
 			edgeVect = edgeEndPoints[0].vectorTo(edgeEndPoints[1])
@@ -920,7 +1252,30 @@ def command_input_changed(args: adsk.core.InputChangedEventArgs):
 			edgeSelector.isEnabled = True
 			distanceSelector.isVisible = False
 
+	if changed_input.id == 'maskSelector':
+		maskMode = adsk.core.DropDownCommandInput.cast(changed_input).selectedItem.name
+		inputs.itemById('maskImageSelector').isVisible = maskMode == 'Mask Image'
+		inputs.itemById('selectedMaskFileName').isVisible = maskMode == 'Mask Image'
+		inputs.itemById('maskThresholdSelector').isVisible = maskMode == 'Shade Threshold'
+		inputs.itemById('maskClipSelector').isVisible = maskMode != 'None'
+
+	if changed_input.id == 'maskImageSelector':
+		fileDialog = ui.createFileDialog()
+		fileDialog.filter = 'Image Files (*.BMP;*.JPG;*.PNG;*.TIF;*.PGM);;All files (*.*)'
+		fileDialog.filterIndex = 0
+		fileDialog.isMultiSelectEnabled = False
+		fileDialog.title = 'Select Mask Image File'
+		if fileDialog.showOpen() == adsk.core.DialogResults.DialogOK:
+			maskFileNameInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedMaskFileName'))
+			maskFileNameInput.value = fileDialog.filename
+			maskFileNameInput.tooltip = fileDialog.filename
+
+	if changed_input.id == 'engineSelector':
+		layerCountInput = inputs.itemById('layerCountSelector')
+		layerCountInput.isVisible = getEngine(inputs) == 'Layers'
+
 	if changed_input.id == 'supportDevSelector':
+		from ...lib.PIL import Image
 		Image.open(RESOURCES_FOLDER+"/supportDev/qrcode.png").show()
 
 	# General logging for debug.
@@ -937,6 +1292,9 @@ def command_validate_input(args: adsk.core.ValidateInputsEventArgs):
 	fileNameInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedFileName'))
 	if not len(fileNameInput.value) > 0:
 		args.areInputsValid = False
+	elif imageLoad is not None and imageLoad.exception() is not None:
+		fileNameInput.tooltip = 'Invalid Image File: '+str(imageLoad.exception())
+		args.areInputsValid = False
 	
 	faceSelector = adsk.core.SelectionCommandInput.cast(inputs.itemById('faceSelector'))
 	if faceSelector.isVisible and not faceSelector.selectionCount == 1:
@@ -954,6 +1312,21 @@ def command_validate_input(args: adsk.core.ValidateInputsEventArgs):
 	if flushBTInput.isVisible and flushBTInput.value < 0:
 		args.areInputsValid = False
 
+	gammaInput = adsk.core.ValueCommandInput.cast(inputs.itemById('gammaSelector'))
+	if gammaInput.value <= 0:
+		args.areInputsValid = False
+
+	toneCurveInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('toneCurveSelector'))
+	from . import shading
+	try:
+		shading.parseToneCurve(toneCurveInput.value)
+	except ValueError:
+		args.areInputsValid = False
+
+	maskFileNameInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedMaskFileName'))
+	if maskFileNameInput.isVisible and not len(maskFileNameInput.value) > 0:
+		args.areInputsValid = False
+
 # This event handler is called when the selection changes.
 def command_select(args: adsk.core.SelectionEventArgs):
 	# General logging for debug.
@@ -968,7 +1341,8 @@ def command_select(args: adsk.core.SelectionEventArgs):
 		try:
 			face = adsk.fusion.BRepFace.cast(faceSelectorInput.selection(0).entity)
 			base = adsk.fusion.BRepEdge.cast(args.selection.entity)
-			if face not in base.faces:
+			topologyCache.setFace(face)
+			if not topologyCache.hasEdge(base):
 				args.isSelectable = False
 		except Exception as ex:
 			futil.log(f'Exception caught: {traceback.format_exc()}')
@@ -981,14 +1355,10 @@ def command_select(args: adsk.core.SelectionEventArgs):
 			face = adsk.fusion.BRepFace.cast(faceSelectorInput.selection(0).entity)
 			base = adsk.fusion.BRepEdge.cast(baseSelectorInput.selection(0).entity)
 			edge = adsk.fusion.BRepEdge.cast(args.selection.entity)
-			if face not in edge.faces:
+			topologyCache.setFace(face)
+			if not topologyCache.hasEdge(edge):
 				args.isSelectable = False
-			
-			basePoints = base.evaluator.getEndPoints()[1:]
-			edgePoints = edge.evaluator.getEndPoints()[1:]
-			v1 = basePoints[0].vectorTo(basePoints[1])
-			v2 = edgePoints[0].vectorTo(edgePoints[1])
-			if not v1.isPerpendicularTo(v2):
+			elif not topologyCache.direction(base).isPerpendicularTo(topologyCache.direction(edge)):
 				args.isSelectable = False
 		except Exception as ex:
 			futil.log(f'Exception caught: {traceback.format_exc()}')
@@ -1000,18 +1370,401 @@ def command_destroy(args: adsk.core.CommandEventArgs):
 	# General logging for debug.
 	futil.log(f'{CMD_NAME} Command Destroy Event')
 
-	global local_handlers
+	global local_handlers, topologyCache, placementFrames
 	local_handlers = []
+	topologyCache = None
+	placementFrames = {}
+
+
+# Start recording the API calls of a run if enabled in the config, returns the trace or None
+def startRecording() -> 'recorder.Recorder':
+	if not config.RECORD_API_CALLS:
+		return None
+	from . import recorder
+	trace = recorder.start(config.TRACE_FOLDER)
+	futil.log(f'Recording API calls to {trace.path}')
+	return trace
+
+
+# Report a failed execution, on the command or, for background jobs that outlive it, in a message box
+def reportFailure(args: adsk.core.CommandEventArgs, message: str, isBackground: bool):
+	if not isBackground:
+		args.executeFailed = True
+		args.executeFailedMessage = message
+	elif message != 'Cancelled.':
+		ui.messageBox(message, CMD_NAME)
+
+
+# Lazily created scheduler of background jobs
+def getScheduler() -> 'scheduler.Scheduler':
+	global jobScheduler
+	if jobScheduler is None:
+		from . import scheduler
+		jobScheduler = scheduler.Scheduler(f'{CMD_ID}_scheduler')
+	return jobScheduler
+
+
+# Wait for the background decode of the selected image.
+# Fails the command on invalid image files.
+def awaitImage(args: adsk.core.CommandEventArgs) -> bool:
+	global loadedImage
+	if imageLoad is None:
+		return False
+	if loadedImage is None:
+		try:
+			loadedImage = imageLoad.result()
+		except Exception as ex:
+			futil.log(f'Exception caught: {traceback.format_exc()}')
+			args.executeFailed = True
+			args.executeFailedMessage = 'Invalid Image File: '+str(ex)
+			return False
+	return True
 
 
 # Return BRepCoEdge of edge and face
 def getCoEdge(edge: adsk.fusion.BRepEdge, face: adsk.fusion.BRepFace) -> adsk.fusion.BRepCoEdge:
-	edgeCoEdge = None
-	for coEdge in edge.coEdges:
-		if coEdge.loop.face == face:
-			edgeCoEdge = coEdge
+	topologyCache.setFace(face)
+	return topologyCache.coEdge(edge)
+
+
+# Shade to depth lookup table for the shift, gamma and tone curve inputs
+def getDepthLut(inputs: adsk.core.CommandInputs, cutRange: float, levels: int = 256) -> list:
+	colorShiftCorrectionInput = adsk.core.IntegerSliderCommandInput.cast(inputs.itemById('colorShiftCorrectionSelector'))
+	gammaInput = adsk.core.ValueCommandInput.cast(inputs.itemById('gammaSelector'))
+	toneCurveInput = adsk.core.StringValueCommandInput.cast(inputs.itemById('toneCurveSelector'))
+	from . import shading
+	return shading.buildDepthLut(cutRange, colorShiftCorrectionInput.valueOne, gammaInput.value, shading.parseToneCurve(toneCurveInput.value), levels, config.DEPTH_LEVELS)
+
+
+# Name of the selected modelling engine
+def getEngine(inputs: adsk.core.CommandInputs) -> str:
+	engineInput = adsk.core.DropDownCommandInput.cast(inputs.itemById('engineSelector'))
+	return engineInput.selectedItem.name
+
+
+# Engine to model with and its tile size, Auto is resolved by sampling the image for the given backend
+def chooseEngine(engine: str, pixels, lut: list, imageWidth: int, imageHeight: int, backend: str) -> tuple:
+	from . import autoplan, tiles
+	if engine != 'Auto':
+		return engine, tiles.TILE_SIZE
+	choice = autoplan.chooseEngine(pixels, lut, imageWidth, imageHeight, backend)
+	futil.log(choice.describe())
+	return choice.engine, choice.tileSize
+
+
+def getLayerCount(inputs: adsk.core.CommandInputs) -> int:
+	layerCountInput = adsk.core.IntegerSpinnerCommandInput.cast(inputs.itemById('layerCountSelector'))
+	return layerCountInput.value
+
+
+# Sketch and extrude the depth map as cumulative layers of equal thickness.
+# Every layer gets its own sketch holding the simplified iso-contours, all filled
+# profiles of a layer are extruded at once. Yields the extrude feature of each layer.
+# With removeSketches each sketch is deleted once the caller is done with its feature.
+# API calls are recorded into trace, which is None when not recording.
+def extrudeLayers(trace: 'recorder.Recorder', rootComponent: adsk.fusion.Component, face: adsk.fusion.BRepFace, operation, participantBodies: list, origin: adsk.core.Point3D, pixelWidthVector: adsk.core.Vector3D, pixelHeightVector: adsk.core.Vector3D, imageAsLine: list, imageWidth: int, imageHeight: int, depthLut: list, depth: float, minThickness: float, isFlush: bool, layerCount: int, progressDialog: adsk.core.ProgressDialog, removeSketches: bool = False):
+	from . import contours, recorder
+	extrudes = recorder.wrap(trace, rootComponent.features.extrudeFeatures, 'ExtrudeFeatures')
+	layerThickness = (depth-minThickness)/layerCount
+	layers = contours.layerIndices(imageAsLine, depthLut, layerThickness, layerCount)
+
+	progressDialog.message = 'Layering: %p% - %v/%m layers'
+	progressDialog.maximumValue = layerCount
+	progressDialog.progressValue = 0
+	for layer in range(1, layerCount+1):
+		if progressDialog.wasCancelled:
 			break
-	return edgeCoEdge
+		polygons = [p for p in contours.layerContours(layers, imageWidth, imageHeight, layer) if len(p) > 2]
+		futil.log(f'Layer: {layer} Contours: {len(polygons)} Points: {sum(len(p) for p in polygons)}')
+		if not polygons:
+			# Layers are cumulative, all following ones are empty as well
+			break
+
+		sketch = rootComponent.sketches.add(face)
+		sketch.isComputeDeferred = True
+		sketchLines = recorder.wrap(trace, sketch.sketchCurves.sketchLines, 'SketchLines')
+		lineOwners = {}
+		for k, polygon in enumerate(polygons):
+			points = []
+			for x, y in polygon:
+				tv = origin.asVector()
+				mv = pixelWidthVector.copy()
+				mv.scaleBy(x)
+				tv.add(mv)
+				mv = pixelHeightVector.copy()
+				mv.scaleBy(y)
+				tv.add(mv)
+				points.append(sketch.modelToSketchSpace(tv.asPoint()))
+			line = sketchLines.addByTwoPoints(points[0], points[1])
+			first = line.startSketchPoint
+			lineOwners[line.entityToken] = k
+			for point in points[2:]:
+				line = sketchLines.addByTwoPoints(line.endSketchPoint, point)
+				lineOwners[line.entityToken] = k
+			line = sketchLines.addByTwoPoints(line.endSketchPoint, first)
+			lineOwners[line.entityToken] = k
+		sketch.isComputeDeferred = False
+		sketch.isVisible = False
+
+		# Filled profiles are bounded by counter-clockwise contours, clockwise ones are holes
+		isOuter = [contours.signedArea(p) > 0 for p in polygons]
+		layerProfiles = adsk.core.ObjectCollection.create()
+		for profile in sketch.profiles:
+			for loop in profile.profileLoops:
+				if loop.isOuter:
+					owner = lineOwners.get(loop.profileCurves.item(0).sketchEntity.entityToken)
+					if owner is not None and isOuter[owner]:
+						layerProfiles.add(profile)
+					break
+		if layerProfiles.count == 0:
+			if removeSketches:
+				sketch.deleteMe()
+			continue
+
+		extrudeInput = extrudes.createInput(layerProfiles, operation)
+		if participantBodies is not None:
+			extrudeInput.participantBodies = participantBodies
+		extrudeInput.isSolid = True
+		if not isFlush:
+			extrudeInput.startExtent = adsk.fusion.OffsetStartDefinition.create(adsk.core.ValueInput.createByReal(-(layer-1)*layerThickness))
+			extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(layerThickness)), adsk.fusion.ExtentDirections.NegativeExtentDirection)
+		else:
+			extrudeInput.startExtent = adsk.fusion.OffsetStartDefinition.create(adsk.core.ValueInput.createByReal(-(depth-minThickness/2)+(layer-1)*layerThickness))
+			extrudeInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(adsk.core.ValueInput.createByReal(layerThickness)), adsk.fusion.ExtentDirections.PositiveExtentDirection)
+		try:
+			yield extrudes.add(extrudeInput)
+		finally:
+			# Also when the job is cancelled or fails while the layer is open
+			if removeSketches:
+				sketch.deleteMe()
+		progressDialog.progressValue = layer
+
+
+# Values of all inputs that define the result
+def getInputValues(inputs: adsk.core.CommandInputs) -> dict:
+	faceSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('faceSelector'))
+	baseSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('baseSelector'))
+	edgeSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('heightEdgeSelector'))
+	dropDownInput = adsk.core.DropDownCommandInput.cast(inputs.itemById('dropDownSelector'))
+	values = {
+		'fileName': adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedFileName')).value,
+		'face': faceSelectorInput.selection(0).entity.entityToken,
+		'base': baseSelectorInput.selection(0).entity.entityToken,
+		'heightMode': dropDownInput.selectedItem.name,
+		'height': adsk.core.DistanceValueCommandInput.cast(inputs.itemById('heightSelector')).value,
+		'minThickness': adsk.core.DistanceValueCommandInput.cast(inputs.itemById('minThicknessSelector')).value,
+		'pitch': adsk.core.DistanceValueCommandInput.cast(inputs.itemById('pitchSelector')).value,
+		'shift': adsk.core.IntegerSliderCommandInput.cast(inputs.itemById('colorShiftCorrectionSelector')).valueOne,
+		'gamma': adsk.core.ValueCommandInput.cast(inputs.itemById('gammaSelector')).value,
+		'toneCurve': adsk.core.StringValueCommandInput.cast(inputs.itemById('toneCurveSelector')).value,
+		'engine': getEngine(inputs),
+		'layers': getLayerCount(inputs),
+		'flush': adsk.core.BoolValueCommandInput.cast(inputs.itemById('modeSelector')).value,
+		'outlineFactor': adsk.core.ValueCommandInput.cast(inputs.itemById('flushBTSelector')).value,
+		'fixBroken': adsk.core.BoolValueCommandInput.cast(inputs.itemById('fixBrokenSelector')).value,
+		'mask': adsk.core.DropDownCommandInput.cast(inputs.itemById('maskSelector')).selectedItem.name,
+		'maskFileName': adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedMaskFileName')).value,
+		'maskThreshold': adsk.core.IntegerSliderCommandInput.cast(inputs.itemById('maskThresholdSelector')).valueOne,
+		'maskClip': adsk.core.BoolValueCommandInput.cast(inputs.itemById('maskClipSelector')).value,
+	}
+	if edgeSelectorInput.isVisible and edgeSelectorInput.selectionCount > 0:
+		values['heightEdge'] = edgeSelectorInput.selection(0).entity.entityToken
+	return values
+
+
+# Temporary box over the pixel region [x0, x1]x[y0, y1], from top to top+thickness below the face
+def createPixelBox(tempBrepMgr: adsk.fusion.TemporaryBRepManager, origin: adsk.core.Point3D, pixelWidthVector: adsk.core.Vector3D, pixelHeightVector: adsk.core.Vector3D, faceNormal: adsk.core.Vector3D, x0: float, y0: float, x1: float, y1: float, top: float, thickness: float) -> adsk.fusion.BRepBody:
+	center = origin.asVector()
+	mv = pixelWidthVector.copy()
+	mv.scaleBy((x0+x1)/2)
+	center.add(mv)
+	mv = pixelHeightVector.copy()
+	mv.scaleBy((y0+y1)/2)
+	center.add(mv)
+	mv = faceNormal.copy()
+	mv.scaleBy(-(top+thickness/2))
+	center.add(mv)
+	orientedBox = adsk.core.OrientedBoundingBox3D.create(center.asPoint(), pixelWidthVector, pixelHeightVector, (x1-x0)*pixelWidthVector.length, (y1-y0)*pixelHeightVector.length, thickness)
+	return tempBrepMgr.createBox(orientedBox)
+
+
+# Hidden sketch of rootComponent on face holding nothing but the rectangle of the image region of frame
+def createOutlineSketch(rootComponent: adsk.fusion.Component, face: adsk.fusion.BRepFace, frame: 'placement.PlacementFrame') -> adsk.fusion.Sketch:
+	outlineSketch = rootComponent.sketches.add(face)
+	outlineSketch.isVisible = False
+	corners = [outlineSketch.modelToSketchSpace(frame.corner(x, y)) for x, y in ((0, 0), (frame.imageWidth, 0), (frame.imageWidth, frame.imageHeight))]
+	outlineSketch.sketchCurves.sketchLines.addThreePointRectangle(*corners)
+	return outlineSketch
+
+
+# Hidden sketch of rootComponent on face with a rectangle per region (x0, y0, x1, y1) in pixel coordinates of frame.
+# The lines are recorded into trace, which is None when not recording.
+def createRegionSketch(trace: 'recorder.Recorder', rootComponent: adsk.fusion.Component, face: adsk.fusion.BRepFace, frame: 'placement.PlacementFrame', rects: list) -> adsk.fusion.Sketch:
+	regionSketch = rootComponent.sketches.add(face)
+	regionSketch.isComputeDeferred = True
+	from . import recorder
+	sketchLines = recorder.wrap(trace, regionSketch.sketchCurves.sketchLines, 'SketchLines')
+	for x0, y0, x1, y1 in rects:
+		sketchLines.addTwoPointRectangle(regionSketch.modelToSketchSpace(frame.corner(x0, y0)), regionSketch.modelToSketchSpace(frame.corner(x1, y1)))
+	regionSketch.isComputeDeferred = False
+	regionSketch.isVisible = False
+	return regionSketch
+
+
+# Temporary outline frame of geometryPlan along the inside of the image border
+def createOutlineFrame(tempBrepMgr: adsk.fusion.TemporaryBRepManager, origin: adsk.core.Point3D, pixelWidthVector: adsk.core.Vector3D, pixelHeightVector: adsk.core.Vector3D, faceNormal: adsk.core.Vector3D, geometryPlan: 'plan.GeometryPlan') -> adsk.fusion.BRepBody:
+	imageWidth, imageHeight, depth = geometryPlan.imageWidth, geometryPlan.imageHeight, geometryPlan.depth
+	tx = min(geometryPlan.outlineThickness/pixelWidthVector.length, imageWidth/2)
+	ty = min(geometryPlan.outlineThickness/pixelHeightVector.length, imageHeight/2)
+	frameBody = None
+	for x0, y0, x1, y1 in ((0, 0, imageWidth, ty), (0, imageHeight-ty, imageWidth, imageHeight), (0, ty, tx, imageHeight-ty), (imageWidth-tx, ty, imageWidth, imageHeight-ty)):
+		if x1 <= x0 or y1 <= y0:
+			continue
+		sideBody = createPixelBox(tempBrepMgr, origin, pixelWidthVector, pixelHeightVector, faceNormal, x0, y0, x1, y1, 0, depth)
+		if frameBody is None:
+			frameBody = sideBody
+		else:
+			tempBrepMgr.booleanOperation(frameBody, sideBody, adsk.fusion.BooleanTypes.UnionBooleanType)
+	return frameBody
+
+
+# Cut toolBody from faceTempBody early when memoryGovernor runs low on memory.
+# Returns the tool body to continue with, None after it was cut.
+def releaseToolBody(memoryGovernor: 'governor.MemoryGovernor', tempBrepMgr: adsk.fusion.TemporaryBRepManager, faceTempBody: adsk.fusion.BRepBody, toolBody: adsk.fusion.BRepBody) -> adsk.fusion.BRepBody:
+	if toolBody is None or not memoryGovernor.shouldRelease():
+		return toolBody
+	futil.log(f'Memory: {memoryGovernor.usage/1048576:.0f} MB, cutting partial tool body')
+	tempBrepMgr.booleanOperation(faceTempBody, toolBody, adsk.fusion.BooleanTypes.DifferenceBooleanType)
+	return None
+
+
+# Lazily opened disk cache of generated tool bodies
+def getResultCache() -> 'cache.ResultCache':
+	global resultCache
+	if resultCache is None:
+		from . import cache
+		resultCache = cache.ResultCache(config.CACHE_FOLDER, config.CACHE_MAX_BYTES)
+	return resultCache
+
+
+# Export tool body in image-local coordinates, so it can be placed on any face
+def exportCachedTool(tempBrepMgr: adsk.fusion.TemporaryBRepManager, toolBody: adsk.fusion.BRepBody, path: str, toolPlacement: adsk.core.Matrix3D) -> bool:
+	localBody = tempBrepMgr.copy(toolBody)
+	toLocal = toolPlacement.copy()
+	toLocal.invert()
+	tempBrepMgr.transform(localBody, toLocal)
+	return tempBrepMgr.exportToFile([localBody], path)
+
+
+# Import cached tool body and move it into toolPlacement
+def importCachedTool(tempBrepMgr: adsk.fusion.TemporaryBRepManager, path: str, toolPlacement: adsk.core.Matrix3D) -> adsk.fusion.BRepBody:
+	try:
+		bodies = tempBrepMgr.createFromFile(path)
+	except RuntimeError:
+		futil.log(f'Exception caught: {traceback.format_exc()}')
+		return None
+	toolBody = None
+	for body in bodies:
+		tempBrepMgr.transform(body, toolPlacement)
+		if toolBody is None:
+			toolBody = body
+		else:
+			tempBrepMgr.booleanOperation(toolBody, body, adsk.fusion.BooleanTypes.UnionBooleanType)
+	return toolBody
+
+
+# Placement of the image on face along base, memoized per face, base, height setting and image size
+def getPlacementFrame(inputs: adsk.core.CommandInputs, face: adsk.fusion.BRepFace, base: adsk.fusion.BRepEdge, imageWidth: int, imageHeight: int) -> 'placement.PlacementFrame':
+	edgeSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('heightEdgeSelector'))
+	heightInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('heightSelector'))
+
+	edge = None
+	if edgeSelectorInput.isVisible:
+		edge = adsk.fusion.BRepEdge.cast(edgeSelectorInput.selection(0).entity)
+		heightKey = ('Edge', edge.entityToken)
+	elif heightInput.isVisible:
+		heightKey = ('Distance', round(heightInput.value, 9))
+	else:
+		heightKey = ('Auto',)
+
+	key = (face.entityToken, base.entityToken, heightKey, imageWidth, imageHeight)
+	frame = placementFrames.get(key)
+	if frame is None:
+		from . import placement
+		coEdge = getCoEdge(base, face)
+		if coEdge is None:
+			raise Exception('No CoEdge found')
+		frame = placement.createFrame(face, base, coEdge, imageWidth, imageHeight, getImageHeight(inputs, base, imageWidth, imageHeight), getDepthPoint)
+		placementFrames[key] = frame
+	return frame
+
+
+# Height in cm of an image of imageWidth x imageHeight pixels spanning base
+def getImageHeight(inputs: adsk.core.CommandInputs, base: adsk.fusion.BRepEdge, imageWidth: int, imageHeight: int) -> float:
+	edgeSelectorInput = adsk.core.SelectionCommandInput.cast(inputs.itemById('heightEdgeSelector'))
+	heightInput = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('heightSelector'))
+	if edgeSelectorInput.isVisible:
+		return adsk.fusion.BRepEdge.cast(edgeSelectorInput.selection(0).entity).length
+	if heightInput.isVisible:
+		return heightInput.value
+	return base.length/imageWidth*imageHeight
+
+
+# Mask of image as grayscale image of the same size, dark pixels are masked. None without mask.
+def getMask(inputs: adsk.core.CommandInputs, image):
+	from . import loader
+	maskMode = adsk.core.DropDownCommandInput.cast(inputs.itemById('maskSelector')).selectedItem.name
+	if maskMode == 'Alpha Channel':
+		# Reduced like the image by the loader, only the print resampling is left
+		mask = imageLoad.alpha()
+		if mask is None:
+			futil.log('Mask: image has no alpha channel')
+			return None
+		return loader.resample(mask, image.size)
+	if maskMode == 'Mask Image':
+		return loader.loadMask(adsk.core.StringValueCommandInput.cast(inputs.itemById('selectedMaskFileName')).value, image.size)
+	if maskMode == 'Shade Threshold':
+		threshold = adsk.core.IntegerSliderCommandInput.cast(inputs.itemById('maskThresholdSelector')).valueOne
+		shades = image if image.mode == 'L' else image.point(lambda v: v/257).convert('L')
+		return shades.point(lambda v: 0 if v >= threshold else 255)
+	return None
+
+
+# Plan of the slab and outline operations, the engines that model regions plan the cuts into it.
+# fixBroken fills the maskRegions, or the whole image without them, below the face.
+def createGeometryPlan(imageWidth: int, imageHeight: int, depth: float, minThickness: float, isFlush: bool, fixBroken: bool, maskRegions: list, outlineFactor: float, cmPerPixel: tuple) -> 'plan.GeometryPlan':
+	from . import plan
+	slabs = [] if not fixBroken else maskRegions if maskRegions is not None else [(0, 0, imageWidth, imageHeight)]
+	outlineThickness = cmPerPixel[0]/outlineFactor if isFlush and outlineFactor > 0 else 0
+	return plan.GeometryPlan(imageWidth, imageHeight, depth, minThickness, isFlush, slabs, outlineThickness)
+
+
+# Rectangles (x0, y0, x1, y1) covering the unmasked pixels of maskImage, rows from the bottom up
+def getMaskRegions(maskImage) -> list:
+	from . import plan
+	imageWidth, imageHeight = maskImage.size
+	maskPlan = plan.createPlan(maskImage.point(lambda v: 1 if v >= 128 else 0).tobytes(), [0.0, 1.0], imageWidth, imageHeight, 0, 0, False)
+	return [region[:4] for region in maskPlan.regions()]
+
+
+# Resample image so no pixel is smaller than the print resolution
+def resampleForPrint(inputs: adsk.core.CommandInputs, base: adsk.fusion.BRepEdge, image):
+	from . import loader
+	pitch = adsk.core.DistanceValueCommandInput.cast(inputs.itemById('pitchSelector')).value
+	imageWidth, imageHeight = image.size
+	if pitch <= 0:
+		return image
+	height = getImageHeight(inputs, base, imageWidth, imageHeight)
+	# One factor for both axes keeps the aspect ratio, the finer axis sets it.
+	# Rounded down, so pixels never get smaller than the pitch, the tolerance only absorbs float error.
+	scale = min(1.0, base.length/(imageWidth*pitch), height/(imageHeight*pitch))
+	size = (max(1, math.floor(imageWidth*scale+1e-9)), max(1, math.floor(imageHeight*scale+1e-9)))
+	if size == image.size:
+		return image
+	startTime = time.perf_counter()
+	image = loader.resample(image, size)
+	futil.log(f'Resampled {imageWidth}x{imageHeight} to {size[0]}x{size[1]} px for {pitch*10:.2f} mm print resolution in {time.perf_counter()-startTime:.2f}s: {imageWidth*imageHeight/(size[0]*size[1]):.1f}x fewer pixels ({imageWidth*imageHeight} -> {size[0]*size[1]})')
+	return image
 
 
 # Point3D MidPoint
@@ -0,0 +1,139 @@
+import os, sys, time, ctypes, tracemalloc
+
+# Memory budget of a modelling run.
+# The governor samples the resident set size of the process and keeps the
+# peak growth per stage. The Python heap is traced with tracemalloc, which
+# slows every allocation down, only on request or when the resident set size
+# cannot be read. Above the soft limit
+# the caller should release memory, e.g. cut the partial tool body from the
+# result early. The soft limit then moves up halfway to the budget, so memory
+# the allocator does not give back does not trigger a release on every sample.
+# Exceeding the budget raises MemoryBudgetExceeded before Fusion runs out.
+
+SOFT_LIMIT = 0.5
+SAMPLE_SECONDS = 0.05
+
+
+class MemoryBudgetExceeded(Exception):
+	pass
+
+
+class MemoryGovernor:
+	def __init__(self, budget: int, softLimit: float = SOFT_LIMIT, tracePython: bool = False):
+		self.budget = budget
+		self.softLimit = budget*softLimit
+		self.flushes = 0
+		self.stageName = None
+		self.peaks = {}
+		self.usage = 0
+		self.lastSample = 0.0
+		rss = residentSetSize()
+		self.baseline = rss or 0
+		self.tracePython = tracePython or rss is None
+		self.startedTracing = self.tracePython and not tracemalloc.is_tracing()
+		if self.startedTracing:
+			tracemalloc.start()
+		self.stage('setup')
+
+	# Start stage name, following samples account to it
+	def stage(self, name: str):
+		self.stageName = name
+		self.peaks.setdefault(name, [0, 0])
+		if self.tracePython and tracemalloc.is_tracing():
+			tracemalloc.reset_peak()
+		self.sample(force=True)
+
+	# Memory growth in bytes since the governor was created, raises MemoryBudgetExceeded beyond the budget
+	def sample(self, force: bool = False) -> int:
+		now = time.perf_counter()
+		if not force and now-self.lastSample < SAMPLE_SECONDS:
+			return self.usage
+		self.lastSample = now
+		rss = residentSetSize()
+		pythonPeak = tracemalloc.get_traced_memory()[1] if self.tracePython and tracemalloc.is_tracing() else 0
+		self.usage = max(0, rss-self.baseline) if rss is not None else pythonPeak
+		peaks = self.peaks[self.stageName]
+		peaks[0] = max(peaks[0], self.usage)
+		peaks[1] = max(peaks[1], pythonPeak)
+		if self.usage > self.budget:
+			raise MemoryBudgetExceeded(f'Memory budget of {self.budget/1048576:.0f} MB exceeded in stage {self.stageName}.')
+		return self.usage
+
+	# True once usage passed the soft limit, which is raised for the next release
+	def shouldRelease(self) -> bool:
+		usage = self.sample()
+		if usage < self.softLimit:
+			return False
+		self.softLimit = usage+(self.budget-usage)/2
+		self.flushes += 1
+		return True
+
+	def close(self):
+		if self.startedTracing:
+			tracemalloc.stop()
+			self.startedTracing = False
+
+	def report(self) -> str:
+		lines = [f'{name}: {rss/1048576:.1f} MB process' + (f', {python/1048576:.1f} MB Python' if self.tracePython else '') for name, (rss, python) in self.peaks.items()]
+		lines.append(f'Budget: {self.budget/1048576:.0f} MB, early releases: {self.flushes}')
+		return '\n'.join(lines)
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+	_fields_ = [(name, ctypes.c_uint32) for name in ('cb', 'PageFaultCount')] + [(name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+
+class _MachTaskBasicInfo(ctypes.Structure):
+	_fields_ = [('virtual_size', ctypes.c_uint64), ('resident_size', ctypes.c_uint64), ('resident_size_max', ctypes.c_uint64), ('times', ctypes.c_int32*4), ('policy', ctypes.c_int32), ('suspend_count', ctypes.c_int32)]
+
+
+def _windowsRss():
+	counters = _ProcessMemoryCounters()
+	counters.cb = ctypes.sizeof(counters)
+	kernel32 = ctypes.windll.kernel32
+	kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+	if not kernel32.K32GetProcessMemoryInfo(ctypes.c_void_p(kernel32.GetCurrentProcess()), ctypes.byref(counters), counters.cb):
+		return None
+	return counters.WorkingSetSize
+
+
+_libc = None
+def _macRss():
+	global _libc
+	if _libc is None:
+		_libc = ctypes.CDLL(None)
+	MACH_TASK_BASIC_INFO = 20
+	info = _MachTaskBasicInfo()
+	count = ctypes.c_uint32(ctypes.sizeof(info)//4)
+	task = ctypes.c_uint32.in_dll(_libc, 'mach_task_self_')
+	if _libc.task_info(task, MACH_TASK_BASIC_INFO, ctypes.byref(info), ctypes.byref(count)) != 0:
+		return None
+	return info.resident_size
+
+
+def _linuxRss():
+	with open('/proc/self/statm') as f:
+		return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+
+
+# Peak instead of current size, used when nothing better is available
+def _maxRss():
+	import resource
+	maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return maxRss if sys.platform == 'darwin' else maxRss*1024
+
+
+_readers = [_windowsRss] if sys.platform == 'win32' else [_macRss, _maxRss] if sys.platform == 'darwin' else [_linuxRss, _maxRss]
+
+
+# Current resident set size of the process in bytes, None if unknown
+def residentSetSize():
+	while _readers:
+		try:
+			rss = _readers[0]()
+			if rss is not None:
+				return rss
+		except Exception:
+			pass
+		_readers.pop(0)
+	return None
@@ -0,0 +1,234 @@
+import math, mmap, threading
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError
+from ...lib.PIL import Image
+
+# Bounded memory image loading.
+# Images are reduced to at most maxPixels while decoding:
+#  - uncompressed files (PGM, BMP, raw TIFF strips, ...) are memory-mapped and
+#    reduced band by band, without ever decoding the full image,
+#  - JPEGs are decoded at a lower scale using the decoder draft mode,
+#  - everything else is decoded by Pillow and reduced afterwards.
+# 16 bit grayscale images are kept at 16 bit precision as mode 'I' (0-65535),
+# 32 bit integer images are clamped to that range, all other images are
+# converted to 8 bit grayscale (mode 'L'). The alpha channel of transparent
+# images is reduced by the same factor alongside, as 8 bit image.
+
+SIXTEEN_BIT_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I')
+RAW_MODES = SIXTEEN_BIT_MODES + ('L', 'RGB', 'RGBA', 'RGBX')
+RAW_BYTES_PER_PIXEL = {'L': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'RGBX': 4, 'BGRX': 4, 'BGRA': 4}
+BAND_PIXELS = 1 << 22
+
+# Decoding runs on a single worker thread, which never touches the Fusion API
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Image2Mono3D-loader')
+# Guards the process-global decompression bomb limit of Pillow, which openImage lifts briefly
+_bombLimitLock = threading.Lock()
+
+
+# Future-like handle of an image decoded in the background.
+# The worker reads the image size from the header and then decodes the
+# image and its alpha channel, size and image can be awaited separately.
+class ImageLoad:
+	def __init__(self, fileName: str, maxPixels: int):
+		self.fileName = fileName
+		self.maxPixels = maxPixels
+		self._cancelled = threading.Event()
+		self._size = Future()
+		self._image = Future()
+		_executor.submit(self._run)
+
+	# Size (width, height) of the loaded image
+	def size(self, timeout: float = None) -> tuple:
+		return self._size.result(timeout)
+
+	# Full resolution grayscale image
+	def result(self, timeout: float = None):
+		return self._image.result(timeout)[0]
+
+	# Alpha channel at the size of the result, None if the image has no transparency
+	def alpha(self, timeout: float = None):
+		return self._image.result(timeout)[1]
+
+	def done(self) -> bool:
+		return self._image.done()
+
+	# Whether size() returns without waiting, the worker may still decode a previous image
+	def sizeReady(self) -> bool:
+		return self._size.done() and not self._size.cancelled() and self._size.exception() is None
+
+	# Exception of a finished load, None while loading or on success
+	def exception(self):
+		return self._image.exception() if self._image.done() and not self._image.cancelled() else None
+
+	# Stop decoding, e.g. because another file was selected
+	def cancel(self):
+		self._cancelled.set()
+		for future in (self._size, self._image):
+			future.cancel()
+
+	def _run(self):
+		stages = (
+			(self._size, lambda: reducedSize(openImage(self.fileName).size, self.maxPixels)),
+			(self._image, lambda: loadImage(self.fileName, self.maxPixels, self._cancelled)),
+		)
+		for k, (future, stage) in enumerate(stages):
+			if not future.set_running_or_notify_cancel():
+				return
+			try:
+				future.set_result(stage())
+			except BaseException as ex:
+				# A failed stage fails all later ones
+				for later, _ in stages[k:]:
+					if later is future or later.set_running_or_notify_cancel():
+						later.set_exception(ex)
+				return
+
+
+# Number of shade levels of a loaded image
+def shadeLevels(image) -> int:
+	return 65536 if image.mode == 'I' else 256
+
+
+# Open fileName lazily, the decompression bomb check is left to loadImage
+def openImage(fileName: str):
+	with _bombLimitLock:
+		bombLimit = Image.MAX_IMAGE_PIXELS
+		Image.MAX_IMAGE_PIXELS = None
+		try:
+			return Image.open(fileName)
+		finally:
+			Image.MAX_IMAGE_PIXELS = bombLimit
+
+
+# Pillow's decompression bomb limit, never the lifted value of a concurrent openImage
+def bombLimit():
+	with _bombLimitLock:
+		return Image.MAX_IMAGE_PIXELS
+
+
+# Integer reduction factor to fit size into maxPixels
+def reductionFactor(size: tuple, maxPixels: int) -> int:
+	return max(1, math.ceil(math.sqrt(size[0]*size[1]/maxPixels)))
+
+
+# Size of an image of size after loading it with at most maxPixels pixels
+def reducedSize(size: tuple, maxPixels: int) -> tuple:
+	factor = reductionFactor(size, maxPixels)
+	return (max(1, size[0]//factor), max(1, size[1]//factor))
+
+
+# Load fileName as grayscale image with at most maxPixels pixels, returns (image, alpha).
+# alpha is None for images without transparency.
+# Raises CancelledError as soon as the cancelled event is set.
+def loadImage(fileName: str, maxPixels: int, cancelled: threading.Event = None) -> tuple:
+	image = openImage(fileName)
+	limit = bombLimit()
+	width, height = image.size
+	factor = reductionFactor(image.size, maxPixels)
+	targetMode = 'I' if image.mode in SIXTEEN_BIT_MODES else 'L'
+
+	raw = _loadRaw(image, fileName, factor, targetMode, cancelled)
+	if raw is not None:
+		return _clampShades(raw[0]), raw[1]
+
+	if image.format == 'JPEG' and factor > 1:
+		image.draft('L', (width//factor, height//factor))
+	elif limit and width*height > limit:
+		raise ValueError(f'Image too large to decode ({width}x{height}). Please use an uncompressed format (PGM, BMP, TIFF) or JPEG.')
+
+	alpha = None
+	if 'A' in image.getbands():
+		alpha = image.getchannel('A')
+	elif 'transparency' in image.info:
+		alpha = image.convert('RGBA').getchannel('A')
+	image = image.convert(targetMode)
+	if factor > 1:
+		# Scale of a draft decoded image, JPEGs have no alpha channel
+		scale = image.size[0]/width
+		targetWidth, targetHeight = max(1, width//factor), max(1, height//factor)
+		image = image.resize((targetWidth, targetHeight), Image.BOX, (0, 0, targetWidth*factor*scale, targetHeight*factor*scale))
+		if alpha is not None:
+			alpha = alpha.resize((targetWidth, targetHeight), Image.BOX, (0, 0, targetWidth*factor, targetHeight*factor))
+	return _clampShades(image), alpha
+
+
+# Clamp mode 'I' shades to 0-65535, the range of the depth lookup tables
+def _clampShades(image):
+	if image.mode != 'I':
+		return image
+	low, high = image.getextrema()
+	if low >= 0 and high <= 65535:
+		return image
+	return image.convert('I;16').convert('I')
+
+
+# Memory-mapped band by band reduction of uncompressed images to (image, alpha), None if not applicable
+def _loadRaw(image, fileName: str, factor: int, targetMode: str, cancelled: threading.Event = None):
+	width, height = image.size
+	strips = []
+	for tile in image.tile:
+		decoder, extents, offset, args = tile[:4]
+		rawmode = args[0] if isinstance(args, tuple) else args
+		if decoder != 'raw' or image.mode not in RAW_MODES or rawmode not in RAW_BYTES_PER_PIXEL:
+			return None
+		x0, y0, x1, y1 = extents
+		if x0 != 0 or x1 != width:
+			return None
+		stride = args[1] if isinstance(args, tuple) and len(args) > 1 and args[1] else width*RAW_BYTES_PER_PIXEL[rawmode]
+		orientation = args[2] if isinstance(args, tuple) and len(args) > 2 else 1
+		strips.append((y0, y1, offset, rawmode, stride, orientation))
+	if not strips:
+		return None
+
+	targetWidth, targetHeight = max(1, width//factor), max(1, height//factor)
+	reduced = Image.new(targetMode, (targetWidth, targetHeight))
+	alpha = Image.new('L', (targetWidth, targetHeight)) if 'A' in image.getbands() else None
+	bandRows = factor*max(1, BAND_PIXELS//(width*factor))
+	with open(fileName, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+		view = memoryview(data)
+		try:
+			for top in range(0, targetHeight*factor, bandRows):
+				if cancelled is not None and cancelled.is_set():
+					raise CancelledError()
+				bottom = min(top+bandRows, targetHeight*factor)
+				band = Image.new(image.mode, (width, bottom-top))
+				for y0, y1, offset, rawmode, stride, orientation in strips:
+					r0, r1 = max(top, y0), min(bottom, y1)
+					if r0 >= r1:
+						continue
+					# Rows of bottom-up strips are stored in reverse order
+					first = r0-y0 if orientation >= 0 else y1-r1
+					rows = view[offset+first*stride:offset+(first+r1-r0)*stride]
+					part = Image.frombuffer(image.mode, (width, r1-r0), rows, 'raw', rawmode, stride, orientation)
+					band.paste(part, (0, r0-top))
+					# Zero-copy images keep the mapping busy until released
+					del part, rows
+				reduced.paste(_reduceBand(band.convert(targetMode), targetWidth, factor), (0, top//factor))
+				if alpha is not None:
+					alpha.paste(_reduceBand(band.getchannel('A'), targetWidth, factor), (0, top//factor))
+				del band
+		finally:
+			view.release()
+	return reduced, alpha
+
+
+# Area average a band of whole factor x factor blocks to targetWidth
+def _reduceBand(band, targetWidth: int, factor: int):
+	if factor == 1:
+		return band
+	return band.resize((targetWidth, band.size[1]//factor), Image.BOX, (0, 0, targetWidth*factor, band.size[1]))
+
+
+# Reduce image to size with area averaging followed by Lanczos for the remaining fraction.
+# 16 bit images are area averaged only, Lanczos overshoots are not clamped in mode 'I'.
+def resample(image, size: tuple):
+	if size == image.size:
+		return image
+	if image.mode == 'I':
+		return image.resize(size, Image.BOX)
+	return image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+
+# Grayscale mask image fileName at size
+def loadMask(fileName: str, size: tuple):
+	mask = openImage(fileName).convert('L')
+	return mask if mask.size == size else mask.resize(size, Image.BOX)
@@ -0,0 +1,292 @@
+import struct, zipfile
+from . import plan
+
+# Streaming mesh output of lithophanes.
+# The lithophane is meshed as one column per pixel, row by row, keeping only
+# two rows of cut depths in memory. Triangles are written straight to disk in
+# fixed size batches, so the memory use does not depend on the image size.
+#
+# Rows are lists of cut depths (cm) per pixel, starting at the bottom row.
+# Coordinates are image-local: x along the width, y along the height and z
+# along the face normal with the face at z=0. Files are written in mm.
+
+MM_PER_CM = 10
+BATCH_BYTES = 1 << 20
+
+
+# Binary STL writer, the triangle count is patched in when closing
+class StlWriter:
+	TRIANGLE = struct.Struct('<12fH')
+
+	def __init__(self, path: str):
+		self.file = open(path, 'wb')
+		self.file.write(b'Image2Mono3D'.ljust(80, b' '))
+		self.file.write(struct.pack('<I', 0))
+		self.buffer = bytearray()
+		self.count = 0
+
+	def add(self, normal, v0, v1, v2):
+		self.buffer += self.TRIANGLE.pack(*normal, *v0, *v1, *v2, 0)
+		self.count += 1
+		if len(self.buffer) >= BATCH_BYTES:
+			self.file.write(self.buffer)
+			self.buffer = bytearray()
+
+	def close(self):
+		self.file.write(self.buffer)
+		self.buffer = bytearray()
+		self.file.seek(80)
+		self.file.write(struct.pack('<I', self.count))
+		self.file.close()
+
+
+# 3MF package writer. The model lists vertices before triangles, so the
+# triangles are generated twice: once for the vertices, once for the indices.
+# Triangles share their vertices, as the 3MF core spec requires of a manifold mesh.
+class ThreeMFWriter:
+	CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+		'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+		'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+		'<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+		'</Types>')
+	RELATIONSHIPS = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+		'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+		'<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+		'</Relationships>')
+
+	def __init__(self, path: str):
+		self.package = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+		self.package.writestr('[Content_Types].xml', self.CONTENT_TYPES)
+		self.package.writestr('_rels/.rels', self.RELATIONSHIPS)
+
+	# triangles is a callable returning a fresh triangle iterator on every call
+	def write(self, triangles):
+		with self.package.open('3D/3dmodel.model', 'w', force_zip64=True) as model:
+			buffer = []
+			size = 0
+			def emit(text):
+				nonlocal size
+				buffer.append(text)
+				size += len(text)
+				if size >= BATCH_BYTES:
+					model.write(''.join(buffer).encode())
+					buffer.clear()
+					size = 0
+
+			emit('<?xml version="1.0" encoding="UTF-8"?>\n'
+				'<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">'
+				'<resources><object id="1" type="model"><mesh><vertices>\n')
+			vertexIndex = VertexIndex()
+			added = []
+			for normal, *vertices in triangles():
+				vertexIndex.indices(vertices, added)
+				for x, y, z in added:
+					emit(f'<vertex x="{x:.5f}" y="{y:.5f}" z="{z:.5f}"/>\n')
+				added.clear()
+			emit('</vertices><triangles>\n')
+			# Same triangles, same order, so the indices match the vertices written above
+			vertexIndex = VertexIndex()
+			for normal, *vertices in triangles():
+				v1, v2, v3 = vertexIndex.indices(vertices)
+				emit(f'<triangle v1="{v1}" v2="{v2}" v3="{v3}"/>\n')
+			emit('</triangles></mesh></object></resources><build><item objectid="1"/></build></model>\n')
+			model.write(''.join(buffer).encode())
+
+	def close(self):
+		self.package.close()
+
+
+# Indices of the vertices of a triangle stream that advances row by row along y.
+# Vertices are shared by all triangles of the current row band. No triangle reaches
+# below the lowest y of the triangle before it within a band, so older vertices are
+# dropped and the memory use does not depend on the image size.
+class VertexIndex:
+	def __init__(self):
+		self.count = 0
+		# y -> {vertex: index}
+		self.bands = {}
+		self.floor = None
+
+	# Indices of vertices, new vertices are appended to added in index order
+	def indices(self, vertices, added: list = None) -> list:
+		floor = min(vertex[1] for vertex in vertices)
+		if floor != self.floor:
+			self.floor = floor
+			for y in [y for y in self.bands if y < floor]:
+				del self.bands[y]
+		indices = []
+		for vertex in vertices:
+			band = self.bands.setdefault(vertex[1], {})
+			index = band.get(vertex)
+			if index is None:
+				index = band[vertex] = self.count
+				self.count += 1
+				if added is not None:
+					added.append(vertex)
+			indices.append(index)
+		return indices
+
+
+# Write the lithophane mesh to path, the format is taken from the extension (.stl or .3mf).
+# rows is a callable returning a fresh iterator over the rows of cut depths, the image size,
+# depths, mode and outline are taken from geometryPlan.
+def writeLithophane(path: str, rows, geometryPlan: plan.GeometryPlan, cmPerPixel: tuple):
+	triangles = lambda: lithophaneTriangles(rows(), geometryPlan, cmPerPixel)
+	if path.lower().endswith('.3mf'):
+		writer = ThreeMFWriter(path)
+		try:
+			writer.write(triangles)
+		finally:
+			writer.close()
+	else:
+		writer = StlWriter(path)
+		try:
+			for triangle in triangles():
+				writer.add(*triangle)
+		finally:
+			writer.close()
+
+
+# Triangles (normal, v0, v1, v2) of the lithophane in mm.
+# Classic: pixel columns from the bottom up to the cut surface.
+# Flush: a closed slab with a cavity of pixel columns starting minThickness/2 above the bottom,
+# the cavity is inset by outlineThickness along the image border. Without an outline it still
+# keeps a rim of minThickness/2 to the sides of the slab, at most a third of the border pixels,
+# so no cavity wall lies in the plane of an outer face.
+def lithophaneTriangles(rows, geometryPlan: plan.GeometryPlan, cmPerPixel: tuple):
+	depth, minThickness = geometryPlan.depth, geometryPlan.minThickness
+	xs = [i*cmPerPixel[0]*MM_PER_CM for i in range(geometryPlan.imageWidth+1)]
+	ys = [j*cmPerPixel[1]*MM_PER_CM for j in range(geometryPlan.imageHeight+1)]
+	bottom = -depth*MM_PER_CM
+
+	if not geometryPlan.isFlush:
+		heights = ([-cut*MM_PER_CM for cut in row] for row in rows)
+		yield from columnTriangles(heights, xs, ys, bottom, False)
+		return
+
+	yield from boxTriangles(xs[0], ys[0], bottom, xs[-1], ys[-1], 0)
+	for coordinates in (xs, ys):
+		pixel = coordinates[1]-coordinates[0]
+		rim = min(max(minThickness/2*MM_PER_CM, pixel/100), pixel/3)
+		inset = max(min(geometryPlan.outlineThickness*MM_PER_CM, pixel), rim)
+		coordinates[0], coordinates[-1] = coordinates[0]+inset, coordinates[-1]-inset
+	floor = -(depth-minThickness/2)*MM_PER_CM
+	heights = ([floor+cut*MM_PER_CM for cut in row] for row in rows)
+	yield from columnTriangles(heights, xs, ys, floor, True)
+
+
+# Axis aligned box, outward facing
+def boxTriangles(x0, y0, z0, x1, y1, z1):
+	yield from _quad((0, 0, -1), (x0, y0, z0), (x0, y1, z0), (x1, y1, z0), (x1, y0, z0))
+	yield from _quad((0, 0, 1), (x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1))
+	yield from _quad((-1, 0, 0), (x0, y0, z0), (x0, y0, z1), (x0, y1, z1), (x0, y1, z0))
+	yield from _quad((1, 0, 0), (x1, y0, z0), (x1, y1, z0), (x1, y1, z1), (x1, y0, z1))
+	yield from _quad((0, -1, 0), (x0, y0, z0), (x1, y0, z0), (x1, y0, z1), (x0, y0, z1))
+	yield from _quad((0, 1, 0), (x0, y1, z0), (x0, y1, z1), (x1, y1, z1), (x1, y1, z0))
+
+
+# Union of pixel columns reaching from base up to the height of each pixel.
+# Pixels at base height are empty. inverted flips all faces, for cavities.
+# The side of a wall is split at every height meeting at its pixel corner, so all
+# faces share their vertices and edges, without T-junctions. Rows are read one
+# ahead for the corners along the top of a row.
+def columnTriangles(heights, xs: list, ys: list, base: float, inverted: bool):
+	width = len(xs)-1
+	empty = [base]*width
+	rows = iter(heights)
+	previous, row = empty, next(rows, None)
+	j = 0
+	while row is not None:
+		following = next(rows, None)
+		upper = following if following is not None else empty
+		y0, y1 = ys[j], ys[j+1]
+		for i, h in enumerate(row):
+			if h == base:
+				continue
+			x0, x1 = xs[i], xs[i+1]
+			yield from _face((0, 0, 1), inverted, (x0, y0, h), (x1, y0, h), (x1, y1, h), (x0, y1, h))
+			yield from _face((0, 0, -1), inverted, (x0, y0, base), (x0, y1, base), (x1, y1, base), (x1, y0, base))
+		# Walls along x, including both image borders
+		for i in range(width+1):
+			left = row[i-1] if i > 0 else base
+			right = row[i] if i < width else base
+			if left == right:
+				continue
+			x = xs[i]
+			lo, hi = min(left, right), max(left, right)
+			below, above = _cornerHeights(previous, row, i, base), _cornerHeights(row, upper, i, base)
+			if left > right:
+				yield from _wall((1, 0, 0), inverted, (x, y0), (x, y1), lo, hi, below, above)
+			else:
+				yield from _wall((-1, 0, 0), inverted, (x, y1), (x, y0), lo, hi, above, below)
+		# Walls along y towards the previous row
+		yield from _rowWalls(previous, row, xs, y0, base, inverted)
+		previous, row = row, following
+		j += 1
+	if j > 0:
+		yield from _rowWalls(previous, empty, xs, ys[j], base, inverted)
+
+
+def _rowWalls(lower: list, upper: list, xs: list, y: float, base: float, inverted: bool):
+	for i, (a, b) in enumerate(zip(lower, upper)):
+		if a == b:
+			continue
+		lo, hi = min(a, b), max(a, b)
+		left, right = _cornerHeights(lower, upper, i, base), _cornerHeights(lower, upper, i+1, base)
+		if a > b:
+			yield from _wall((0, 1, 0), inverted, (xs[i+1], y), (xs[i], y), lo, hi, right, left)
+		else:
+			yield from _wall((0, -1, 0), inverted, (xs[i], y), (xs[i+1], y), lo, hi, left, right)
+
+
+# Heights of the up to four pixels around corner i between the rows lower and upper
+def _cornerHeights(lower: list, upper: list, i: int, base: float) -> set:
+	if i == 0:
+		return {base, lower[0], upper[0]}
+	if i == len(lower):
+		return {base, lower[i-1], upper[i-1]}
+	return {lower[i-1], lower[i], upper[i-1], upper[i]}
+
+
+# Vertical wall from lo to hi between the corners a and b (x, y), counter-clockwise
+# seen from outside when running from a to b along the bottom. The sides at a and b
+# are split at the heights in cutsA and cutsB.
+def _wall(normal, inverted, a, b, lo, hi, cutsA, cutsB):
+	sideA = [lo] + sorted(z for z in cutsA if lo < z < hi) + [hi]
+	sideB = [lo] + sorted(z for z in cutsB if lo < z < hi) + [hi]
+	(ax, ay), (bx, by) = a, b
+	if inverted:
+		normal = (-normal[0], -normal[1], -normal[2])
+	k = m = 0
+	while k < len(sideA)-1 or m < len(sideB)-1:
+		if m < len(sideB)-1 and (k == len(sideA)-1 or sideB[m+1] <= sideA[k+1]):
+			triangle = ((ax, ay, sideA[k]), (bx, by, sideB[m]), (bx, by, sideB[m+1]))
+			m += 1
+		else:
+			triangle = ((ax, ay, sideA[k]), (bx, by, sideB[m]), (ax, ay, sideA[k+1]))
+			k += 1
+		yield (normal, triangle[0], triangle[2], triangle[1]) if inverted else (normal, *triangle)
+
+
+def _face(normal, inverted, p0, p1, p2, p3):
+	if inverted:
+		yield from _quad((-normal[0], -normal[1], -normal[2]), p3, p2, p1, p0)
+	else:
+		yield from _quad(normal, p0, p1, p2, p3)
+
+
+# Quad p0..p3 counter-clockwise seen from outside
+def _quad(normal, p0, p1, p2, p3):
+	yield (normal, p0, p1, p2)
+	yield (normal, p0, p2, p3)
+
+
+# Rows of shades of a grayscale image from the bottom up, decoded band by band
+def imageRows(image, bandHeight: int = 64):
+	width, height = image.size
+	for top in range(height, 0, -bandHeight):
+		band = image.crop((0, max(0, top-bandHeight), width, top))
+		# 8 bit shades are read as bytes, 16 bit shades (mode 'I') as a list of ints
+		band = band.tobytes() if band.mode == 'L' else list(band.getdata())
+		for y in range(len(band)//width - 1, -1, -1):
+			yield band[y*width:(y+1)*width]
@@ -0,0 +1,82 @@
+import adsk.core, adsk.fusion
+from dataclasses import dataclass
+
+# Placement of the image on the selected face.
+# A frame is computed once per face, base edge, height setting and image size
+# and shared by the preview and all execute paths, so changes of the shading
+# or thickness inputs never recompute the pixel vectors or ray cast the depth.
+# Geometry is kept as coordinate tuples and handed out as new adsk objects,
+# so callers are free to modify what they get.
+@dataclass(frozen=True)
+class PlacementFrame:
+	imageWidth: int
+	imageHeight: int
+	cmPerPixel: tuple
+	originCoordinates: tuple
+	pixelWidthCoordinates: tuple
+	pixelHeightCoordinates: tuple
+	faceNormalCoordinates: tuple
+	# Thickness of the body below the first pixel, None if the ray cast missed
+	measuredDepth: float
+
+	# World position of the bottom left image corner
+	@property
+	def origin(self) -> adsk.core.Point3D:
+		return adsk.core.Point3D.create(*self.originCoordinates)
+
+	@property
+	def pixelWidthVector(self) -> adsk.core.Vector3D:
+		return adsk.core.Vector3D.create(*self.pixelWidthCoordinates)
+
+	@property
+	def pixelHeightVector(self) -> adsk.core.Vector3D:
+		return adsk.core.Vector3D.create(*self.pixelHeightCoordinates)
+
+	@property
+	def faceNormal(self) -> adsk.core.Vector3D:
+		return adsk.core.Vector3D.create(*self.faceNormalCoordinates)
+
+	# Depth of the lithophane, falls back to just above minThickness if the depth is unknown
+	def depth(self, minThickness: float) -> float:
+		return minThickness+0.1 if self.measuredDepth is None else self.measuredDepth
+
+	# World position of pixel corner (x, y)
+	def corner(self, x: float, y: float) -> adsk.core.Point3D:
+		return adsk.core.Point3D.create(*(o + x*w + y*h for o, w, h in zip(self.originCoordinates, self.pixelWidthCoordinates, self.pixelHeightCoordinates)))
+
+	# Matrix mapping image-local coordinates (x along the width, y along the height, z along the normal) onto the face
+	def placement(self) -> adsk.core.Matrix3D:
+		xAxis = self.pixelWidthVector
+		xAxis.normalize()
+		yAxis = self.pixelHeightVector
+		yAxis.normalize()
+		matrix = adsk.core.Matrix3D.create()
+		matrix.setWithCoordinateSystem(self.origin, xAxis, yAxis, xAxis.crossProduct(yAxis))
+		return matrix
+
+
+# Frame of an image of imageWidth x imageHeight pixels spanning base, which is height cm high.
+# coEdge orients base along face, depthAt(face, point) returns (hitPoint, depth) below point.
+def createFrame(face: adsk.fusion.BRepFace, base: adsk.fusion.BRepEdge, coEdge: adsk.fusion.BRepCoEdge, imageWidth: int, imageHeight: int, height: float, depthAt) -> PlacementFrame:
+	cmPerPixel = (base.length/imageWidth, height/imageHeight)
+
+	origin = base.startVertex.geometry
+	widthEndPoint = base.endVertex.geometry
+	if coEdge.isOpposedToEdge:
+		origin, widthEndPoint = widthEndPoint, origin
+
+	faceNormal = face.evaluator.getNormalAtPoint(origin)[1]
+	faceNormal.normalize()
+
+	pixelWidthVector = origin.vectorTo(widthEndPoint)
+	pixelWidthVector.scaleBy(1/imageWidth)
+	pixelHeightVector = faceNormal.crossProduct(pixelWidthVector)
+	pixelHeightVector.normalize()
+	pixelHeightVector.scaleBy(cmPerPixel[1])
+
+	pixelOnePV = origin.asVector()
+	pixelOnePV.add(pixelHeightVector)
+	pixelOnePV.add(pixelWidthVector)
+	depthPoint, depth = depthAt(face, pixelOnePV.asPoint())
+
+	return PlacementFrame(imageWidth, imageHeight, cmPerPixel, tuple(origin.asArray()), tuple(pixelWidthVector.asArray()), tuple(pixelHeightVector.asArray()), tuple(faceNormal.asArray()), None if depthPoint is None else depth)
@@ -0,0 +1,161 @@
+import struct, sys
+from array import array
+
+# Backend neutral geometry plan of a lithophane.
+# The planner decides what to cut where and how deep without touching the
+# Fusion API: equal depth runs of every row are merged with identical runs of
+# the rows above into rectangles. Besides the cuts the plan holds the slabs
+# filled below the face before cutting (fix broken) and the width of the flush
+# outline frame. Executors then turn the plan into temporary bodies, sketch
+# extrudes or a mesh file. Plans serialize to a compact binary form, so they
+# can be computed, stored and compared outside of Fusion.
+#
+# Coordinates are in pixel units with (0, 0) at the bottom left corner of the
+# image, matching the row order of the flipped image buffer. Depths are cut
+# depths in cm.
+
+MAGIC = b'I2M3PLAN'
+VERSION = 3
+HEADER = struct.Struct('<8sHIIdddBIII')
+FLUSH = 1
+
+
+# Cut regions (x0, y0, x1, y1, depth) plus the slab and outline operations.
+# Regions are kept in flat arrays, depths as indices into a table of distinct depths.
+class GeometryPlan:
+	def __init__(self, imageWidth: int, imageHeight: int, depth: float, minThickness: float, isFlush: bool, slabs: list = (), outlineThickness: float = 0):
+		self.imageWidth = imageWidth
+		self.imageHeight = imageHeight
+		self.depth = depth
+		self.minThickness = minThickness
+		self.isFlush = isFlush
+		# Width of the flush outline frame along the image border in cm, 0 for none
+		self.outlineThickness = outlineThickness
+		self.depths = array('d')
+		self.depthIndices = {}
+		self.rects = array('I')
+		# Rectangles (x0, y0, x1, y1) filled below the face up to depth before cutting
+		self.slabRects = array('I')
+		for slab in slabs:
+			self.slabRects.extend(slab)
+
+	def __len__(self) -> int:
+		return len(self.rects)//5
+
+	def __eq__(self, other) -> bool:
+		return isinstance(other, GeometryPlan) and self.serialize() == other.serialize()
+
+	def addRegion(self, x0: int, y0: int, x1: int, y1: int, depth: float):
+		index = self.depthIndices.get(depth)
+		if index is None:
+			index = self.depthIndices[depth] = len(self.depths)
+			self.depths.append(depth)
+		self.rects.extend((x0, y0, x1, y1, index))
+
+	# Regions as (x0, y0, x1, y1, depth)
+	def regions(self):
+		rects, depths = self.rects, self.depths
+		for i in range(0, len(rects), 5):
+			yield rects[i], rects[i+1], rects[i+2], rects[i+3], depths[rects[i+4]]
+
+	# Slabs as (x0, y0, x1, y1)
+	def slabs(self) -> list:
+		rects = self.slabRects
+		return [tuple(rects[i:i+4]) for i in range(0, len(rects), 4)]
+
+	# True if a single slab fills the whole image region
+	def fillsImage(self) -> bool:
+		return self.slabs() == [(0, 0, self.imageWidth, self.imageHeight)]
+
+	# Regions grouped by depth, shallowest first
+	def byDepth(self) -> dict:
+		groups = {}
+		for x0, y0, x1, y1, depth in self.regions():
+			groups.setdefault(depth, []).append((x0, y0, x1, y1))
+		return {depth: groups[depth] for depth in sorted(groups)}
+
+	def pixelCount(self) -> int:
+		return sum((x1-x0)*(y1-y0) for x0, y0, x1, y1, _ in self.regions())
+
+	# Distance below the face at which a cut of cutDepth starts, flush cuts end at the minimum thickness
+	def cutTop(self, cutDepth: float) -> float:
+		return self.depth-cutDepth-self.minThickness/2 if self.isFlush else 0
+
+	# Plan the cuts of an iterable of shade rows from the bottom up with the depth lookup table lut, once per plan
+	def planRows(self, rows, lut: list):
+		# Rectangles still growing upwards, (x0, x1, depth) -> y0
+		growing = {}
+		for y, shades in enumerate(rows):
+			row = [lut[shade] for shade in shades]
+			current = {}
+			x = 0
+			while x < self.imageWidth:
+				end = x+1
+				while end < self.imageWidth and row[end] == row[x]:
+					end += 1
+				if row[x] > 0:
+					run = (x, end, row[x])
+					current[run] = growing.pop(run, y)
+				x = end
+			for (x0, x1, runDepth), y0 in growing.items():
+				self.addRegion(x0, y0, x1, y, runDepth)
+			growing = current
+		for (x0, x1, runDepth), y0 in growing.items():
+			self.addRegion(x0, y0, x1, self.imageHeight, runDepth)
+
+	def serialize(self) -> bytes:
+		flags = FLUSH if self.isFlush else 0
+		header = HEADER.pack(MAGIC, VERSION, self.imageWidth, self.imageHeight, self.depth, self.minThickness, self.outlineThickness, flags, len(self.depths), len(self), len(self.slabRects)//4)
+		return header + _littleEndian(self.depths).tobytes() + _littleEndian(self.rects).tobytes() + _littleEndian(self.slabRects).tobytes()
+
+	@classmethod
+	def deserialize(cls, data: bytes):
+		magic, version, imageWidth, imageHeight, depth, minThickness, outlineThickness, flags, depthCount, regionCount, slabCount = HEADER.unpack_from(data)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('Not a geometry plan of a supported version')
+		plan = cls(imageWidth, imageHeight, depth, minThickness, bool(flags & FLUSH), outlineThickness=outlineThickness)
+		offset = HEADER.size
+		plan.depths.frombytes(data[offset:offset+depthCount*plan.depths.itemsize])
+		offset += depthCount*plan.depths.itemsize
+		plan.rects.frombytes(data[offset:offset+regionCount*5*plan.rects.itemsize])
+		offset += regionCount*5*plan.rects.itemsize
+		plan.slabRects.frombytes(data[offset:offset+slabCount*4*plan.slabRects.itemsize])
+		plan.depths = _littleEndian(plan.depths)
+		plan.rects = _littleEndian(plan.rects)
+		plan.slabRects = _littleEndian(plan.slabRects)
+		plan.depthIndices = {d: i for i, d in enumerate(plan.depths)}
+		return plan
+
+	def save(self, path: str):
+		with open(path, 'wb') as f:
+			f.write(self.serialize())
+
+	@classmethod
+	def load(cls, path: str):
+		with open(path, 'rb') as f:
+			return cls.deserialize(f.read())
+
+
+# Rows of pixels (shades, rows from the bottom up)
+def pixelRows(pixels, imageWidth: int, imageHeight: int):
+	return (pixels[y*imageWidth:(y+1)*imageWidth] for y in range(imageHeight))
+
+
+# Plan the cuts of pixels (shades, rows from the bottom up) with the depth lookup table lut
+def createPlan(pixels, lut: list, imageWidth: int, imageHeight: int, depth: float, minThickness: float, isFlush: bool, slabs: list = (), outlineThickness: float = 0) -> GeometryPlan:
+	return createPlanFromRows(pixelRows(pixels, imageWidth, imageHeight), lut, imageWidth, imageHeight, depth, minThickness, isFlush, slabs, outlineThickness)
+
+
+# Plan the cuts of an iterable of shade rows from the bottom up, e.g. streamed by mesh.imageRows
+def createPlanFromRows(rows, lut: list, imageWidth: int, imageHeight: int, depth: float, minThickness: float, isFlush: bool, slabs: list = (), outlineThickness: float = 0) -> GeometryPlan:
+	plan = GeometryPlan(imageWidth, imageHeight, depth, minThickness, isFlush, slabs, outlineThickness)
+	plan.planRows(rows, lut)
+	return plan
+
+
+# Arrays are stored little endian, big endian machines swap a copy
+def _littleEndian(values: array) -> array:
+	if sys.byteorder == 'big':
+		values = array(values.typecode, values)
+		values.byteswap()
+	return values
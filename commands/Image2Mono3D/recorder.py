@@ -0,0 +1,120 @@
+import gzip, itertools, json, os, platform, sys, time
+
+# Opt-in recorder of Fusion API calls.
+# Every run records into its own trace, so concurrent background jobs do not
+# mix or cut each other's traces. Objects wrapped with wrap() are replaced by
+# proxies of the run's trace. Every method call and property assignment on a
+# proxy is written to a gzip compressed trace with the Python call stack leading to it, its
+# arguments, the shape of its result and its duration. tools/replay.py turns
+# traces into folded stacks, a flame graph and a call histogram.
+#
+# Trace format: a JSON header line, then one tab separated record per call:
+# stack (';' separated), call, start (us), duration (us), arguments, result.
+
+TRACE_VERSION = 1
+PACKAGE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Recorder:
+	# Raises FileExistsError if path exists, traces are never overwritten
+	def __init__(self, path: str):
+		self.path = path
+		self.file = gzip.open(path, 'xt', encoding='utf-8')
+		self.startTime = time.perf_counter()
+		self.calls = 0
+		self.file.write(json.dumps({'version': TRACE_VERSION, 'created': time.time(), 'platform': platform.platform(), 'python': sys.version.split()[0]})+'\n')
+
+	def record(self, call: str, start: float, duration: float, args: tuple, result):
+		stack = ';'.join(_callStack(sys._getframe(2)))
+		arguments = ','.join(_shape(arg) for arg in args)
+		self.file.write(f'{stack}\t{call}\t{int((start-self.startTime)*1e6)}\t{int(duration*1e6)}\t{arguments}\t{_shape(result)}\n')
+		self.calls += 1
+
+	def close(self):
+		self.file.close()
+
+
+# Proxy recording the method calls and property assignments of target into trace
+class _Proxy:
+	__slots__ = ('_target', '_name', '_trace')
+
+	def __init__(self, trace: Recorder, target, name: str):
+		object.__setattr__(self, '_target', target)
+		object.__setattr__(self, '_name', name)
+		object.__setattr__(self, '_trace', trace)
+
+	def __getattr__(self, attribute: str):
+		value = getattr(self._target, attribute)
+		if not callable(value):
+			return value
+		call = f'{self._name}.{attribute}'
+		def recorded(*args, **kwargs):
+			args = tuple(_unwrap(arg) for arg in args)
+			start = time.perf_counter()
+			result = value(*args, **kwargs)
+			self._trace.record(call, start, time.perf_counter()-start, args, result)
+			return result
+		return recorded
+
+	def __setattr__(self, attribute: str, value):
+		start = time.perf_counter()
+		setattr(self._target, attribute, _unwrap(value))
+		self._trace.record(f'{self._name}.{attribute}=', start, time.perf_counter()-start, (value,), None)
+
+
+# Start recording into a new trace in folder, runs starting in the same second get numbered traces
+def start(folder: str) -> Recorder:
+	os.makedirs(folder, exist_ok=True)
+	name = time.strftime('trace-%Y%m%d-%H%M%S')
+	for number in itertools.count():
+		try:
+			return Recorder(os.path.join(folder, f'{name}-{number}.tsv.gz' if number else f'{name}.tsv.gz'))
+		except FileExistsError:
+			pass
+
+
+# Stop recording into trace, nothing to do for None
+def stop(trace: Recorder):
+	if trace is not None:
+		trace.close()
+
+
+# Proxy of target recording its calls as name.method into trace, target itself without trace
+def wrap(trace: Recorder, target, name: str):
+	if trace is None or target is None:
+		return target
+	return _Proxy(trace, target, name)
+
+
+def _unwrap(value):
+	return object.__getattribute__(value, '_target') if isinstance(value, _Proxy) else value
+
+
+# Functions of the add-in on the stack, outermost first
+def _callStack(frame) -> list:
+	stack = []
+	while frame is not None:
+		if frame.f_code.co_filename.startswith(PACKAGE_FOLDER):
+			stack.append(frame.f_code.co_name)
+		frame = frame.f_back
+	return stack[::-1]
+
+
+# Compact description of a value: numbers as is, everything else by type and size
+def _shape(value) -> str:
+	if value is None:
+		return '-'
+	if isinstance(value, bool):
+		return str(value)
+	if isinstance(value, int):
+		return str(value)
+	if isinstance(value, float):
+		return f'{value:.6g}'
+	if isinstance(value, str):
+		return f'str[{len(value)}]'
+	if isinstance(value, (list, tuple)):
+		return f'{type(value).__name__}[{len(value)}]'
+	count = getattr(value, 'count', None)
+	if isinstance(count, int):
+		return f'{type(value).__name__}[{count}]'
+	return type(value).__name__
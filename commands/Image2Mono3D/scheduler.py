@@ -0,0 +1,89 @@
+import adsk.core
+import time, traceback
+from collections import deque
+from ...lib import fusion360utils as futil
+
+# Cooperative time-sliced execution of long running jobs.
+# A job is a generator that yields after every small unit of Fusion API work.
+# Each slice runs in a custom event handler on the main thread and advances the
+# current job until its time budget is used up, then fires the event again so
+# Fusion processes UI events in between. The number of steps per slice adapts
+# to the measured cost of a step.
+
+SLICE_SECONDS = 0.05
+
+app = adsk.core.Application.get()
+
+
+# Named generator of steps
+class Job:
+	def __init__(self, name: str, steps):
+		self.name = name
+		self.steps = steps
+		self.stepCount = 0
+		self.elapsed = 0.0
+		self.finished = False
+
+	def cancel(self):
+		self.steps.close()
+		self.finished = True
+
+
+class Scheduler:
+	def __init__(self, eventId: str, budget: float = SLICE_SECONDS):
+		self.eventId = eventId
+		self.budget = budget
+		self.jobs = deque()
+		# Moving average of the seconds per step
+		self.stepCost = budget
+		self.event = app.registerCustomEvent(eventId)
+		self.handler = futil.add_handler(self.event, self._onSlice)
+
+	# Queue job, jobs run one after another
+	def submit(self, job: Job):
+		self.jobs.append(job)
+		if len(self.jobs) == 1:
+			self._fire()
+
+	def cancelAll(self):
+		while self.jobs:
+			self.jobs.popleft().cancel()
+
+	def stop(self):
+		self.cancelAll()
+		self.event.remove(self.handler)
+		app.unregisterCustomEvent(self.eventId)
+
+	def _fire(self):
+		app.fireCustomEvent(self.eventId)
+
+	def _onSlice(self, args: adsk.core.CustomEventArgs):
+		startTime = time.perf_counter()
+		deadline = startTime+self.budget
+		while self.jobs:
+			job = self.jobs[0]
+			now = time.perf_counter()
+			if now >= deadline:
+				break
+			batch = max(1, int((deadline-now)/self.stepCost))
+			batchStart = now
+			steps = 0
+			try:
+				for _ in range(batch):
+					next(job.steps)
+					steps += 1
+			except StopIteration:
+				job.finished = True
+			except Exception:
+				futil.log(f'{job.name}: Exception caught: {traceback.format_exc()}')
+				job.finished = True
+			now = time.perf_counter()
+			if steps > 0:
+				self.stepCost = 0.5*self.stepCost + 0.5*(now-batchStart)/steps
+			job.stepCount += steps
+			job.elapsed += now-batchStart
+			if job.finished:
+				self.jobs.popleft()
+				futil.log(f'{job.name}: finished {job.stepCount} steps in {job.elapsed:.2f}s')
+		if self.jobs:
+			self._fire()
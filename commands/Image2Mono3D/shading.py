@@ -0,0 +1,77 @@
+# Shade to depth mapping.
+# All modelling engines cut pixels by depth rather than by raw shade, so
+# shades which end up at the same depth (e.g. clamped by the shift
+# correction) are merged into a single cut.
+
+# Depth values are rounded to this many decimals (cm) to merge equal depths
+DEPTH_DIGITS = 6
+
+
+# Parse a tone curve given as 'in:out' control points on the 0-255 scale, e.g. '0:0, 128:96, 255:255'
+def parseToneCurve(text: str) -> list:
+	points = []
+	for item in text.replace(';', ',').split(','):
+		if not item.strip():
+			continue
+		shade, value = item.split(':')
+		points.append((float(shade)/255, float(value)/255))
+	points.sort()
+	if len(points) == 1:
+		raise ValueError('A tone curve needs at least two points.')
+	for shade, value in points:
+		if not (0 <= shade <= 1 and 0 <= value <= 1):
+			raise ValueError('Tone curve points must be within 0-255.')
+	return points
+
+
+# Evaluate a piecewise linear tone curve at normalized shade x
+def applyToneCurve(points: list, x: float) -> float:
+	if not points:
+		return x
+	if x <= points[0][0]:
+		return points[0][1]
+	for (x0, y0), (x1, y1) in zip(points, points[1:]):
+		if x <= x1:
+			return y0 if x1 == x0 else y0 + (y1-y0)*(x-x0)/(x1-x0)
+	return points[-1][1]
+
+
+# Lookup table of the cut depth for each shade level, plus a final entry for masked pixels.
+# cutRange is the maximum cut depth (depth - minimum depth), shift the Black/White
+# distribution in percent, gamma and curve reshape the normalized shade before shifting.
+# Images with more than depthLevels shade levels are quantized to depthLevels depths.
+def buildDepthLut(cutRange: float, shift: float = 0, gamma: float = 1.0, curve: list = None, levels: int = 256, depthLevels: int = 0) -> list:
+	maxValue = levels-1
+	steps = depthLevels-1 if 1 < depthLevels < levels else 0
+	lut = []
+	for e in range(levels):
+		value = e/maxValue
+		if curve:
+			value = applyToneCurve(curve, value)
+		if gamma != 1.0:
+			value = value**gamma
+		shiftCorrection = max(min(maxValue, value*maxValue + shift*0.01*maxValue), 0)
+		if steps:
+			lut.append(round(cutRange*round(shiftCorrection/maxValue*steps)/steps, DEPTH_DIGITS))
+		else:
+			lut.append(round(cutRange/maxValue*shiftCorrection, DEPTH_DIGITS))
+	# Masked pixels, see applyMask
+	lut.append(0.0)
+	return lut
+
+
+# Group pixel indices by cut depth, pixels that are not cut are skipped
+def groupByDepth(pixels, lut: list) -> dict:
+	groups = {}
+	for pixelIndex, shade in enumerate(pixels):
+		depth = lut[shade]
+		if depth > 0:
+			groups.setdefault(depth, []).append(pixelIndex)
+	return groups
+
+
+
+# Pixels with the shade levels replaced by maskedShade where mask (0-255) is below half,
+# maskedShade is the number of shade levels, whose depth lookup entry is never cut
+def applyMask(pixels, mask, maskedShade: int) -> list:
+	return [maskedShade if keep < 128 else shade for shade, keep in zip(pixels, mask)]
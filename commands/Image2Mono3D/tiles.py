@@ -0,0 +1,39 @@
+# Tile deduplication of depth maps.
+# The image is split into square tiles. Tiles with identical cut depths are
+# modelled once and instanced at all their positions, so repetitive images
+# (logos, patterns, QR codes, uniform backgrounds) cost per unique tile
+# rather than per pixel.
+#
+# Coordinates follow the pixel convention of plan.py.
+
+TILE_SIZE = 8
+
+
+# Unique tiles of the depth map as a list of (runs, positions).
+# runs are the tileRuns of the tile, positions the (x, y) pixel coordinates of
+# all tile corners it occurs at. Tiles without any cut are skipped.
+def uniqueTiles(pixels, lut: list, width: int, height: int, tileSize: int = TILE_SIZE) -> list:
+	tiles = {}
+	for ty in range(0, height, tileSize):
+		rows = range(ty, min(ty+tileSize, height))
+		for tx in range(0, width, tileSize):
+			x1 = min(tx+tileSize, width)
+			tile = tuple(tuple(lut[shade] for shade in pixels[y*width+tx:y*width+x1]) for y in rows)
+			if any(any(row) for row in tile):
+				tiles.setdefault(tile, []).append((tx, ty))
+	return [(tileRuns(tile), positions) for tile, positions in tiles.items()]
+
+
+# Horizontal runs (x0, y, x1, depth) of equal cut depth within a tile, uncut pixels are skipped
+def tileRuns(tile: tuple) -> list:
+	runs = []
+	for y, row in enumerate(tile):
+		x = 0
+		while x < len(row):
+			end = x+1
+			while end < len(row) and row[end] == row[x]:
+				end += 1
+			if row[x] > 0:
+				runs.append((x, y, end, row[x]))
+			x = end
+	return runs
@@ -0,0 +1,66 @@
+import adsk.core, adsk.fusion
+
+# Per command session cache of the topology around the selected face.
+# The face's coEdges are collected once when the face is selected, edge end
+# points and directions once per edge, so selection filtering on hover is
+# mostly a dictionary lookup. The entityToken keys only speed up the lookup,
+# hits are confirmed by comparing the entities themselves and unknown edges
+# fall back to the coEdges of the edge. Edges not bounding the face are
+# cached as well, so hovering over the rest of the body stays cheap.
+class TopologyCache:
+	def __init__(self):
+		self.clear()
+
+	def clear(self):
+		self.face = None
+		self.coEdges = {}
+		self.foreignEdges = {}
+		self.endPoints = {}
+
+	# Cache the edges of face, nothing to do if face is cached already
+	def setFace(self, face: adsk.fusion.BRepFace):
+		if self.face is not None and self.face == face:
+			return
+		self.clear()
+		self.face = face
+		for loop in face.loops:
+			for coEdge in loop.coEdges:
+				self.coEdges.setdefault(coEdge.edge.entityToken, coEdge)
+
+	def hasEdge(self, edge: adsk.fusion.BRepEdge) -> bool:
+		return self.coEdge(edge) is not None
+
+	# CoEdge of edge on the cached face, None if edge does not bound it
+	def coEdge(self, edge: adsk.fusion.BRepEdge) -> adsk.fusion.BRepCoEdge:
+		token = edge.entityToken
+		coEdge = self.coEdges.get(token)
+		if coEdge is not None and coEdge.edge == edge:
+			return coEdge
+		foreignEdge = self.foreignEdges.get(token)
+		if foreignEdge is not None and foreignEdge == edge:
+			return None
+		for coEdge in edge.coEdges:
+			if coEdge.loop.face == self.face:
+				self.coEdges[token] = coEdge
+				return coEdge
+		self.foreignEdges[token] = edge
+		return None
+
+	# End points of edge, in the direction of its coEdge on the cached face
+	def edgeEndPoints(self, edge: adsk.fusion.BRepEdge) -> tuple:
+		token = edge.entityToken
+		cached = self.endPoints.get(token)
+		if cached is not None and cached[0] == edge:
+			points = cached[1]
+		else:
+			points = tuple(edge.evaluator.getEndPoints()[1:])
+			coEdge = self.coEdge(edge)
+			if coEdge is not None and coEdge.isOpposedToEdge:
+				points = points[::-1]
+			self.endPoints[token] = (edge, points)
+		return tuple(p.copy() for p in points)
+
+	# Vector from the start to the end point of edge
+	def direction(self, edge: adsk.fusion.BRepEdge) -> adsk.core.Vector3D:
+		start, end = self.edgeEndPoints(edge)
+		return start.vectorTo(end)
@@ -4,6 +4,7 @@
 # If you want to add an additional command, duplicate one of the existing directories and import it here.
 # You need to use aliases (import "entry" as "my_module") assuming you have the default module named "entry".
 
+import time
 from .Image2Mono3D import entry as Image2Mono3D
 
 # TODO add your imported modules to this list.
@@ -13,11 +14,17 @@ commands = [
 ]
 
 
+# Time each command's start function took at the last add-in start, for the startup report
+startTimes = {}
+
+
 # Assumes you defined a "start" function in each of your modules.
 # The start function will be run when the add-in is started.
 def start():
     for command in commands:
+        startTime = time.perf_counter()
         command.start()
+        startTimes[getattr(command, 'CMD_NAME', command.__name__)] = time.perf_counter() - startTime
 
 
 # Assumes you defined a "stop" function in each of your modules.
@@ -16,3 +16,31 @@ DEBUG = False
 # part of the ID to better ensure the ID is unique.
 ADDIN_NAME = os.path.basename(os.path.dirname(__file__))
 COMPANY_NAME = 'CY'
+
+# Folder and size limit (bytes) of the disk cache holding generated lithophane
+# bodies. Identical images and settings are re-imported from here instead of
+# being modelled again.
+CACHE_FOLDER = os.path.join(os.path.expanduser('~'), f'.{COMPANY_NAME}_{ADDIN_NAME}', 'cache')
+CACHE_MAX_BYTES = 512*1024*1024
+
+# Maximum number of pixels of a loaded image. Larger images are reduced while
+# decoding, so huge scans never have to fit into memory at full resolution.
+MAX_IMAGE_PIXELS = 4*1024*1024
+
+# Number of distinct cut depths, including uncut. 16 bit images are quantized to
+# it after the shade adjustments. Every depth costs one extrude (and one sketch
+# with the Regions engine) in sketch based parametric designs.
+DEPTH_LEVELS = 256
+
+# Memory (MB) a single lithophane run may use on top of what Fusion used when it
+# started. Above half of it partial results are merged early to free memory,
+# beyond it the run is aborted with a report instead of destabilizing Fusion.
+MEMORY_BUDGET_MB = 4096
+# Also report the peak Python heap per stage (tracemalloc). Slows modelling down
+# noticeably, it is always used when the process memory cannot be read.
+TRACE_PYTHON_MEMORY = False
+
+# Record the Fusion API calls of every lithophane run into a trace in
+# TRACE_FOLDER, for analysis with tools/replay.py. Slows modelling down a bit.
+RECORD_API_CALLS = False
+TRACE_FOLDER = os.path.join(os.path.expanduser('~'), f'.{COMPANY_NAME}_{ADDIN_NAME}', 'traces')
@@ -0,0 +1,22 @@
+import os, sys, types
+
+# The engines of the command are plain Python, importable as Image2Mono3D.<module>
+# without Fusion. Only entry.py needs the adsk modules.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'commands'))
+# Tools run as scripts, importable by their file name
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+# Modules importing Pillow from the bundled lib folder (from ...lib.PIL import Image) are
+# importable as addin.commands.Image2Mono3D.<module>, with an installed Pillow standing in
+# for the bundled one. The commands package is created bare, its __init__ needs Fusion.
+try:
+	import PIL.Image
+except ImportError:
+	PIL = None
+if PIL is not None:
+	for name, path in (('addin', ROOT), ('addin.commands', os.path.join(ROOT, 'commands')), ('addin.lib', None)):
+		package = types.ModuleType(name)
+		package.__path__ = [path] if path else []
+		sys.modules[name] = package
+	sys.modules['addin.lib.PIL'] = PIL
@@ -0,0 +1,68 @@
+import random
+import pytest
+from Image2Mono3D import autoplan, plan, shading
+
+LUT = shading.buildDepthLut(0.4)
+
+
+def gradient(width, height):
+	return [x*255//(width-1) for y in range(height) for x in range(width)]
+
+
+def realRegions(pixels, width, height):
+	return len(plan.createPlan(pixels, LUT, width, height, 0.5, 0.1, False))
+
+
+@pytest.mark.parametrize('width, height', [(40, 30), (300, 400)])
+def test_regionEstimateOfGradient(width, height):
+	pixels = gradient(width, height)
+	estimate = autoplan.estimateRegions(pixels, LUT, width, height)
+	assert estimate == pytest.approx(realRegions(pixels, width, height), rel=0.05)
+
+
+def test_regionEstimateIsExactOnSmallImages():
+	rng = random.Random(1)
+	width, height = 50, 40
+	pixels = [rng.choice((0, 60, 120, 255)) for _ in range(width*height)]
+	assert autoplan.estimateRegions(pixels, LUT, width, height) == realRegions(pixels, width, height)
+
+
+def test_regionsWinOnGradient():
+	choice = autoplan.chooseEngine(gradient(300, 400), LUT, 300, 400, autoplan.TEMPORARY_BODIES)
+	assert choice.engine == 'Regions'
+
+
+def test_pixelsWinOnIsolatedDots():
+	# Every cut pixel is a region of its own, planning them is wasted work
+	rng = random.Random(2)
+	width, height = 120, 120
+	pixels = [rng.randrange(1, 256) if x % 2 == 0 and y % 2 == 0 else 0 for y in range(height) for x in range(width)]
+	choice = autoplan.chooseEngine(pixels, LUT, width, height, autoplan.TEMPORARY_BODIES)
+	assert choice.statistics.regionsPerPixel == choice.statistics.cutFraction
+	assert choice.engine == 'Pixels'
+
+
+def test_tilesWinOnRepeatedPattern():
+	rng = random.Random(3)
+	tile = [rng.randrange(256) for _ in range(64)]
+	width, height = 256, 256
+	pixels = [tile[(y % 8)*8 + x % 8] for y in range(height) for x in range(width)]
+	choice = autoplan.chooseEngine(pixels, LUT, width, height, autoplan.TEMPORARY_BODIES)
+	assert choice.engine == 'Tiles'
+
+
+def test_sketchFeatures():
+	rng = random.Random(4)
+	width, height = 200, 200
+	noise = [rng.randrange(256) for _ in range(width*height)]
+	assert autoplan.chooseEngine(noise, LUT, width, height, autoplan.SKETCH_FEATURES).engine == 'Pixels'
+	assert autoplan.chooseEngine(gradient(width, height), LUT, width, height, autoplan.SKETCH_FEATURES).engine == 'Regions'
+
+
+def test_engineCosts():
+	statistics = autoplan.ImageStatistics(10000, 10000, 0.5, 4, 0.6, {8: (0.1, 0.01)})
+	costs = autoplan.engineCosts(statistics, autoplan.TEMPORARY_BODIES)
+	assert costs['Pixels'] == pytest.approx(5000*autoplan.BOX_COST)
+	assert costs['Regions'] == pytest.approx(10000*autoplan.PLAN_COST + 6000*autoplan.BOX_COST)
+	assert costs['Tiles 8'] == pytest.approx(1000*autoplan.BOX_COST + 100*(autoplan.INSTANCE_COST+autoplan.UNION_COST))
+	assert set(autoplan.engineCosts(statistics, autoplan.SKETCH_FEATURES)) == {'Pixels', 'Regions'}
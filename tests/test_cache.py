@@ -0,0 +1,62 @@
+import os
+from Image2Mono3D import cache
+
+
+def exporter(size):
+	def export(path):
+		with open(path, 'wb') as f:
+			f.write(b'x'*size)
+		return True
+	return export
+
+
+def test_keyDependsOnPixelsAndParameters():
+	key = cache.ResultCache.key(b'\x00\x01', {'depth': 0.3, 'engine': 'Auto'})
+	assert key == cache.ResultCache.key(b'\x00\x01', {'engine': 'Auto', 'depth': 0.3+1e-9})
+	assert key != cache.ResultCache.key(b'\x00\x02', {'depth': 0.3, 'engine': 'Auto'})
+	assert key != cache.ResultCache.key(b'\x00\x01', {'depth': 0.31, 'engine': 'Auto'})
+
+
+def test_storeLookupAndPersist(tmp_path):
+	resultCache = cache.ResultCache(str(tmp_path), 1000)
+	assert resultCache.lookup('a') is None
+	assert resultCache.store('a', exporter(10), 5.0)
+	path = resultCache.lookup('a')
+	assert path is not None and os.path.getsize(path) == 10
+	resultCache.recordHit('a', 1.0)
+
+	reopened = cache.ResultCache(str(tmp_path), 1000)
+	assert reopened.lookup('a') == path
+	stats = reopened.stats()
+	assert (stats['hits'], stats['misses'], stats['bytesSaved'], stats['entries'], stats['bytes']) == (1, 1, 10, 1, 10)
+	assert stats['timeSaved'] == 4.0
+
+
+def test_leastRecentlyUsedIsEvicted(tmp_path):
+	resultCache = cache.ResultCache(str(tmp_path), 25)
+	resultCache.store('a', exporter(10), 1.0)
+	resultCache.store('b', exporter(10), 1.0)
+	resultCache.entries['a']['lastAccess'] = resultCache.entries['b']['lastAccess']+1
+	assert resultCache.store('c', exporter(10), 1.0)
+	assert sorted(resultCache.entries) == ['a', 'c']
+	assert not os.path.exists(resultCache._path('b'))
+
+
+def test_oversizedBodyIsNotKept(tmp_path):
+	resultCache = cache.ResultCache(str(tmp_path), 5)
+	assert not resultCache.store('a', exporter(10), 1.0)
+	assert resultCache.lookup('a') is None
+
+
+def test_missingFileIsAMiss(tmp_path):
+	resultCache = cache.ResultCache(str(tmp_path), 1000)
+	resultCache.store('a', exporter(10), 1.0)
+	os.remove(resultCache._path('a'))
+	assert resultCache.lookup('a') is None
+	assert resultCache.stats()['entries'] == 0
+
+
+def test_failedExportIsNotStored(tmp_path):
+	resultCache = cache.ResultCache(str(tmp_path), 1000)
+	assert not resultCache.store('a', lambda path: False, 1.0)
+	assert resultCache.stats()['entries'] == 0
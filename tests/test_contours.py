@@ -0,0 +1,108 @@
+from Image2Mono3D import contours
+
+
+def mask(rows):
+	# Rows as strings from the top down, '#' is set
+	return bytes(1 if c == '#' else 0 for row in reversed(rows) for c in row), len(rows[0]), len(rows)
+
+
+def test_squareIsCounterClockwise():
+	data, width, height = mask([
+		'....',
+		'.##.',
+		'.##.',
+		'....',
+	])
+	polygons = contours.marchingSquares(data, width, height)
+	assert len(polygons) == 1
+	assert contours.signedArea(polygons[0]) > 0
+
+
+def test_holeIsClockwise():
+	data, width, height = mask([
+		'#####',
+		'#...#',
+		'#...#',
+		'#####',
+	])
+	polygons = contours.marchingSquares(data, width, height)
+	areas = sorted(contours.signedArea(polygon) for polygon in polygons)
+	assert len(areas) == 2
+	assert areas[0] < 0 < areas[1]
+	assert -areas[0] < areas[1]
+
+
+def test_separateRegions():
+	data, width, height = mask([
+		'#..#',
+		'....',
+		'#..#',
+	])
+	polygons = contours.marchingSquares(data, width, height)
+	assert len(polygons) == 4
+	assert all(contours.signedArea(polygon) > 0 for polygon in polygons)
+
+
+def test_pointsLieOnPixelBoundaries():
+	data, width, height = mask([
+		'.#',
+		'##',
+	])
+	for polygon in contours.marchingSquares(data, width, height):
+		for x, y in polygon:
+			assert 0 <= x <= width and 0 <= y <= height
+			assert (x*2) % 1 == 0 and (y*2) % 1 == 0
+
+
+def test_simplifyKeepsStraightRectangle():
+	data, width, height = mask([
+		'......',
+		'.####.',
+		'.####.',
+		'......',
+	])
+	polygon = contours.marchingSquares(data, width, height)[0]
+	simplified = contours.simplifyPolygon(polygon, 0.25)
+	assert len(simplified) < len(polygon)
+	assert contours.signedArea(simplified) > 0
+	assert abs(contours.signedArea(simplified)-contours.signedArea(polygon)) <= 1
+
+
+def test_layersAreCumulative():
+	lut = [0.0, 0.1, 0.2, 0.4]
+	layers = contours.layerIndices(bytes([0, 1, 2, 3]), lut, 0.1, 3)
+	assert list(layers) == [0, 1, 2, 3]
+	first = contours.layerContours(layers, 4, 1, 1)
+	last = contours.layerContours(layers, 4, 1, 3)
+	assert sum(contours.signedArea(p) for p in first) > sum(contours.signedArea(p) for p in last) > 0
+
+
+def test_islandInHoleIsCounterClockwise():
+	data, width, height = mask([
+		'#######',
+		'#.....#',
+		'#..#..#',
+		'#.....#',
+		'#######',
+	])
+	polygons = contours.marchingSquares(data, width, height)
+	orientations = sorted(contours.signedArea(polygon) > 0 for polygon in polygons)
+	assert orientations == [False, True, True]
+
+
+def test_regionsTouchingTheBorderAreClosed():
+	data, width, height = mask([
+		'###',
+		'###',
+	])
+	polygons = contours.marchingSquares(data, width, height)
+	assert len(polygons) == 1
+	xs = [x for x, _ in polygons[0]]
+	ys = [y for _, y in polygons[0]]
+	assert (min(xs), max(xs), min(ys), max(ys)) == (0, width, 0, height)
+
+
+def test_emptyLayerHasNoContours():
+	layers = contours.layerIndices(bytes([0, 1, 1, 0]), [0.0, 0.1], 0.1, 3)
+	assert contours.layerContours(layers, 2, 2, 2) == []
+	assert len(contours.layerContours(layers, 2, 2, 1)) == 1
@@ -0,0 +1,102 @@
+import tracemalloc
+import pytest
+from Image2Mono3D import governor
+
+MB = 1048576
+
+
+# Resident set size under control of the test, None pretends it cannot be read
+class FakeRss:
+	def __init__(self, rss):
+		self.rss = rss
+
+	def __call__(self):
+		return self.rss
+
+
+@pytest.fixture
+def rss(monkeypatch):
+	fake = FakeRss(100*MB)
+	monkeypatch.setattr(governor, 'residentSetSize', fake)
+	monkeypatch.setattr(governor, 'SAMPLE_SECONDS', 0)
+	return fake
+
+
+def test_usageIsGrowthSinceStart(rss):
+	memoryGovernor = governor.MemoryGovernor(50*MB)
+	rss.rss += 10*MB
+	assert memoryGovernor.sample() == 10*MB
+	rss.rss -= 20*MB
+	assert memoryGovernor.sample() == 0
+
+
+def test_softLimitMovesHalfwayToBudget(rss):
+	memoryGovernor = governor.MemoryGovernor(40*MB, softLimit=0.5)
+	rss.rss += 10*MB
+	assert not memoryGovernor.shouldRelease()
+	rss.rss += 10*MB
+	assert memoryGovernor.shouldRelease()
+	assert memoryGovernor.softLimit == 30*MB
+	# Memory the allocator keeps does not trigger another release
+	assert not memoryGovernor.shouldRelease()
+	rss.rss += 10*MB
+	assert memoryGovernor.shouldRelease()
+	assert memoryGovernor.flushes == 2
+
+
+def test_budgetExceededNamesStage(rss):
+	memoryGovernor = governor.MemoryGovernor(40*MB)
+	memoryGovernor.stage('modelling')
+	rss.rss += 41*MB
+	with pytest.raises(governor.MemoryBudgetExceeded, match='modelling'):
+		memoryGovernor.sample()
+
+
+def test_peaksPerStage(rss):
+	memoryGovernor = governor.MemoryGovernor(100*MB)
+	rss.rss += 30*MB
+	memoryGovernor.sample()
+	memoryGovernor.stage('modelling')
+	rss.rss -= 20*MB
+	memoryGovernor.sample()
+	assert memoryGovernor.peaks['setup'][0] == 30*MB
+	assert memoryGovernor.peaks['modelling'][0] == 30*MB
+	rss.rss -= 10*MB
+	memoryGovernor.stage('result')
+	assert memoryGovernor.peaks['result'][0] == 0
+	assert memoryGovernor.report().splitlines()[0] == 'setup: 30.0 MB process'
+
+
+def test_samplesAreThrottled(rss, monkeypatch):
+	monkeypatch.setattr(governor, 'SAMPLE_SECONDS', 3600)
+	memoryGovernor = governor.MemoryGovernor(100*MB)
+	rss.rss += 30*MB
+	assert memoryGovernor.sample() == 0
+	assert memoryGovernor.sample(force=True) == 30*MB
+
+
+def test_tracesPythonWithoutResidentSetSize(rss):
+	if tracemalloc.is_tracing():
+		pytest.skip('tracemalloc is already in use')
+	rss.rss = None
+	memoryGovernor = governor.MemoryGovernor(100*MB)
+	try:
+		assert memoryGovernor.tracePython and tracemalloc.is_tracing()
+		data = bytearray(MB)
+		assert memoryGovernor.sample() >= MB
+		del data
+	finally:
+		memoryGovernor.close()
+	assert not tracemalloc.is_tracing()
+
+
+def test_leavesForeignTracingRunning(rss):
+	if tracemalloc.is_tracing():
+		pytest.skip('tracemalloc is already in use')
+	tracemalloc.start()
+	try:
+		memoryGovernor = governor.MemoryGovernor(100*MB, tracePython=True)
+		memoryGovernor.close()
+		assert tracemalloc.is_tracing()
+	finally:
+		tracemalloc.stop()
@@ -0,0 +1,105 @@
+import struct, threading
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+from PIL import JpegImagePlugin
+loader = pytest.importorskip('addin.commands.Image2Mono3D.loader')
+
+
+def gradient(mode, size, scale=1):
+	image = Image.new(mode, size)
+	image.putdata([(x+y)*scale for y in range(size[1]) for x in range(size[0])])
+	return image
+
+
+# Mean shade of an 8 bit image, area averaging preserves it for whole blocks
+def mean(image):
+	return sum(shade*count for shade, count in enumerate(image.histogram()))/(image.size[0]*image.size[1])
+
+
+def test_rawStripsAreReducedBandByBand(tmp_path, monkeypatch):
+	path = str(tmp_path/'gradient.pgm')
+	gradient('L', (40, 30), 2).save(path)
+	assert loader.openImage(path).tile[0][0] == 'raw'
+	# Several bands, the last one partial
+	monkeypatch.setattr(loader, 'BAND_PIXELS', 40*4*3)
+	image, alpha = loader.loadImage(path, 300)
+	assert image.mode == 'L' and image.size == (20, 15) == loader.reducedSize((40, 30), 300)
+	assert alpha is None
+	assert image.getpixel((0, 0)) == 2 and image.getpixel((19, 14)) == 134
+	assert mean(image) == pytest.approx(mean(gradient('L', (40, 30), 2)), abs=0.5)
+
+
+def test_rawTiffKeepsAlpha(tmp_path):
+	path = str(tmp_path/'transparent.tif')
+	image = Image.new('RGBA', (8, 8), (255, 255, 255, 255))
+	image.paste((0, 0, 0, 0), (0, 0, 8, 4))
+	image.save(path)
+	image, alpha = loader.loadImage(path, 16)
+	assert image.size == alpha.size == (4, 4)
+	assert alpha.getpixel((0, 0)) == 0 and alpha.getpixel((0, 3)) == 255
+	assert image.getpixel((0, 0)) == 0 and image.getpixel((0, 3)) == 255
+
+
+def test_jpegIsDraftDecoded(tmp_path, monkeypatch):
+	path = str(tmp_path/'photo.jpg')
+	Image.new('RGB', (256, 128), (200, 100, 50)).save(path, quality=95)
+	drafts = []
+	draft = JpegImagePlugin.JpegImageFile.draft
+	monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft', lambda self, mode, size: drafts.append((mode, size)) or draft(self, mode, size))
+	image, alpha = loader.loadImage(path, 2048)
+	assert drafts == [('L', (64, 32))]
+	assert image.mode == 'L' and image.size == (64, 32) and alpha is None
+	assert abs(mean(image)-Image.new('RGB', (1, 1), (200, 100, 50)).convert('L').getpixel((0, 0))) <= 2
+
+
+def test_sixteenBitKeepsPrecision(tmp_path):
+	path = str(tmp_path/'deep.png')
+	gradient('I;16', (16, 16), 1000).save(path)
+	image, _ = loader.loadImage(path, 1 << 20)
+	assert image.mode == 'I' and loader.shadeLevels(image) == 65536
+	assert image.getpixel((15, 15)) == 30000 and image.getpixel((1, 0)) == 1000
+
+
+def test_thirtyTwoBitIsClamped(tmp_path):
+	path = str(tmp_path/'wide.tif')
+	image = Image.new('I', (2, 1))
+	image.putdata([-5, 100000])
+	image.save(path)
+	image, _ = loader.loadImage(path, 1 << 20)
+	assert image.mode == 'I' and [image.getpixel((x, 0)) for x in range(2)] == [0, 65535]
+
+
+def test_sizeAndImageFromBackground(tmp_path):
+	path = str(tmp_path/'gradient.pgm')
+	gradient('L', (40, 30)).save(path)
+	imageLoad = loader.ImageLoad(path, 300)
+	assert imageLoad.size(5) == (20, 15)
+	assert imageLoad.result(5).size == (20, 15) and imageLoad.alpha(5) is None
+	assert imageLoad.exception() is None
+
+
+def test_sizeReadyNeverWaits(tmp_path):
+	path = str(tmp_path/'gradient.pgm')
+	gradient('L', (40, 30)).save(path)
+	# The worker is still busy with a previous image
+	release = threading.Event()
+	loader._executor.submit(release.wait, 5)
+	imageLoad = loader.ImageLoad(path, 300)
+	try:
+		assert not imageLoad.sizeReady()
+	finally:
+		release.set()
+	assert imageLoad.size(5) == (20, 15) and imageLoad.sizeReady()
+
+
+def test_failedLoadFailsAllStages(tmp_path):
+	path = str(tmp_path/'broken.png')
+	with open(path, 'wb') as f:
+		f.write(struct.pack('<4I', 1, 2, 3, 4))
+	imageLoad = loader.ImageLoad(path, 300)
+	with pytest.raises(Exception):
+		imageLoad.size(5)
+	with pytest.raises(Exception):
+		imageLoad.result(5)
+	assert imageLoad.exception() is not None
@@ -0,0 +1,98 @@
+import random, struct, zipfile
+import xml.etree.ElementTree as ElementTree
+from collections import Counter
+import pytest
+from Image2Mono3D import mesh, plan
+
+NAMESPACE = '{http://schemas.microsoft.com/3dmanufacturing/core/2015/02}'
+WIDTH, HEIGHT = 6, 5
+CM_PER_PIXEL = (0.1, 0.1)
+DEPTH, MIN_THICKNESS = 0.5, 0.1
+
+
+def lithophanePlan(isFlush, outlineThickness=0):
+	return plan.GeometryPlan(WIDTH, HEIGHT, DEPTH, MIN_THICKNESS, isFlush, outlineThickness=outlineThickness)
+
+
+def cutRows(seed=1):
+	rng = random.Random(seed)
+	rows = [[rng.choice((0.0, 0.1, 0.2, 0.4)) for _ in range(WIDTH)] for _ in range(HEIGHT)]
+	return rows, lambda: iter(rows)
+
+
+def readThreeMF(path):
+	with zipfile.ZipFile(path) as package:
+		model = ElementTree.fromstring(package.read('3D/3dmodel.model'))
+	vertices = [tuple(float(v.get(axis)) for axis in 'xyz') for v in model.iter(NAMESPACE+'vertex')]
+	triangles = [tuple(int(t.get(key)) for key in ('v1', 'v2', 'v3')) for t in model.iter(NAMESPACE+'triangle')]
+	return vertices, triangles
+
+
+# Volume enclosed by the triangles, by the divergence theorem
+def volume(vertices, triangles):
+	total = 0.0
+	for a, b, c in triangles:
+		(ax, ay, az), (bx, by, bz), (cx, cy, cz) = vertices[a], vertices[b], vertices[c]
+		total += ax*(by*cz-bz*cy) - ay*(bx*cz-bz*cx) + az*(bx*cy-by*cx)
+	return total/6
+
+
+@pytest.mark.parametrize('isFlush', [False, True])
+def test_threeMFIsClosedAndShared(tmp_path, isFlush):
+	rows, rowsCallable = cutRows()
+	path = str(tmp_path/'lithophane.3mf')
+	mesh.writeLithophane(path, rowsCallable, lithophanePlan(isFlush), CM_PER_PIXEL)
+	vertices, triangles = readThreeMF(path)
+
+	assert len(set(vertices)) == len(vertices)
+	# Every edge is used as often in one direction as in the other: closed, consistently oriented
+	# and free of T-junctions. Columns touching diagonally share an edge between four triangles.
+	edges = Counter((v[k], v[(k+1) % 3]) for v in triangles for k in range(3))
+	assert all(edges[(b, a)] == count for (a, b), count in edges.items())
+
+	pixelArea = CM_PER_PIXEL[0]*CM_PER_PIXEL[1]*mesh.MM_PER_CM**2
+	# The flush cavity keeps a rim of a third of the border pixels (minThickness/2 is wider)
+	xScale = [2/3 if isFlush and i in (0, WIDTH-1) else 1 for i in range(WIDTH)]
+	yScale = [2/3 if isFlush and j in (0, HEIGHT-1) else 1 for j in range(HEIGHT)]
+	cutVolume = sum(cut*xScale[i]*yScale[j] for j, row in enumerate(rows) for i, cut in enumerate(row))*mesh.MM_PER_CM*pixelArea
+	slabVolume = WIDTH*HEIGHT*DEPTH*mesh.MM_PER_CM*pixelArea
+	assert volume(vertices, triangles) == pytest.approx(slabVolume-cutVolume, rel=1e-4)
+
+
+def test_stlMatchesThreeMF(tmp_path):
+	_, rowsCallable = cutRows(2)
+	stlPath, threeMFPath = str(tmp_path/'lithophane.stl'), str(tmp_path/'lithophane.3mf')
+	mesh.writeLithophane(stlPath, rowsCallable, lithophanePlan(False), CM_PER_PIXEL)
+	mesh.writeLithophane(threeMFPath, rowsCallable, lithophanePlan(False), CM_PER_PIXEL)
+	with open(stlPath, 'rb') as f:
+		data = f.read()
+	count = struct.unpack_from('<I', data, 80)[0]
+	assert len(data) == 84 + count*mesh.StlWriter.TRIANGLE.size
+	assert count == len(readThreeMF(threeMFPath)[1])
+
+
+def test_outlineInsetShrinksCavity(tmp_path):
+	rows, rowsCallable = cutRows(3)
+	plain, inset = str(tmp_path/'plain.3mf'), str(tmp_path/'inset.3mf')
+	mesh.writeLithophane(plain, rowsCallable, lithophanePlan(True), CM_PER_PIXEL)
+	mesh.writeLithophane(inset, rowsCallable, lithophanePlan(True, 0.05), CM_PER_PIXEL)
+	assert volume(*readThreeMF(inset)) > volume(*readThreeMF(plain))
+
+
+def test_flushCavityStaysInsideSlab(tmp_path):
+	rows, rowsCallable = cutRows(4)
+	path = str(tmp_path/'flush.3mf')
+	mesh.writeLithophane(path, rowsCallable, lithophanePlan(True), CM_PER_PIXEL)
+	vertices, _ = readThreeMF(path)
+	right, top = WIDTH*CM_PER_PIXEL[0]*mesh.MM_PER_CM, HEIGHT*CM_PER_PIXEL[1]*mesh.MM_PER_CM
+	onSide = [v for v in vertices if min(abs(v[0]), abs(v[0]-right), abs(v[1]), abs(v[1]-top)) < 1e-9]
+	# Only the corners of the slab lie on its sides
+	assert len(onSide) == 8
+
+
+def test_vertexIndexSharesVertices():
+	vertexIndex = mesh.VertexIndex()
+	added = []
+	assert vertexIndex.indices([(0, 0, 0), (1, 0, 0), (0, 1, 0)], added) == [0, 1, 2]
+	assert vertexIndex.indices([(1, 0, 0), (1, 1, 0), (0, 1, 0)], added) == [1, 3, 2]
+	assert added == [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)]
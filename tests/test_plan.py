@@ -0,0 +1,78 @@
+import random
+import pytest
+from Image2Mono3D import plan
+
+LUT = [0.0, 0.1, 0.2, 0.35]
+
+
+def randomImage(width, height, seed=1):
+	rng = random.Random(seed)
+	return bytes(rng.choice((0, 0, 1, 2, 3)) for _ in range(width*height))
+
+
+# Cut depth of every pixel, painted from the regions of geometryPlan
+def paint(geometryPlan):
+	width = geometryPlan.imageWidth
+	cuts = [0.0]*(width*geometryPlan.imageHeight)
+	for x0, y0, x1, y1, depth in geometryPlan.regions():
+		for y in range(y0, y1):
+			for x in range(x0, x1):
+				assert cuts[y*width+x] == 0.0, 'regions overlap'
+				cuts[y*width+x] = depth
+	return cuts
+
+
+@pytest.mark.parametrize('width, height', [(1, 1), (7, 5), (16, 9)])
+def test_regionsReproduceDepthMap(width, height):
+	pixels = randomImage(width, height)
+	geometryPlan = plan.createPlan(pixels, LUT, width, height, 1.0, 0.2, False)
+	assert paint(geometryPlan) == [LUT[shade] for shade in pixels]
+	assert geometryPlan.pixelCount() == sum(1 for shade in pixels if LUT[shade] > 0)
+
+
+def test_equalRunsAreMerged():
+	pixels = bytes([1, 1, 2, 0]*3)
+	geometryPlan = plan.createPlan(pixels, LUT, 4, 3, 1.0, 0.2, False)
+	assert sorted(geometryPlan.regions()) == [(0, 0, 2, 3, 0.1), (2, 0, 3, 3, 0.2)]
+	assert list(geometryPlan.byDepth()) == [0.1, 0.2]
+
+
+def test_planFromRowsMatchesPlan():
+	pixels = randomImage(9, 6)
+	rows = (pixels[y*9:(y+1)*9] for y in range(6))
+	assert plan.createPlanFromRows(rows, LUT, 9, 6, 1.0, 0.2, True) == plan.createPlan(pixels, LUT, 9, 6, 1.0, 0.2, True)
+
+
+def test_serializeRoundTrip(tmp_path):
+	slabs = [(0, 0, 4, 7), (6, 2, 11, 5)]
+	geometryPlan = plan.createPlan(randomImage(11, 7), LUT, 11, 7, 1.25, 0.3, True, slabs, 0.05)
+	copy = plan.GeometryPlan.deserialize(geometryPlan.serialize())
+	assert copy == geometryPlan
+	assert (copy.imageWidth, copy.imageHeight, copy.depth, copy.minThickness, copy.isFlush, copy.outlineThickness) == (11, 7, 1.25, 0.3, True, 0.05)
+	assert list(copy.regions()) == list(geometryPlan.regions())
+	assert copy.slabs() == slabs and not copy.fillsImage()
+
+	path = str(tmp_path/'lithophane.plan')
+	geometryPlan.save(path)
+	assert plan.GeometryPlan.load(path) == geometryPlan
+
+
+def test_deserializeRejectsOtherVersions():
+	data = bytearray(plan.createPlan(bytes([1]), LUT, 1, 1, 1.0, 0.2, False).serialize())
+	data[8] += 1
+	with pytest.raises(ValueError):
+		plan.GeometryPlan.deserialize(bytes(data))
+	with pytest.raises(ValueError):
+		plan.GeometryPlan.deserialize(b'NOTAPLAN' + bytes(data[8:]))
+
+
+def test_slabOperations():
+	assert plan.GeometryPlan(4, 3, 1.0, 0.2, False).slabs() == []
+	full = plan.GeometryPlan(4, 3, 1.0, 0.2, False, [(0, 0, 4, 3)])
+	assert full.fillsImage() and full != plan.GeometryPlan(4, 3, 1.0, 0.2, False)
+	assert plan.GeometryPlan(4, 3, 1.0, 0.2, True, outlineThickness=0.1) != plan.GeometryPlan(4, 3, 1.0, 0.2, True)
+
+
+def test_cutTop():
+	assert plan.GeometryPlan(1, 1, 1.0, 0.2, False).cutTop(0.3) == 0
+	assert plan.GeometryPlan(1, 1, 1.0, 0.2, True).cutTop(0.3) == pytest.approx(0.6)
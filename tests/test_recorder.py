@@ -0,0 +1,100 @@
+import os
+import pytest
+import replay
+from Image2Mono3D import recorder
+
+
+class Manager:
+	def __init__(self):
+		self.received = []
+		self.mode = None
+
+	def copy(self, body):
+		self.received.append(body)
+		return [body]*3
+
+
+class Body:
+	count = 4
+
+
+def record(tmp_path):
+	trace = recorder.start(str(tmp_path))
+	manager = recorder.wrap(trace, Manager(), 'TemporaryBRepManager')
+	body = recorder.wrap(trace, Body(), 'Body')
+	assert manager.copy(body) == [body._target]*3
+	manager.mode = 2.5
+	recorder.stop(trace)
+	return trace, manager
+
+
+def test_wrapWithoutTraceReturnsTarget():
+	target = Manager()
+	assert recorder.wrap(None, target, 'Manager') is target
+	assert recorder.wrap(None, None, 'Manager') is None
+	recorder.stop(None)
+
+
+def test_callsAreRecordedAndReadBack(tmp_path):
+	trace, manager = record(tmp_path)
+	# Proxies pass their targets on, never themselves
+	assert isinstance(manager._target.received[0], Body) and manager._target.mode == 2.5
+	header, records = replay.readTrace(trace.path)
+	assert header['version'] == recorder.TRACE_VERSION and trace.calls == 2
+	assert [(call, arguments, result) for _, call, _, _, arguments, result in records] == [
+		('TemporaryBRepManager.copy', 'Body[4]', 'list[3]'),
+		('TemporaryBRepManager.mode=', '2.5', '-'),
+	]
+
+
+def test_runsNeverShareATrace(tmp_path):
+	first, second = recorder.start(str(tmp_path)), recorder.start(str(tmp_path))
+	try:
+		assert first.path != second.path
+	finally:
+		recorder.stop(first)
+		recorder.stop(second)
+	assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(trace.path) for trace in (first, second))
+
+
+@pytest.mark.parametrize('value', [None, True, 3, 0.25, 'text', [1, 2], (1,), Body()])
+def test_parseValueInvertsShape(value):
+	parsed = replay.parseValue(recorder._shape(value))
+	if value is None or isinstance(value, (bool, int, float)):
+		assert parsed == value
+	elif isinstance(value, Body):
+		assert repr(parsed) == 'Body[4]'
+	else:
+		assert parsed.typeName == type(value).__name__ and len(parsed) == len(value)
+
+
+# Stand-in of the recorded manager, assignments only run on properties the class defines
+class StandIn:
+	mode = None
+
+	def __init__(self):
+		self.calls = []
+
+	def copy(self, body):
+		self.calls.append(body)
+
+
+def test_replayDispatchesToStandIns(tmp_path):
+	trace, _ = record(tmp_path)
+	_, records = replay.readTrace(trace.path)
+	standIn = StandIn()
+	api = replay.StandInApi(standIns={'TemporaryBRepManager': standIn})
+	stacks, calls = replay.replay(records, api)
+	assert api.dispatched == 2 and standIn.mode == 2.5
+	assert repr(standIn.calls[0]) == 'Body[4]'
+	assert set(calls) == {'TemporaryBRepManager.copy', 'TemporaryBRepManager.mode='}
+
+
+def test_unknownCallsTakeScaledRecordedTime():
+	records = [([], 'Sketch.add', 0.0, 0.5, '', '-'), (['execute'], 'Sketch.add', 1.0, 0.5, '', '-')]
+	stacks, calls = replay.replay(records, replay.StandInApi({'Sketch.add': 2.0}))
+	assert calls['Sketch.add'] == [1.0, 1.0]
+	# Time between the calls belongs to the Python code of the caller
+	assert stacks[('execute', '[python]')] == pytest.approx(0.5)
+	assert replay.formatFolded(stacks).splitlines() == ['Sketch.add 1000000', 'execute;Sketch.add 1000000', 'execute;[python] 500000']
+	assert replay.formatSvg(stacks, 'trace').count('<rect') == 5
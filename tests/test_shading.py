@@ -0,0 +1,48 @@
+import pytest
+from Image2Mono3D import shading
+
+
+def test_linearLut():
+	lut = shading.buildDepthLut(0.5)
+	assert len(lut) == 257
+	assert lut[0] == 0 and lut[255] == 0.5 and lut[256] == 0
+	assert all(a < b for a, b in zip(lut[:255], lut[1:255]))
+
+
+def test_shiftCollapsesClampedLevels():
+	lut = shading.buildDepthLut(1.0, shift=50)
+	assert lut[0] == pytest.approx(0.5)
+	assert len(set(lut[128:256])) == 1 and lut[255] == 1.0
+	assert len(set(lut[:256])) < 256
+
+
+def test_gammaAndCurve():
+	assert shading.buildDepthLut(1.0, gamma=2.0)[128] == pytest.approx((128/255)**2, abs=1e-6)
+	curve = shading.parseToneCurve('0:255, 255:0')
+	lut = shading.buildDepthLut(1.0, curve=curve)
+	assert lut[0] == 1.0 and lut[255] == 0
+
+
+def test_sixteenBitDepthsAreQuantized():
+	lut = shading.buildDepthLut(1.0, levels=65536, depthLevels=256)
+	assert len(lut) == 65537
+	assert len(set(lut[:65536])) == 256
+	assert lut[65535] == 1.0
+	# Eight bit lookup tables are not quantized further
+	assert shading.buildDepthLut(1.0, depthLevels=256) == shading.buildDepthLut(1.0)
+
+
+def test_parseToneCurve():
+	assert shading.parseToneCurve('255:255; 0:0') == [(0.0, 0.0), (1.0, 1.0)]
+	assert shading.parseToneCurve('') == []
+	for text in ('128:64', '0:0, 300:255', 'a:b', '0-0, 255-255'):
+		with pytest.raises(ValueError):
+			shading.parseToneCurve(text)
+
+
+def test_groupByDepthAndMask():
+	lut = [0.0, 0.1, 0.2, 0.0]
+	assert shading.groupByDepth(bytes([0, 1, 2, 1]), lut) == {0.1: [1, 3], 0.2: [2]}
+	masked = shading.applyMask(bytes([1, 2, 1]), bytes([255, 0, 200]), 3)
+	assert masked == [1, 3, 1]
+	assert shading.groupByDepth(masked, lut) == {0.1: [0, 2]}
@@ -0,0 +1,41 @@
+import random
+import pytest
+from Image2Mono3D import tiles
+
+LUT = [0.0, 0.1, 0.2]
+
+
+# Cut depth of every pixel, rebuilt from the runs of the unique tiles at all their positions
+def rebuild(uniqueTiles, width, height):
+	cuts = [0.0]*(width*height)
+	for runs, positions in uniqueTiles:
+		for tx, ty in positions:
+			for x0, y, x1, depth in runs:
+				for x in range(tx+x0, tx+x1):
+					assert cuts[(ty+y)*width+x] == 0.0, 'tiles overlap'
+					cuts[(ty+y)*width+x] = depth
+	return cuts
+
+
+@pytest.mark.parametrize('width, height, tileSize', [(8, 8, 4), (13, 10, 4), (5, 3, 8), (17, 9, 8)])
+def test_tilesReproduceDepthMap(width, height, tileSize):
+	rng = random.Random(width*height)
+	pixels = bytes(rng.choice((0, 1, 2)) for _ in range(width*height))
+	uniqueTiles = tiles.uniqueTiles(pixels, LUT, width, height, tileSize)
+	assert rebuild(uniqueTiles, width, height) == [LUT[shade] for shade in pixels]
+
+
+def test_repeatedTileIsModelledOnce():
+	tile = [1, 2, 0, 1]
+	pixels = bytes(tile[(x % 2) + 2*(y % 2)] for y in range(8) for x in range(8))
+	uniqueTiles = tiles.uniqueTiles(pixels, LUT, 8, 8, 2)
+	assert len(uniqueTiles) == 1
+	runs, positions = uniqueTiles[0]
+	assert sorted(positions) == [(x, y) for x in range(0, 8, 2) for y in range(0, 8, 2)]
+	assert runs == [(0, 0, 1, 0.1), (1, 0, 2, 0.2), (1, 1, 2, 0.1)]
+
+
+def test_uncutTilesAreSkipped():
+	pixels = bytes([0]*16 + [1]*16)
+	uniqueTiles = tiles.uniqueTiles(pixels, LUT, 4, 8, 4)
+	assert [positions for _, positions in uniqueTiles] == [[(0, 4)]]
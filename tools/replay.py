@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# Offline replay of Fusion API call traces recorded by commands/Image2Mono3D/recorder.py.
+# Runs without Fusion on any machine with Python 3:
+#
+#   python3 tools/replay.py trace-20240101-120000.tsv.gz --svg flame.svg --folded flame.folded
+#
+# The recorded calls are dispatched in order, with their parsed arguments, to
+# a stand-in API. --stand-in FILE loads it from a Python file with one class
+# per recorded object name, e.g. class TemporaryBRepManager with a method
+# booleanOperation(target, tool, operation). Calls it implements are run and
+# timed, all others take as long as the recorded call did. Arguments are
+# recorded by shape: numbers, booleans and None as is, everything else as
+# Shape of type name and size. --scale CALL=FACTOR multiplies the time of a
+# call, to estimate the effect of a faster implementation.
+# Time between two calls is accounted to the Python code of the caller as
+# [python]. The result is printed as call histogram and optionally written as
+# folded stacks (flamegraph.pl, speedscope) and as a self-contained SVG flame graph.
+
+import argparse, gzip, importlib.util, json, time, zlib
+from html import escape
+
+SVG_WIDTH = 1200
+FRAME_HEIGHT = 16
+
+
+# Header and records (stack, call, start, duration, arguments, result) of a trace, times in seconds
+def readTrace(path: str):
+	with gzip.open(path, 'rt', encoding='utf-8') as f:
+		header = json.loads(f.readline())
+		records = []
+		for line in f:
+			stack, call, start, duration, arguments, result = line.rstrip('\n').split('\t')
+			records.append((stack.split(';') if stack else [], call, int(start)/1e6, int(duration)/1e6, arguments, result))
+	return header, records
+
+
+# Recorded shape of an argument that is not a number, e.g. list[12] or BRepBody
+class Shape:
+	def __init__(self, typeName: str, size: int = None):
+		self.typeName = typeName
+		self.size = size
+
+	def __len__(self) -> int:
+		return self.size or 0
+
+	def __repr__(self) -> str:
+		return self.typeName if self.size is None else f'{self.typeName}[{self.size}]'
+
+
+# Value of a recorded argument or result, the inverse of recorder._shape as far as recorded
+def parseValue(text: str):
+	if text == '-':
+		return None
+	if text in ('True', 'False'):
+		return text == 'True'
+	for number in (int, float):
+		try:
+			return number(text)
+		except ValueError:
+			pass
+	typeName, _, size = text.partition('[')
+	return Shape(typeName, int(size[:-1]) if size else None)
+
+
+def parseArguments(arguments: str) -> list:
+	return [parseValue(argument) for argument in arguments.split(',')] if arguments else []
+
+
+# Stand-in for the Fusion API, dispatches every recorded call and returns the time it takes.
+# standIns maps recorded object names to objects implementing some of their calls.
+class StandInApi:
+	def __init__(self, scales: dict = None, standIns: dict = None):
+		self.scales = scales or {}
+		self.standIns = standIns or {}
+		self.dispatched = 0
+
+	def call(self, call: str, duration: float, arguments: str, result: str) -> float:
+		name, _, method = call.partition('.')
+		standIn = self.standIns.get(name)
+		args = parseArguments(arguments)
+		scale = self.scales.get(call, 1.0)
+		if method.endswith('='):
+			# Property assignments run on stand-ins that define the property
+			attribute = method[:-1]
+			if standIn is None or not hasattr(type(standIn), attribute):
+				return duration*scale
+			start = time.perf_counter()
+			setattr(standIn, attribute, args[0] if args else None)
+		else:
+			function = getattr(standIn, method, None)
+			if not callable(function):
+				return duration*scale
+			start = time.perf_counter()
+			function(*args)
+		self.dispatched += 1
+		return (time.perf_counter()-start)*scale
+
+
+# Instances of the classes defined in the Python file path, by class name
+def loadStandIns(path: str) -> dict:
+	spec = importlib.util.spec_from_file_location('standins', path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return {name: value() for name, value in vars(module).items() if isinstance(value, type) and value.__module__ == module.__name__}
+
+
+# Replay records against api, returns the weight in seconds of every stack (tuple of frame names)
+def replay(records: list, api: StandInApi) -> tuple:
+	stacks = {}
+	calls = {}
+	previousEnd = None
+	for stack, call, start, duration, arguments, result in records:
+		if previousEnd is not None and start > previousEnd:
+			key = tuple(stack)+('[python]',)
+			stacks[key] = stacks.get(key, 0.0) + start-previousEnd
+		cost = api.call(call, duration, arguments, result)
+		key = tuple(stack)+(call,)
+		stacks[key] = stacks.get(key, 0.0) + cost
+		calls.setdefault(call, []).append(cost)
+		previousEnd = start+duration
+	return stacks, calls
+
+
+def formatHistogram(calls: dict) -> str:
+	total = sum(sum(costs) for costs in calls.values()) or 1.0
+	lines = [f'{"Call":<48} {"Count":>8} {"Total ms":>10} {"Mean ms":>9} {"P50 ms":>8} {"P95 ms":>8} {"Max ms":>8} {"Share":>6}']
+	for call, costs in sorted(calls.items(), key=lambda item: -sum(item[1])):
+		ordered = sorted(costs)
+		lines.append(f'{call:<48} {len(costs):>8} {sum(costs)*1e3:>10.1f} {sum(costs)/len(costs)*1e3:>9.3f} {ordered[len(ordered)//2]*1e3:>8.3f} {ordered[min(len(ordered)-1, int(len(ordered)*0.95))]*1e3:>8.3f} {ordered[-1]*1e3:>8.3f} {sum(costs)/total:>6.1%}')
+	return '\n'.join(lines)
+
+
+# Folded stacks, one 'frame;frame;frame microseconds' line per stack
+def formatFolded(stacks: dict) -> str:
+	return ''.join(f'{";".join(stack)} {int(weight*1e6)}\n' for stack, weight in sorted(stacks.items()) if weight > 0)
+
+
+# Flame graph of stacks as SVG, the root spans the full width
+def formatSvg(stacks: dict, title: str) -> str:
+	root = {'name': 'all', 'weight': 0.0, 'children': {}}
+	for stack, weight in stacks.items():
+		node = root
+		node['weight'] += weight
+		for name in stack:
+			node = node['children'].setdefault(name, {'name': name, 'weight': 0.0, 'children': {}})
+			node['weight'] += weight
+
+	rects = []
+	def layout(node, x: float, level: int):
+		width = node['weight']/root['weight']*SVG_WIDTH if root['weight'] else 0
+		if width < 0.5:
+			return
+		rects.append((node['name'], node['weight'], x, level, width))
+		for child in sorted(node['children'].values(), key=lambda child: child['name']):
+			layout(child, x, level+1)
+			x += child['weight']/root['weight']*SVG_WIDTH
+	layout(root, 0.0, 0)
+
+	depth = max((level for _, _, _, level, _ in rects), default=0)+1
+	height = (depth+2)*FRAME_HEIGHT
+	svg = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{height}" font-family="monospace" font-size="11">',
+		f'<text x="4" y="{FRAME_HEIGHT-4}">{escape(title)}</text>']
+	for name, weight, x, level, width in rects:
+		y = height-(level+1)*FRAME_HEIGHT
+		hue = zlib.crc32(name.encode()) % 60
+		label = name if len(name)*7 < width-4 else name[:max(0, int((width-4)/7)-2)]+'..' if width > 24 else ''
+		svg.append(f'<g><title>{escape(name)} ({weight*1e3:.1f} ms, {weight/root["weight"]:.1%})</title>'
+			f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FRAME_HEIGHT-1}" fill="hsl({hue},80%,60%)"/>'
+			f'<text x="{x+2:.1f}" y="{y+FRAME_HEIGHT-4}">{escape(label)}</text></g>')
+	svg.append('</svg>\n')
+	return '\n'.join(svg)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Replay an Image2Mono3D API call trace.')
+	parser.add_argument('trace')
+	parser.add_argument('--folded', help='write folded stacks to this file')
+	parser.add_argument('--svg', help='write a flame graph to this file')
+	parser.add_argument('--scale', action='append', default=[], metavar='CALL=FACTOR', help='let the stand-in take FACTOR times the recorded time for CALL, e.g. TemporaryBRepManager.booleanOperation=0.5')
+	parser.add_argument('--stand-in', dest='standIn', metavar='FILE', help='Python file with stand-in classes named after the recorded objects, whose methods are run instead of the recorded times')
+	args = parser.parse_args()
+
+	scales = {}
+	for item in args.scale:
+		call, factor = item.rsplit('=', 1)
+		scales[call] = float(factor)
+
+	header, records = readTrace(args.trace)
+	api = StandInApi(scales, loadStandIns(args.standIn) if args.standIn else None)
+	stacks, calls = replay(records, api)
+	print(f'{args.trace}: {len(records)} calls, recorded {header.get("created", "")} on {header.get("platform", "unknown")}')
+	if args.standIn:
+		print(f'Stand-ins ran {api.dispatched} of {len(records)} calls')
+	print(f'Replayed time: {sum(stacks.values()):.2f}s, API {sum(sum(costs) for costs in calls.values()):.2f}s\n')
+	print(formatHistogram(calls))
+
+	if args.folded:
+		with open(args.folded, 'w') as f:
+			f.write(formatFolded(stacks))
+	if args.svg:
+		with open(args.svg, 'w') as f:
+			f.write(formatSvg(stacks, f'Image2Mono3D {args.trace}'))
+
+
+if __name__ == '__main__':
+	main()